@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from api.v1 import voice, deepseek, digital_manage, file_upload, register_api, login_api,document  # 导入新的路由
+from api.v1 import voice, deepseek, digital_manage, file_upload, register_api, login_api,document, admin  # 导入新的路由
 
 api_router = APIRouter()  # Global router
 
@@ -49,5 +49,11 @@ v1_router.include_router(
     tags=["Authentication"]
 )
 
+v1_router.include_router(
+    admin.router, 
+    prefix="/admin", 
+    tags=["Admin Diagnostics"]
+)
+
 # Include v1 router in the main API router
 api_router.include_router(v1_router, prefix="/api")
\ No newline at end of file
@@ -0,0 +1,77 @@
+import os
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from core.config import settings
+from utils.profiler import ProfilerBusy, current_session, profile_for, start_session
+
+router = APIRouter()
+
+
+def require_admin(x_admin_token: str = Header(None)):
+    """校验 X-Admin-Token；未配置 ADMIN_TOKEN 时诊断接口整体关闭"""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="需要管理员令牌")
+
+
+def _profile_response(session, output: str):
+    if output == "collapsed":
+        return PlainTextResponse(
+            session.collapsed(),
+            headers={"Content-Disposition": f"attachment; filename=profile-{os.getpid()}.collapsed"}
+        )
+    return session.result()
+
+
+# 功能：对当前 worker 采样 N 秒并返回结果
+# 查询参数：seconds: 采样时长
+#          interval_ms: 采样间隔
+#          allocations: 是否对比 tracemalloc 快照
+#          output: collapsed（火焰图输入）或 json（事件循环延迟、内存分配、事件循环热点栈）
+@router.post("/profile", dependencies=[Depends(require_admin)])
+async def profile(
+    seconds: float = Query(10, gt=0, description="采样时长（秒）"),
+    interval_ms: float = Query(10, ge=1, le=1000, description="采样间隔（毫秒）"),
+    allocations: bool = Query(False, description="记录内存分配增量"),
+    output: str = Query("collapsed", pattern="^(collapsed|json)$", description="collapsed 或 json")
+):
+    """
+    采样分析当前 worker，等待期间该 worker 照常处理其他请求
+    """
+    if seconds > settings.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"采样时长不能超过 {settings.PROFILE_MAX_SECONDS} 秒")
+    try:
+        session = await profile_for(seconds, interval_ms / 1000, allocations)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _profile_response(session, output)
+
+
+# 功能：开始不定长的分析会话，超过 PROFILE_MAX_SECONDS 自动停止
+@router.post("/profile/start", dependencies=[Depends(require_admin)])
+async def profile_start(
+    interval_ms: float = Query(10, ge=1, le=1000, description="采样间隔（毫秒）"),
+    allocations: bool = Query(False, description="记录内存分配增量")
+):
+    try:
+        start_session(interval_ms / 1000, allocations, settings.PROFILE_MAX_SECONDS)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # 采样线程正在写入结果，不能在这里调用 session.result()
+    return {"success": True, "pid": os.getpid(), "max_seconds": settings.PROFILE_MAX_SECONDS}
+
+
+# 功能：停止分析会话并返回结果（会话已自动停止时返回最后一次的结果）
+@router.post("/profile/stop", dependencies=[Depends(require_admin)])
+async def profile_stop(
+    output: str = Query("collapsed", pattern="^(collapsed|json)$", description="collapsed 或 json")
+):
+    session = current_session()
+    if session is None:
+        raise HTTPException(status_code=404, detail="没有分析会话")
+    session.stop()
+    return _profile_response(session, output)
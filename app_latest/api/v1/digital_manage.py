@@ -4,14 +4,13 @@ import json
 import time
 import logging
 import os
-import shutil
 from typing import Optional, Dict, Any
-from pathlib import Path
 
 # 导入数据库和模型
 from db.db_digital_manage import DatabaseManager, get_db
 from models.digital_manage import DigitalHuman, DigitalHumanCreate, DigitalHumanResponse, DigitalHumanList, DigitalHumanListResponse
 from services.digital_manage import digital_manage_service
+from services.storage import storage
 
 # 创建路由器
 router = APIRouter()
@@ -19,9 +18,8 @@ router = APIRouter()
 # 日志设置
 logger = logging.getLogger(__name__)
 
-# 路径设置
-AUDIO_DIR = Path("static/audio")
-AUDIO_DIR.mkdir(parents=True, exist_ok=True)
+# 存储键前缀
+AUDIO_PREFIX = "audio"
 
 # 临时存储
 LOCAL_TEMP_DATA = {}
@@ -171,8 +169,8 @@ async def update_digital_human(
     )
 
 # 辅助函数
-def copy_file_to_static(file_path, target_dir):
-    """复制文件到静态目录，返回访问URL"""
+def copy_file_to_static(file_path, target_prefix):
+    """复制文件到媒体存储，返回访问URL"""
     try:
         if not os.path.exists(file_path):
             logger.error(f"源文件不存在: {file_path}")
@@ -181,16 +179,14 @@ def copy_file_to_static(file_path, target_dir):
         # 生成唯一文件名
         file_name = os.path.basename(file_path)
         unique_filename = f"{int(time.time())}_{file_name}"
-        target_path = os.path.join(target_dir, unique_filename)
+        file_key = f"{target_prefix}/{unique_filename}"
         
-        # 复制文件
-        shutil.copy2(file_path, target_path)
+        # 流式复制到存储后端
+        with open(file_path, "rb") as f:
+            storage.save(file_key, f)
         
         # 返回URL路径
-        if str(target_dir).endswith("audio"):
-            return f"/static/audio/{unique_filename}"
-        else:
-            return f"/static/{unique_filename}"
+        return storage.url_for(file_key)
     except Exception as e:
         logger.error(f"复制文件失败: {e}", exc_info=True)
         return None
@@ -1,11 +1,14 @@
-from fastapi import APIRouter, File, UploadFile
+from fastapi import APIRouter, BackgroundTasks, File, UploadFile
 from fastapi.responses import JSONResponse
-import os
 import uuid
 import time
-from pathlib import Path
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
+
+from core.config import settings
+from services.storage import storage
+from services.waveform import precompute_peaks
+from utils.media_sniff import SNIFF_SIZE, MediaValidationError, sniff_media
 
 # 创建路由器
 router = APIRouter()
@@ -13,13 +16,91 @@ router = APIRouter()
 # 设置日志
 logger = logging.getLogger(__name__)
 
-# 设置上传目录
-AVATARS_DIR = Path("static/uploads/avatars")
-AUDIO_DIR = Path("static/audio")
+# 上传文件的存储键前缀
+AVATARS_PREFIX = "uploads/avatars"
+AUDIO_PREFIX = "audio"
+
+# 流式写入存储时的读取块大小
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+IMAGE_FORMAT_MESSAGE = "上传失败：文件格式不支持，仅支持JPG、PNG格式"
+AUDIO_FORMAT_MESSAGE = "上传失败：文件格式不支持，仅支持WAV、MP3格式"
+
+
+class UploadRejected(Exception):
+    """上传文件未通过校验"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def _rejected_response(e: UploadRejected) -> JSONResponse:
+    return JSONResponse(
+        status_code=e.status_code,
+        content={
+            "success": False,
+            "message": e.message
+        }
+    )
+
+
+async def _sniff_upload(file: UploadFile, kind: str, max_size: int, format_message: str) -> Tuple[Dict[str, Any], bytes]:
+    """
+    只读取文件头校验上传文件，不信任客户端提供的 content_type
+
+    Returns:
+        Tuple: (嗅探结果, 已读取的文件头)
+    """
+    file_size = file.size
+    if file_size is not None and file_size > max_size:
+        raise UploadRejected(413, f"上传失败：文件过大，最大支持{max_size // 1024 // 1024}MB")
+
+    header = await file.read(SNIFF_SIZE)
+    try:
+        info = sniff_media(header, file_size)
+    except MediaValidationError as e:
+        logger.warning(f"文件头校验失败: {file.filename}, {e}")
+        raise UploadRejected(400, format_message)
+
+    if info["kind"] != kind:
+        logger.warning(f"文件类型不匹配: {file.filename}, 实际为 {info['content_type']}")
+        raise UploadRejected(400, format_message)
+
+    duration = info.get("duration")
+    if kind == "audio" and duration and duration > settings.UPLOAD_MAX_AUDIO_DURATION:
+        raise UploadRejected(413, f"上传失败：音频时长超过{settings.UPLOAD_MAX_AUDIO_DURATION}秒")
+
+    return info, header
+
+
+async def _iter_upload(file: UploadFile, header: bytes, max_size: int, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """先返回已嗅探的文件头，再按块读取其余内容；超过大小限制时中止写入"""
+    received = len(header)
+    if header:
+        yield header
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        received += len(chunk)
+        if received > max_size:
+            raise UploadRejected(413, f"上传失败：文件过大，最大支持{max_size // 1024 // 1024}MB")
+        yield chunk
 
-# 确保目录存在
-AVATARS_DIR.mkdir(parents=True, exist_ok=True)
-AUDIO_DIR.mkdir(parents=True, exist_ok=True)
+
+async def _store_upload(file: UploadFile, kind: str, key_prefix: str, name_prefix: str, format_message: str) -> str:
+    """校验并保存上传文件，返回存储键"""
+    max_size = settings.UPLOAD_MAX_IMAGE_SIZE if kind == "image" else settings.UPLOAD_MAX_AUDIO_SIZE
+    info, header = await _sniff_upload(file, kind, max_size, format_message)
+
+    # 扩展名以实际文件格式为准
+    unique_filename = f"{name_prefix}{uuid.uuid4()}_{int(time.time())}{info['extension']}"
+    file_key = f"{key_prefix}/{unique_filename}"
+
+    await storage.put_stream(file_key, _iter_upload(file, header, max_size), info["content_type"])
+    return file_key
 
 # 文件上传
 # 功能：上传数字人头像
@@ -32,40 +113,21 @@ async def upload_image(file: UploadFile = File(...)):
     """
     logger.info(f"接收到图片上传: {file.filename}")
     
-    # 检查文件类型
-    allowed_types = ["image/jpeg", "image/png", "image/jpg"]
-    content_type = file.content_type
-    
-    if content_type not in allowed_types:
-        logger.warning(f"不支持的文件类型: {content_type}")
-        return JSONResponse(
-            status_code=400,
-            content={
-                "success": False,
-                "message": "上传失败：文件格式不支持，仅支持JPG、PNG格式"
-            }
-        )
-    
     try:
-        # 生成唯一文件名
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}_{int(time.time())}{file_extension}"
-        file_path = AVATARS_DIR / unique_filename
-        
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # 校验文件头并保存文件
+        file_key = await _store_upload(file, "image", AVATARS_PREFIX, "", IMAGE_FORMAT_MESSAGE)
         
         # 生成访问URL
-        image_url = f"/static/uploads/avatars/{unique_filename}"
-        logger.info(f"图片已保存: {file_path}, URL: {image_url}")
+        image_url = storage.url_for(file_key)
+        logger.info(f"图片已保存: {file_key}, URL: {image_url}")
         
         return {
             "success": True,
             "imageUrl": image_url,
             "message": "上传成功"
         }
+    except UploadRejected as e:
+        return _rejected_response(e)
     except Exception as e:
         logger.error(f"图片上传出错: {e}", exc_info=True)
         return JSONResponse(
@@ -88,40 +150,21 @@ async def upload_reference_audio(file: UploadFile = File(...)):
     """
     logger.info(f"接收到参考音频上传: {file.filename}")
     
-    # 检查文件类型
-    allowed_types = ["audio/wav", "audio/mpeg", "audio/mp3", "audio/x-wav"]
-    content_type = file.content_type
-    
-    if content_type not in allowed_types:
-        logger.warning(f"不支持的文件类型: {content_type}")
-        return JSONResponse(
-            status_code=400,
-            content={
-                "success": False,
-                "message": "上传失败：文件格式不支持，仅支持WAV、MP3格式"
-            }
-        )
-    
     try:
-        # 生成唯一文件名
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"ref_{uuid.uuid4()}_{int(time.time())}{file_extension}"
-        file_path = AUDIO_DIR / unique_filename
-        
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # 校验文件头并保存文件
+        file_key = await _store_upload(file, "audio", AUDIO_PREFIX, "ref_", AUDIO_FORMAT_MESSAGE)
         
         # 生成访问URL
-        audio_url = f"/static/audio/{unique_filename}"
-        logger.info(f"参考音频已保存: {file_path}, URL: {audio_url}")
+        audio_url = storage.url_for(file_key)
+        logger.info(f"参考音频已保存: {file_key}, URL: {audio_url}")
         
         return {
             "success": True,
             "audioUrl": audio_url,
             "message": "上传成功"
         }
+    except UploadRejected as e:
+        return _rejected_response(e)
     except Exception as e:
         logger.error(f"参考音频上传出错: {e}", exc_info=True)
         return JSONResponse(
@@ -144,40 +187,21 @@ async def upload_training_audio(file: UploadFile = File(...)):
     """
     logger.info(f"接收到训练音频上传: {file.filename}")
     
-    # 检查文件类型
-    allowed_types = ["audio/wav", "audio/mpeg", "audio/mp3", "audio/x-wav"]
-    content_type = file.content_type
-    
-    if content_type not in allowed_types:
-        logger.warning(f"不支持的文件类型: {content_type}")
-        return JSONResponse(
-            status_code=400,
-            content={
-                "success": False,
-                "message": "上传失败：文件格式不支持，仅支持WAV、MP3格式"
-            }
-        )
-    
     try:
-        # 生成唯一文件名
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"train_{uuid.uuid4()}_{int(time.time())}{file_extension}"
-        file_path = AUDIO_DIR / unique_filename
-        
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # 校验文件头并保存文件
+        file_key = await _store_upload(file, "audio", AUDIO_PREFIX, "train_", AUDIO_FORMAT_MESSAGE)
         
         # 生成访问URL
-        audio_url = f"/static/audio/{unique_filename}"
-        logger.info(f"训练音频已保存: {file_path}, URL: {audio_url}")
+        audio_url = storage.url_for(file_key)
+        logger.info(f"训练音频已保存: {file_key}, URL: {audio_url}")
         
         return {
             "success": True,
             "audioUrl": audio_url,
             "message": "上传成功"
         }
+    except UploadRejected as e:
+        return _rejected_response(e)
     except Exception as e:
         logger.error(f"训练音频上传出错: {e}", exc_info=True)
         return JSONResponse(
@@ -193,46 +217,29 @@ async def upload_training_audio(file: UploadFile = File(...)):
 # 文件类型：WAV/MP3
 # 返回：音频访问URL
 @router.post("/upload/recorded-audio")
-async def upload_recorded_audio(file: UploadFile = File(...)):
+async def upload_recorded_audio(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """
     处理录音音频上传
     """
     logger.info(f"接收到录音音频上传: {file.filename}")
     
-    # 检查文件类型
-    allowed_types = ["audio/wav", "audio/mpeg", "audio/mp3", "audio/x-wav"]
-    content_type = file.content_type
-    
-    if content_type not in allowed_types:
-        logger.warning(f"不支持的文件类型: {content_type}")
-        return JSONResponse(
-            status_code=400,
-            content={
-                "success": False,
-                "message": "上传失败：文件格式不支持，仅支持WAV、MP3格式"
-            }
-        )
-    
     try:
-        # 生成唯一文件名
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"record_{uuid.uuid4()}_{int(time.time())}{file_extension}"
-        file_path = AUDIO_DIR / unique_filename
-        
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # 校验文件头并保存文件
+        file_key = await _store_upload(file, "audio", AUDIO_PREFIX, "record_", AUDIO_FORMAT_MESSAGE)
+        # 响应返回后预计算波形峰值
+        background_tasks.add_task(precompute_peaks, file_key)
         
         # 生成访问URL
-        audio_url = f"/static/audio/{unique_filename}"
-        logger.info(f"录音音频已保存: {file_path}, URL: {audio_url}")
+        audio_url = storage.url_for(file_key)
+        logger.info(f"录音音频已保存: {file_key}, URL: {audio_url}")
         
         return {
             "success": True,
             "audioUrl": audio_url,
             "message": "上传成功"
         }
+    except UploadRejected as e:
+        return _rejected_response(e)
     except Exception as e:
         logger.error(f"录音音频上传出错: {e}", exc_info=True)
         return JSONResponse(
@@ -1,7 +1,10 @@
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException
+from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException, Query
 from schemas.voice import VoiceTrainRequest, VoiceTrainResponse, VoiceGenerateRequest, VoiceGenerateResponse
 from services.voice import voice_service
-from fastapi.responses import FileResponse  # 新增导入
+from services.storage import storage
+from services.waveform import get_or_create_peaks, precompute_peaks
+from utils.media_sniff import MediaValidationError
+from fastapi.responses import FileResponse, Response  # 新增导入
 from pathlib import Path  # 新增导入
 import os  # 新增导入
 import uuid  # 新增导入
@@ -30,16 +33,45 @@ async def train_custom_voice(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/generate/{digital_human_id}", response_model=VoiceGenerateResponse) 
-async def generate_voice_audio(request: VoiceGenerateRequest):
+async def generate_voice_audio(request: VoiceGenerateRequest, background_tasks: BackgroundTasks):
     try:
         result = await voice_service.generate_audio(
             audio_url=request.audio_url,
             id=request.dh_id,
             model_name="FunAudioLLM/CosyVoice2-0.5B"  # 添加默认模型名称
         )
+        # 响应返回后预计算波形峰值
+        file_key = storage.key_from_url(result["audio_url"])
+        if file_key:
+            background_tasks.add_task(precompute_peaks, file_key)
         return {
             "audio_url": result["audio_url"],
-            "duration": result.get("duration", 0)
+            "duration": result.get("duration", 0),
+            "sample_rate": result.get("sample_rate"),
+            "file_size": result.get("file_size")
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/waveform")
+async def get_waveform_peaks(audio_url: str = Query(..., description="音频访问URL")):
+    """
+    获取音频的波形峰值（audiowaveform JSON 格式，8位 min/max 交错）
+    """
+    file_key = storage.key_from_url(audio_url)
+    if not file_key:
+        raise HTTPException(status_code=400, detail="不支持的音频地址")
+    try:
+        data = await get_or_create_peaks(file_key)
+    except MediaValidationError as e:
+        raise HTTPException(status_code=415, detail=f"不是可解码的音频文件: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"波形计算失败: {str(e)}")
+    if data is None:
+        raise HTTPException(status_code=404, detail="音频文件不存在")
+    return Response(
+        content=data,
+        media_type="application/json",
+        headers={"Cache-Control": "public, max-age=86400"}
+    )
@@ -0,0 +1,302 @@
+"""
+语音识别基准测试
+
+逐个测量 VoiceService.transcribe_audio_file 各步骤（读取、解码、重采样、Vosk 识别）
+的耗时和 CPU 时间，计算实时率（RTF = 处理耗时 / 音频时长）、进程峰值内存，
+以及与参考文本对比的字错误率（CER）。修改音频预处理或 Vosk 参数前后各跑一次，
+用 --baseline 对比即可发现性能或准确率回退。
+
+    # 在 app_latest 目录下运行，默认使用 static/audio 下的 record_*.wav 和 train_*.mp3
+    python -m benchmarks.asr_bench --synthetic 60,300 --output asr_results.jsonl
+
+    # 与上一次结果对比，RTF 变慢超过10%或 CER 上升超过0.02时返回非零退出码
+    python -m benchmarks.asr_bench --baseline asr_results.jsonl
+
+参考文本保存在 --references 指定的 JSON 文件中（{"文件名": "文本"}）。
+--record-references 会把当前识别结果写入缺少参考文本的条目，人工校对后再作为基准使用。
+"""
+import argparse
+import asyncio
+import glob
+import io
+import json
+import math
+import os
+import resource
+import statistics
+import sys
+import time
+import unicodedata
+import wave
+from typing import Any, Dict, List, Optional, Tuple
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PATTERNS = [
+    os.path.join(APP_DIR, "static", "audio", "record_*.wav"),
+    os.path.join(APP_DIR, "static", "audio", "train_*.mp3"),
+]
+DEFAULT_REFERENCES = os.path.join(APP_DIR, "benchmarks", "asr_references.json")
+STAGES = ("read", "decode", "resample", "asr")
+
+
+class StageClock:
+    """记录一个步骤的耗时和 CPU 时间"""
+
+    def __init__(self):
+        self.wall = {}
+        self.cpu = {}
+
+    def measure(self, stage, func, *args):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = func(*args)
+        self.wall[stage] = time.perf_counter() - wall_start
+        self.cpu[stage] = time.process_time() - cpu_start
+        return result
+
+
+def peak_rss_mb() -> float:
+    """进程峰值常驻内存（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def normalize_text(text: str) -> str:
+    """去掉空白和标点，只比较文字本身"""
+    return "".join(
+        char for char in unicodedata.normalize("NFKC", text)
+        if not char.isspace() and not unicodedata.category(char).startswith("P")
+    )
+
+
+def edit_distance(reference: str, hypothesis: str) -> int:
+    """字符级编辑距离"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_char in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_char in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_char != hyp_char),
+            ))
+        previous = current
+    return previous[-1]
+
+
+def wav_duration(wav_content: bytes) -> float:
+    with wave.open(io.BytesIO(wav_content), "rb") as wf:
+        return wf.getnframes() / wf.getframerate()
+
+
+def concat_wavs(clips: List[bytes], target_seconds: float) -> bytes:
+    """循环拼接16kHz单声道WAV，直到达到目标时长"""
+    frames = []
+    total = 0.0
+    params = None
+    while total < target_seconds:
+        for clip in clips:
+            with wave.open(io.BytesIO(clip), "rb") as wf:
+                params = params or wf.getparams()
+                frames.append(wf.readframes(wf.getnframes()))
+                total += wf.getnframes() / wf.getframerate()
+            if total >= target_seconds:
+                break
+
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wf:
+        wf.setparams(params)
+        wf.writeframes(b"".join(frames))
+    return output.getvalue()
+
+
+def benchmark_clip(service, model, name: str, content: bytes, content_type: str,
+                   reference: Optional[str], repeat: int) -> Tuple[Dict[str, Any], bytes]:
+    """
+    对一段音频重复测量解码、重采样和识别，取各步骤耗时的中位数
+
+    Returns:
+        tuple: (结果, 16kHz单声道WAV)，结果包含时长、各步骤耗时/CPU时间、RTF、CER 和识别结果
+    """
+    runs = []
+    for _ in range(repeat):
+        clock = StageClock()
+        audio = clock.measure("decode", service._decode_audio, content, content_type)
+        wav_content = clock.measure("resample", service._resample_to_wav, audio)
+        hypothesis = clock.measure("asr", service._recognize, model, wav_content)
+        runs.append(clock)
+
+    duration = wav_duration(wav_content)
+    wall = {stage: statistics.median(run.wall[stage] for run in runs) for stage in runs[0].wall}
+    cpu = {stage: statistics.median(run.cpu[stage] for run in runs) for stage in runs[0].cpu}
+    processing = sum(wall.values())
+
+    result = {
+        "name": name,
+        "duration_seconds": round(duration, 3),
+        "wall_ms": {stage: round(value * 1000, 2) for stage, value in wall.items()},
+        "cpu_ms": {stage: round(value * 1000, 2) for stage, value in cpu.items()},
+        "rtf": round(processing / duration, 4) if duration else None,
+        "asr_rtf": round(wall["asr"] / duration, 4) if duration else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "hypothesis": hypothesis,
+        "cer": None,
+        "reference_chars": None,
+        "errors": None,
+    }
+    if reference:
+        ref, hyp = normalize_text(reference), normalize_text(hypothesis)
+        errors = edit_distance(ref, hyp)
+        result.update(cer=round(errors / len(ref), 4) if ref else None, reference_chars=len(ref), errors=errors)
+    return result, wav_content
+
+
+def summarize(clips: List[Dict[str, Any]], model_load_ms: float) -> Dict[str, Any]:
+    rtfs = sorted(clip["rtf"] for clip in clips if clip["rtf"] is not None)
+    scored = [clip for clip in clips if clip["cer"] is not None]
+    reference_chars = sum(clip["reference_chars"] for clip in scored)
+    total_audio = sum(clip["duration_seconds"] for clip in clips)
+
+    def stage_total(key, stage):
+        return round(sum(clip[key].get(stage, 0) for clip in clips), 2)
+
+    return {
+        "clips": len(clips),
+        "audio_seconds": round(total_audio, 3),
+        "model_load_ms": round(model_load_ms, 2),
+        "rtf_mean": round(statistics.mean(rtfs), 4) if rtfs else None,
+        "rtf_p95": rtfs[max(0, math.ceil(len(rtfs) * 0.95) - 1)] if rtfs else None,
+        "rtf_overall": round(
+            sum(clip["rtf"] * clip["duration_seconds"] for clip in clips if clip["rtf"]) / total_audio, 4
+        ) if total_audio else None,
+        "wall_ms": {stage: stage_total("wall_ms", stage) for stage in STAGES},
+        "cpu_ms": {stage: stage_total("cpu_ms", stage) for stage in STAGES},
+        "cer": round(sum(clip["errors"] for clip in scored) / reference_chars, 4) if reference_chars else None,
+        "cer_clips": len(scored),
+        "peak_rss_mb": max((clip["peak_rss_mb"] for clip in clips), default=peak_rss_mb()),
+    }
+
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    """读取基准结果，JSON Lines 文件取最后一行"""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    try:
+        return json.loads(lines[-1])
+    except json.JSONDecodeError:
+        return json.loads("\n".join(lines))
+
+
+def compare(summary: Dict[str, Any], baseline: Dict[str, Any], max_regression: float,
+            max_cer_increase: float) -> List[str]:
+    """返回回退项说明，为空表示通过"""
+    failures = []
+    previous = baseline["summary"]
+    for key in ("rtf_overall", "rtf_p95"):
+        if summary.get(key) and previous.get(key) and summary[key] > previous[key] * (1 + max_regression):
+            failures.append(f"{key} 从 {previous[key]} 变为 {summary[key]}（允许 +{max_regression:.0%}）")
+    if summary.get("cer") is not None and previous.get("cer") is not None \
+            and summary["cer"] > previous["cer"] + max_cer_increase:
+        failures.append(f"CER 从 {previous['cer']} 变为 {summary['cer']}（允许 +{max_cer_increase}）")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="语音识别耗时与准确率基准测试")
+    parser.add_argument("files", nargs="*", help="音频文件，默认 static/audio 下的 record_*.wav 和 train_*.mp3")
+    parser.add_argument("--synthetic", default="", help="额外生成的长音频时长（秒），逗号分隔，如 60,300")
+    parser.add_argument("--repeat", type=int, default=3, help="每段音频重复次数，取中位数")
+    parser.add_argument("--references", default=DEFAULT_REFERENCES, help="参考文本 JSON")
+    parser.add_argument("--record-references", action="store_true", help="把识别结果写入缺少参考文本的条目")
+    parser.add_argument("--end-to-end", action="store_true", help="额外测量完整的 transcribe_audio_file 调用")
+    parser.add_argument("--output", help="结果追加写入的 JSON Lines 文件")
+    parser.add_argument("--baseline", help="对比的基准结果文件")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="RTF 允许变慢的比例")
+    parser.add_argument("--max-cer-increase", type=float, default=0.02, help="CER 允许上升的绝对值")
+    args = parser.parse_args()
+
+    from services.storage import storage
+    from services.voice import voice_service
+
+    files = args.files or sorted(path for pattern in DEFAULT_PATTERNS for path in glob.glob(pattern))
+    if not files:
+        parser.error("没有找到音频文件")
+
+    # 先读取基准，避免 --output 与 --baseline 是同一个文件时和本次结果比较
+    baseline = load_baseline(args.baseline) if args.baseline else None
+
+    references = {}
+    if os.path.exists(args.references):
+        with open(args.references, "r", encoding="utf-8") as f:
+            references = json.load(f)
+
+    load_start = time.perf_counter()
+    model = voice_service._load_asr_model()
+    model_load_ms = (time.perf_counter() - load_start) * 1000
+
+    clips = []
+    converted = []
+    for path in files:
+        name = os.path.basename(path)
+        clock = StageClock()
+        with open(path, "rb") as f:
+            content = clock.measure("read", f.read)
+        content_type = voice_service._validate_audio_file(content)
+        result, wav_content = benchmark_clip(
+            voice_service, model, name, content, content_type, references.get(name), args.repeat
+        )
+        result["wall_ms"]["read"] = round(clock.wall["read"] * 1000, 2)
+        result["cpu_ms"]["read"] = round(clock.cpu["read"] * 1000, 2)
+        clips.append(result)
+        converted.append(wav_content)
+        print(f"{name}: {result['duration_seconds']}s, RTF {result['rtf']}, CER {result['cer']}", file=sys.stderr)
+
+    for seconds in [float(value) for value in args.synthetic.split(",") if value.strip()]:
+        name = f"synthetic_{seconds:g}s"
+        content = concat_wavs(converted, seconds)
+        result, _ = benchmark_clip(voice_service, model, name, content, "audio/wav", references.get(name), args.repeat)
+        clips.append(result)
+        print(f"{name}: {result['duration_seconds']}s, RTF {result['rtf']}, CER {result['cer']}", file=sys.stderr)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "repeat": args.repeat,
+        "summary": summarize(clips, model_load_ms),
+        "clips": clips,
+    }
+
+    if args.end_to_end:
+        # 走存储后端读取、每次重新加载模型的完整路径，与线上请求一致
+        timings = []
+        for path in files:
+            relative = os.path.relpath(os.path.abspath(path), os.path.join(APP_DIR, "static"))
+            start = time.perf_counter()
+            asyncio.run(voice_service.transcribe_audio_file(storage.url_for(relative.replace(os.sep, "/"))))
+            timings.append((time.perf_counter() - start) * 1000)
+        report["end_to_end_ms"] = {
+            "mean": round(statistics.mean(timings), 2),
+            "max": round(max(timings), 2),
+        }
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+    if args.record_references:
+        for clip in clips:
+            references.setdefault(clip["name"], clip["hypothesis"])
+        with open(args.references, "w", encoding="utf-8") as f:
+            json.dump(references, f, ensure_ascii=False, indent=2)
+
+    if baseline:
+        failures = compare(report["summary"], baseline, args.max_regression, args.max_cer_increase)
+        for failure in failures:
+            print(f"回退: {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
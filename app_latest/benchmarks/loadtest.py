@@ -0,0 +1,453 @@
+"""
+吞吐量与延迟压测
+
+启动替身外部服务（benchmarks.stub_services）、可选的本地 MySQL 容器和被测应用，
+写入一组种子数据后按比例混合发送请求，统计每个接口的 p50/p95/p99 延迟和吞吐量，
+结果以 JSON 输出，可追加到同一个文件中长期对比。
+
+    # 在 app_latest 目录下运行，使用 .env / 环境变量中的 MySQL
+    python -m benchmarks.loadtest --concurrency 16 --duration 60 --mix list=5,search=2,upload=2,generate=1
+
+    # 同时启动一个临时 MySQL 容器，结果追加到 bench_results.jsonl
+    python -m benchmarks.loadtest --mysql-docker --output bench_results.jsonl
+
+    # 压测已经在运行的实例（不启动应用，也不启动替身服务）
+    python -m benchmarks.loadtest --target http://127.0.0.1:8000 --no-stubs
+"""
+import argparse
+import asyncio
+import glob
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API = "/api/v1"
+DEFAULT_MIX = "list=5,search=2,get=2,upload=2,generate=1"
+DEFAULT_AUDIO_GLOB = os.path.join(APP_DIR, "static", "audio", "record_*.wav")
+MYSQL_CONTAINER = "ad-caregiver-bench-mysql"
+
+
+# ==================== #
+#       Statistics      #
+# ==================== #
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """最近秩法计算百分位数，输入需已排序"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+@dataclass
+class EndpointStats:
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    status_codes: Dict[str, int] = field(default_factory=dict)
+
+    def record(self, latency: float, status: str, ok: bool) -> None:
+        self.latencies.append(latency)
+        self.status_codes[status] = self.status_codes.get(status, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        values = sorted(self.latencies)
+        count = len(values)
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 2)
+
+        return {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0.0,
+            "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {
+                "p50": ms(percentile(values, 50)),
+                "p95": ms(percentile(values, 95)),
+                "p99": ms(percentile(values, 99)),
+                "mean": ms(sum(values) / count) if count else None,
+                "max": ms(values[-1]) if values else None,
+            },
+            "status_codes": dict(sorted(self.status_codes.items())),
+        }
+
+
+# ==================== #
+#       Scenarios       #
+# ==================== #
+
+@dataclass
+class SeedData:
+    """压测前创建的用户、数字人和录音"""
+    user_id: int
+    digital_human_ids: List[int]
+    record_urls: List[str]
+    audio_files: List[str]
+    search_terms: List[str]
+
+
+def _audio_upload(path: str):
+    with open(path, "rb") as f:
+        content = f.read()
+    content_type = "audio/wav" if path.endswith(".wav") else "audio/mpeg"
+    return {"file": (os.path.basename(path), content, content_type)}
+
+
+async def op_list(client: httpx.AsyncClient, seed: SeedData) -> httpx.Response:
+    return await client.get(f"{API}/digital/digital-humans/{seed.user_id}", params={"skip": 0, "limit": 10})
+
+
+async def op_search(client: httpx.AsyncClient, seed: SeedData) -> httpx.Response:
+    return await client.get(
+        f"{API}/digital/digital-humans/{seed.user_id}",
+        params={"skip": 0, "limit": 10, "search": random.choice(seed.search_terms)}
+    )
+
+
+async def op_get(client: httpx.AsyncClient, seed: SeedData) -> httpx.Response:
+    digital_human_id = random.choice(seed.digital_human_ids)
+    return await client.get(f"{API}/digital/digital-humans/{seed.user_id}/{digital_human_id}")
+
+
+async def op_upload(client: httpx.AsyncClient, seed: SeedData) -> httpx.Response:
+    return await client.post(f"{API}/files/upload/recorded-audio", files=_audio_upload(random.choice(seed.audio_files)))
+
+
+async def op_generate(client: httpx.AsyncClient, seed: SeedData) -> httpx.Response:
+    digital_human_id = random.choice(seed.digital_human_ids)
+    return await client.post(
+        f"{API}/voice/generate/{digital_human_id}",
+        json={"dh_id": str(digital_human_id), "audio_url": random.choice(seed.record_urls)}
+    )
+
+
+OPERATIONS: Dict[str, Callable] = {
+    "list": op_list,
+    "search": op_search,
+    "get": op_get,
+    "upload": op_upload,
+    "generate": op_generate,
+}
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """解析 "list=5,generate=1" 形式的请求比例"""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"未知的请求类型: {name}，可选 {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("请求比例不能全为0")
+    return mix
+
+
+def _check(response: httpx.Response, name: str) -> Dict[str, Any]:
+    if response.status_code >= 400:
+        raise RuntimeError(f"{name} 失败: {response.status_code} {response.text[:300]}")
+    data = response.json()
+    if isinstance(data, dict) and data.get("success") is False:
+        raise RuntimeError(f"{name} 失败: {data.get('message')}")
+    return data
+
+
+async def seed_data(client: httpx.AsyncClient, audio_files: List[str], digital_humans: int = 5) -> SeedData:
+    """创建压测用户、数字人（完成音色训练）和若干条录音"""
+    # 列表接口会在首次访问时建表
+    await client.get(f"{API}/digital/digital-humans/0")
+
+    suffix = uuid.uuid4().hex[:8]
+    user = _check(await client.post(f"{API}/auth/register", json={
+        "username": f"bench_{suffix}",
+        "password": "bench123",
+        "email": f"bench_{suffix}@example.com",
+        "phone": f"139{random.randint(0, 99999999):08d}",
+        "role": 0,
+    }), "注册用户")
+    user_id = int(user["data"]["id"])
+
+    reference = _check(await client.post(f"{API}/files/upload/reference-audio", files=_audio_upload(audio_files[0])), "上传参考音频")
+    search_terms = ["陪护", "奶奶", "爷爷", "bench"]
+    digital_human_ids = []
+    for index in range(digital_humans):
+        created = _check(await client.post(f"{API}/digital/digital-humans/", json={
+            "name": f"bench-{search_terms[index % len(search_terms)]}-{index}",
+            "user_id": user_id,
+            "description": "你是一位温和耐心的陪护助手，回答简短。",
+            "reference_audio_path": reference["audioUrl"],
+        }), "创建数字人")
+        digital_human_id = int(created["data"]["id"])
+        _check(await client.post(f"{API}/voice/train/{digital_human_id}", json={
+            "custom_name": f"bench-{digital_human_id}",
+            "text": "你好",
+            "audio_url": reference["audioUrl"],
+            "dh_id": str(digital_human_id),
+        }), "训练音色")
+        digital_human_ids.append(digital_human_id)
+
+    record_urls = []
+    for path in audio_files[:5]:
+        record = _check(await client.post(f"{API}/files/upload/recorded-audio", files=_audio_upload(path)), "上传录音")
+        record_urls.append(record["audioUrl"])
+
+    return SeedData(user_id, digital_human_ids, record_urls, audio_files, search_terms)
+
+
+async def run_load(base_url: str, seed: SeedData, mix: Dict[str, float], concurrency: int,
+                   duration: Optional[float], total_requests: Optional[int], timeout: float) -> Dict[str, Any]:
+    """
+    以固定并发循环发送请求，直到达到时长或请求总数
+
+    Returns:
+        dict: 每个接口和全部请求的统计
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    stats = {name: EndpointStats() for name in names}
+    overall = EndpointStats()
+    remaining = [total_requests] if total_requests else None
+    deadline = time.perf_counter() + duration if duration else None
+
+    def next_operation() -> Optional[str]:
+        if deadline and time.perf_counter() >= deadline:
+            return None
+        if remaining is not None:
+            if remaining[0] <= 0:
+                return None
+            remaining[0] -= 1
+        return random.choices(names, weights)[0]
+
+    async def worker(client: httpx.AsyncClient):
+        while True:
+            name = next_operation()
+            if name is None:
+                return
+            start = time.perf_counter()
+            try:
+                response = await OPERATIONS[name](client, seed)
+                status, ok = str(response.status_code), response.status_code < 400
+            except httpx.TimeoutException:
+                status, ok = "timeout", False
+            except httpx.HTTPError as e:
+                status, ok = type(e).__name__, False
+            latency = time.perf_counter() - start
+            stats[name].record(latency, status, ok)
+            overall.record(latency, status, ok)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "endpoints": {name: stats[name].summary(elapsed) for name in names},
+        "total": overall.summary(elapsed),
+    }
+
+
+# ==================== #
+#   Process management  #
+# ==================== #
+
+def _wait_http(url: str, timeout: float, process: Optional[subprocess.Popen] = None) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"进程已退出（返回码 {process.returncode}）: {' '.join(process.args)}")
+        try:
+            httpx.get(url, timeout=2)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.3)
+    raise RuntimeError(f"等待 {url} 就绪超时")
+
+
+def start_mysql_container(port: int, password: str, image: str, timeout: float = 120) -> None:
+    """启动临时 MySQL 容器并等待可连接，结束时由 stop_mysql_container 删除"""
+    import pymysql
+
+    subprocess.run(["docker", "rm", "-f", MYSQL_CONTAINER], capture_output=True)
+    subprocess.run([
+        "docker", "run", "-d", "--rm", "--name", MYSQL_CONTAINER,
+        "-e", f"MYSQL_ROOT_PASSWORD={password}",
+        "-p", f"{port}:3306", image,
+    ], check=True, capture_output=True)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            pymysql.connect(host="127.0.0.1", port=port, user="root", password=password).close()
+            return
+        except pymysql.MySQLError:
+            time.sleep(1)
+    raise RuntimeError("等待 MySQL 容器就绪超时")
+
+
+def stop_mysql_container() -> None:
+    subprocess.run(["docker", "rm", "-f", MYSQL_CONTAINER], capture_output=True)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="吞吐量与延迟压测")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发请求数")
+    parser.add_argument("--duration", type=float, default=30, help="压测时长（秒）")
+    parser.add_argument("--requests", type=int, help="请求总数，设置后忽略 --duration")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"请求比例，默认 {DEFAULT_MIX}")
+    parser.add_argument("--timeout", type=float, default=60, help="单个请求超时（秒）")
+    parser.add_argument("--audio", nargs="*", help=f"上传/识别用的音频，默认 {DEFAULT_AUDIO_GLOB}")
+    parser.add_argument("--output", help="结果追加写入的 JSON Lines 文件")
+    parser.add_argument("--label", help="写入结果的备注，便于区分不同配置")
+    parser.add_argument("--seed", type=int, help="随机种子")
+
+    target = parser.add_argument_group("被测应用")
+    target.add_argument("--target", help="已在运行的应用地址，设置后不启动应用")
+    target.add_argument("--app-port", type=int, default=8800)
+    target.add_argument("--workers", type=int, default=1, help="uvicorn worker 数")
+    target.add_argument("--tracing", default="none", help="应用的 TRACING_EXPORTER")
+
+    stubs = parser.add_argument_group("替身服务")
+    stubs.add_argument("--no-stubs", action="store_true", help="不启动替身服务，使用应用自身配置的外部接口")
+    stubs.add_argument("--stub-port", type=int, default=9100)
+    stubs.add_argument("--deepseek-latency", type=float, default=0.5)
+    stubs.add_argument("--tts-latency", type=float, default=1.0)
+    stubs.add_argument("--upload-latency", type=float, default=0.3)
+    stubs.add_argument("--jitter", type=float, default=0.1)
+    stubs.add_argument("--tts-seconds", type=float, default=5.0)
+    stubs.add_argument("--error-rate", type=float, default=0.0)
+
+    database = parser.add_argument_group("数据库")
+    database.add_argument("--mysql-docker", action="store_true", help="启动临时 MySQL 容器")
+    database.add_argument("--mysql-image", default="mysql:8.0")
+    database.add_argument("--mysql-port", type=int, default=3307)
+    database.add_argument("--mysql-password", default="bench")
+    database.add_argument("--db-name", default="app_db_bench", help="压测使用的数据库名，不存在时自动创建")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    audio_files = args.audio or sorted(glob.glob(DEFAULT_AUDIO_GLOB))
+    if not audio_files:
+        parser.error("没有找到压测音频，请通过 --audio 指定")
+
+    processes = []
+    env = dict(os.environ)
+    try:
+        if not args.no_stubs:
+            stub_url = f"http://127.0.0.1:{args.stub_port}/v1"
+            processes.append(subprocess.Popen([
+                sys.executable, "-m", "benchmarks.stub_services",
+                "--port", str(args.stub_port),
+                "--deepseek-latency", str(args.deepseek_latency),
+                "--tts-latency", str(args.tts_latency),
+                "--upload-latency", str(args.upload_latency),
+                "--jitter", str(args.jitter),
+                "--tts-seconds", str(args.tts_seconds),
+                "--error-rate", str(args.error_rate),
+            ], cwd=APP_DIR))
+            _wait_http(f"http://127.0.0.1:{args.stub_port}/docs", 30, processes[-1])
+            env.update({
+                "DEEPSEEK_API_URL": f"{stub_url}/chat/completions",
+                "TTS_BASE_URL": stub_url,
+            })
+
+        if args.mysql_docker:
+            start_mysql_container(args.mysql_port, args.mysql_password, args.mysql_image)
+            env.update({
+                "DB_HOST": "127.0.0.1",
+                "DB_PORT": str(args.mysql_port),
+                "DB_USER": "root",
+                "DB_PASSWORD": args.mysql_password,
+            })
+
+        if args.target:
+            base_url = args.target.rstrip("/")
+        else:
+            from core.config import settings
+            db_user = env.get("DB_USER", settings.DB_USER)
+            db_password = env.get("DB_PASSWORD", settings.DB_PASSWORD)
+            db_host = env.get("DB_HOST", settings.DB_HOST)
+            db_port = env.get("DB_PORT", str(settings.DB_PORT))
+            env.update({
+                "DB_NAME": args.db_name,
+                "DATABASE_URI": f"mysql+pymysql://{db_user}:{db_password}@{db_host}:{db_port}/{args.db_name}",
+                "TRACING_EXPORTER": args.tracing,
+            })
+            base_url = f"http://127.0.0.1:{args.app_port}"
+            processes.append(subprocess.Popen([
+                sys.executable, "-m", "uvicorn", "main:app",
+                "--port", str(args.app_port), "--workers", str(args.workers), "--log-level", "warning",
+            ], cwd=APP_DIR, env=env))
+            _wait_http(f"{base_url}{API}/digital/", 120, processes[-1])
+
+        async def run():
+            async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+                seed = await seed_data(client, audio_files)
+            return await run_load(
+                base_url, seed, mix, args.concurrency,
+                None if args.requests else args.duration, args.requests, args.timeout
+            )
+
+        result = asyncio.run(run())
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if args.mysql_docker:
+            stop_mysql_container()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git_commit(),
+        "label": args.label,
+        "config": {
+            "concurrency": args.concurrency,
+            "duration": None if args.requests else args.duration,
+            "requests": args.requests,
+            "mix": mix,
+            "workers": args.workers,
+            "stubs": None if args.no_stubs else {
+                "deepseek_latency": args.deepseek_latency,
+                "tts_latency": args.tts_latency,
+                "upload_latency": args.upload_latency,
+                "jitter": args.jitter,
+                "tts_seconds": args.tts_seconds,
+                "error_rate": args.error_rate,
+            },
+        },
+        **result,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+压测用的外部服务替身
+
+在本地模拟 DeepSeek 聊天接口和 SiliconFlow 的 TTS / 音色上传接口，延迟和返回内容
+可配置，压测时不消耗真实额度，结果也不受公网波动影响。
+
+    python -m benchmarks.stub_services --port 9100 --deepseek-latency 0.8 --tts-latency 1.5
+
+接口（base_url 为 http://127.0.0.1:9100/v1）：
+- POST /v1/chat/completions      DeepSeek 聊天补全
+- POST /v1/audio/speech          TTS，按块流式返回 MP3
+- POST /v1/uploads/audio/voice   音色上传，返回 uri
+"""
+import argparse
+import asyncio
+import random
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# MPEG-1 Layer III，128kbps，44.1kHz，无填充；每帧 417 字节、1152 个采样
+MP3_FRAME_HEADER = b"\xff\xfb\x90\x64"
+MP3_FRAME_SIZE = 417
+MP3_FRAME_SECONDS = 1152 / 44100
+
+
+def silent_mp3(seconds: float) -> bytes:
+    """生成指定时长的静音 MP3 数据（帧头合法，能被 media_sniff 识别出时长）"""
+    frames = max(1, int(seconds / MP3_FRAME_SECONDS))
+    frame = MP3_FRAME_HEADER + b"\x00" * (MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+    return frame * frames
+
+
+async def _sleep(latency: float, jitter: float) -> None:
+    delay = latency + random.uniform(-jitter, jitter) if jitter else latency
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+def create_app(deepseek_latency: float = 0.5, tts_latency: float = 1.0, upload_latency: float = 0.3,
+               jitter: float = 0.0, reply_text: str = "好的，我记住了。今天天气不错，出去走走吧。",
+               tts_seconds: float = 5.0, tts_chunks: int = 8, error_rate: float = 0.0) -> FastAPI:
+    """
+    创建替身服务
+
+    Args:
+        deepseek_latency: 聊天接口返回前的等待时间（秒）
+        tts_latency: TTS 首字节延迟，剩余数据按块匀速返回，总耗时约为该值的两倍
+        upload_latency: 音色上传接口延迟
+        jitter: 每次延迟在 ±jitter 范围内随机波动
+        reply_text: 聊天接口返回的回复
+        tts_seconds: 返回音频的时长
+        tts_chunks: TTS 响应分块数
+        error_rate: 以该概率返回 429，用于观察限流下的表现
+    """
+    app = FastAPI(title="benchmark stub services")
+    audio = silent_mp3(tts_seconds)
+    chunk_size = max(1, len(audio) // tts_chunks)
+
+    def should_fail() -> bool:
+        return error_rate > 0 and random.random() < error_rate
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        await _sleep(deepseek_latency, jitter)
+        if should_fail():
+            return _rate_limited()
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "model": payload.get("model", "deepseek-chat"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply_text},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    @app.post("/v1/audio/speech")
+    async def audio_speech(request: Request):
+        await request.body()
+        await _sleep(tts_latency, jitter)
+        if should_fail():
+            return _rate_limited()
+
+        async def stream():
+            interval = tts_latency / tts_chunks if tts_chunks else 0
+            for start in range(0, len(audio), chunk_size):
+                yield audio[start:start + chunk_size]
+                if interval:
+                    await asyncio.sleep(interval)
+
+        return StreamingResponse(stream(), media_type="audio/mpeg")
+
+    @app.post("/v1/uploads/audio/voice")
+    async def upload_voice(request: Request):
+        await request.body()
+        await _sleep(upload_latency, jitter)
+        if should_fail():
+            return _rate_limited()
+        return {"uri": f"speech:stub-voice:{uuid.uuid4().hex[:12]}"}
+
+    return app
+
+
+def _rate_limited():
+    return JSONResponse(status_code=429, content={"error": {"message": "rate limited (stub)"}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepSeek / SiliconFlow 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--deepseek-latency", type=float, default=0.5)
+    parser.add_argument("--tts-latency", type=float, default=1.0)
+    parser.add_argument("--upload-latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--tts-seconds", type=float, default=5.0, help="返回音频时长")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 429 的概率")
+    args = parser.parse_args()
+
+    app = create_app(
+        deepseek_latency=args.deepseek_latency,
+        tts_latency=args.tts_latency,
+        upload_latency=args.upload_latency,
+        jitter=args.jitter,
+        tts_seconds=args.tts_seconds,
+        error_rate=args.error_rate,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
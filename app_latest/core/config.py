@@ -41,6 +41,45 @@ class Settings(BaseSettings):
     DB_PORT: int = 3306
     DB_CHARSET: str = "utf8mb4"
 
+    # ==================== #
+    #  Static Media Config  #
+    # ==================== #
+    STATIC_IMMUTABLE_MAX_AGE: int = 60 * 60 * 24 * 365  # 1 year
+    STATIC_ZERO_COPY: bool = True  # 服务器支持时使用 sendfile 零拷贝
+
+    # ==================== #
+    #    Storage Config     #
+    # ==================== #
+    STORAGE_BACKEND: str = "local"  # local 或 s3
+    STORAGE_LOCAL_ROOT: str = "static"
+    STORAGE_LOCAL_URL_PREFIX: str = "/static"
+    S3_ENDPOINT_URL: Optional[str] = None  # 例如本地 MinIO: http://localhost:9000
+    S3_BUCKET: str = "ad-caregiver-media"
+    S3_ACCESS_KEY: Optional[str] = None
+    S3_SECRET_KEY: Optional[str] = None
+    S3_REGION: Optional[str] = None
+    S3_PUBLIC_URL: Optional[str] = None  # 未配置时使用预签名URL
+    S3_URL_EXPIRE_SECONDS: int = 3600
+
+    # ==================== #
+    #     Upload Config     #
+    # ==================== #
+    UPLOAD_MAX_IMAGE_SIZE: int = 10 * 1024 * 1024  # 10MB
+    UPLOAD_MAX_AUDIO_SIZE: int = 50 * 1024 * 1024  # 50MB
+    UPLOAD_MAX_AUDIO_DURATION: int = 600  # 秒
+
+    # ==================== #
+    #    Tracing Config     #
+    # ==================== #
+    TRACING_EXPORTER: str = "log"  # log（JSON日志）、otlp（发送到collector）或 none
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+
+    # ==================== #
+    #     Admin Config      #
+    # ==================== #
+    ADMIN_TOKEN: Optional[str] = None  # 未配置时关闭 /admin 诊断接口
+    PROFILE_MAX_SECONDS: int = 300
+
     # ==================== #
     #      CORS Config      #
     # ==================== #
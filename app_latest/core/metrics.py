@@ -0,0 +1,137 @@
+"""
+Prometheus 指标
+
+/metrics 以 Prometheus 文本格式输出以下指标：
+- HTTP 请求数与耗时（按路由模板聚合，避免路径参数导致标签爆炸）
+- 语音生成流程各阶段耗时：读取文件、解码、ASR、LLM、TTS、数据库写入
+- 外部 API（DeepSeek、SiliconFlow TTS）的耗时与状态码
+- 已打开的数据库连接数、正在进行的 ASR 任务数
+- 缓存命中/未命中次数
+
+未安装 prometheus_client 时所有指标退化为空操作，/metrics 返回 503。
+"""
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+
+class _NoopMetric:
+    """prometheus_client 不可用时的占位指标"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+    METRICS_AVAILABLE = True
+except ImportError:
+    METRICS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; charset=utf-8"
+    Counter = Gauge = Histogram = _NoopMetric
+
+
+# 秒级分桶，覆盖从毫秒级的数据库写入到数十秒的 TTS 生成
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP 请求数", ["method", "route", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时", ["method", "route"], buckets=LATENCY_BUCKETS
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "正在处理的 HTTP 请求数"
+)
+
+PIPELINE_STAGE_DURATION = Histogram(
+    "pipeline_stage_duration_seconds", "语音生成流程各阶段耗时", ["stage"], buckets=LATENCY_BUCKETS
+)
+PIPELINE_STAGE_ERRORS = Counter(
+    "pipeline_stage_errors_total", "语音生成流程各阶段失败次数", ["stage"]
+)
+
+EXTERNAL_API_DURATION = Histogram(
+    "external_api_duration_seconds", "外部 API 调用耗时", ["service"], buckets=LATENCY_BUCKETS
+)
+EXTERNAL_API_REQUESTS = Counter(
+    "external_api_requests_total", "外部 API 调用次数，status 为 HTTP 状态码或错误类型", ["service", "status"]
+)
+
+DB_CONNECTIONS_OPEN = Gauge(
+    "db_connections_open", "已打开的数据库连接数"
+)
+ASR_IN_PROGRESS = Gauge(
+    "asr_in_progress", "正在进行的语音识别任务数"
+)
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "缓存查询次数", ["cache", "result"]
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """记录语音生成流程中一个阶段的耗时，异常时同时计入失败次数"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        PIPELINE_STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        PIPELINE_STAGE_DURATION.labels(stage).observe(time.perf_counter() - start)
+
+
+def _error_status(error: BaseException) -> str:
+    """从 httpx / openai 异常中取出状态码，取不到时返回异常类型"""
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status_code:
+        return str(status_code)
+    return type(error).__name__
+
+
+@contextmanager
+def track_external_call(service: str):
+    """
+    记录一次外部 API 调用的耗时和状态码
+
+    调用方拿到响应后设置 call.status_code；抛出异常时从异常中提取状态码。
+    """
+    call = SimpleNamespace(status_code=None)
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException as e:
+        EXTERNAL_API_REQUESTS.labels(service, _error_status(e)).inc()
+        raise
+    else:
+        EXTERNAL_API_REQUESTS.labels(service, str(call.status_code or "ok")).inc()
+    finally:
+        EXTERNAL_API_DURATION.labels(service).observe(time.perf_counter() - start)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """记录一次缓存命中或未命中"""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def render_metrics() -> bytes:
+    """导出 Prometheus 文本格式的指标"""
+    return generate_latest()
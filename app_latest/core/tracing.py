@@ -0,0 +1,302 @@
+"""
+请求链路追踪
+
+按 OpenTelemetry 的数据模型记录嵌套 span：每个 HTTP 请求是一个 trace，请求内的
+语音识别、DeepSeek、TTS、数据库查询等步骤是它的子 span。当前 span 保存在
+contextvars 中，同一请求内的 await 调用和 run_in_threadpool 都能自动找到父 span。
+
+导出方式由 TRACING_EXPORTER 配置：
+- log：每个 span 结束时以一行 JSON 写入 tracing 日志
+- otlp：批量以 OTLP/HTTP JSON 格式发送到本地 collector（TRACING_OTLP_ENDPOINT）
+- none：只生成 trace ID，不导出
+
+请求头中带有 W3C traceparent 时沿用上游的 trace ID，响应头返回 X-Trace-Id 和 traceparent。
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from core.config import settings
+
+logger = logging.getLogger("tracing")
+
+# OTLP span kind
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """一次操作的耗时记录"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "attributes",
+                 "start_ns", "end_ns", "status", "status_message")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent 头"""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": "error" if self.status == STATUS_ERROR else "ok",
+            "status_message": self.status_message or None,
+            "attributes": self.attributes,
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": self.status, "message": self.status_message},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class LogExporter:
+    """span 结束时写一行 JSON 日志"""
+
+    def export(self, span: Span) -> None:
+        logger.info(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+
+
+class OTLPExporter:
+    """
+    批量发送到 OTLP/HTTP collector（如 http://localhost:4318/v1/traces）
+
+    span 先放入队列，由后台线程每隔 flush_interval 秒或攒够 batch_size 个后发送，
+    不阻塞请求；collector 不可用时丢弃该批并记录警告。
+    """
+
+    def __init__(self, endpoint: str, service_name: str, batch_size: int = 256,
+                 flush_interval: float = 2.0, max_queue: int = 10000):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass
+
+    def _run(self) -> None:
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self._send(batch)
+
+    def _send(self, batch) -> None:
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "core.tracing"},
+                    "spans": [span.to_otlp() for span in batch],
+                }],
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(payload, default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+        except Exception as e:
+            logger.warning(f"发送 {len(batch)} 个 span 到 {self.endpoint} 失败: {e}")
+
+
+def _create_exporter():
+    exporter = settings.TRACING_EXPORTER.lower()
+    if exporter == "log":
+        return LogExporter()
+    if exporter == "otlp":
+        return OTLPExporter(settings.TRACING_OTLP_ENDPOINT, settings.APP_NAME)
+    return None
+
+
+_exporter = _create_exporter()
+
+
+def parse_traceparent(header: Optional[str]):
+    """解析 W3C traceparent 头，返回 (trace_id, parent_span_id)，格式不对时返回 (None, None)"""
+    if not header:
+        return None, None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None, None
+    if parts[1] == "0" * 32:
+        return None, None
+    return parts[1], parts[2]
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+@contextmanager
+def start_span(name: str, kind: int = KIND_INTERNAL, traceparent: Optional[str] = None, **attributes):
+    """
+    开始一个 span，结束时导出
+
+    Args:
+        name: span 名称
+        kind: KIND_INTERNAL / KIND_SERVER / KIND_CLIENT
+        traceparent: 上游传入的 traceparent 头，只对根 span 有效
+        **attributes: span 属性
+    """
+    parent = _current_span.get()
+    if parent:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = parse_traceparent(traceparent)
+        trace_id = trace_id or secrets.token_hex(16)
+
+    span = Span(name, trace_id, parent_id, kind, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        if _exporter:
+            _exporter.export(span)
+
+
+def traced(name: str, kind: int = KIND_INTERNAL):
+    """把整个函数调用包在一个 span 中，支持同步和异步函数"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with start_span(name, kind):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_span(name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_sqlalchemy(engine) -> None:
+    """为 SQLAlchemy engine 的每条 SQL 创建 span"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        manager = start_span("db.query", KIND_CLIENT, **db_attributes(statement))
+        manager.__enter__()
+        conn.info.setdefault("tracing_spans", []).append(manager)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("tracing_spans")
+        if spans:
+            spans.pop().__exit__(None, None, None)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        spans = context.connection.info.get("tracing_spans") if context.connection else None
+        if spans:
+            error = context.original_exception
+            spans.pop().__exit__(type(error), error, error.__traceback__)
+
+
+def db_attributes(statement: str) -> Dict[str, Any]:
+    """数据库 span 的属性，语句过长时截断"""
+    statement = " ".join(statement.split())
+    return {
+        "db.system": "mysql",
+        "db.operation": statement.split(" ", 1)[0].upper() if statement else "",
+        "db.statement": statement[:500],
+    }
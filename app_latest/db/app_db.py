@@ -1,16 +1,25 @@
 import pymysql
 from typing import Dict, List, Optional, Tuple, Any
-import os
 import logging
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+import weakref
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 import datetime
 from core.config import settings
+from core.metrics import DB_CONNECTIONS_OPEN
+from core.tracing import KIND_CLIENT, db_attributes, instrument_sqlalchemy, start_span
+from services.storage import storage
 
 # 配置日志
 logger = logging.getLogger("digital_human_db")
 
+# 对话记录文档的存储键前缀
+DOCUMENTS_PREFIX = "uploads/digital_humans/documents"
+
+# 保存媒体文件路径的数字人字段；入库时保存存储键，读取时再生成访问URL（S3 预签名URL会过期）
+MEDIA_FIELDS = ('image_path', 'reference_audio_path', 'train_audio_path')
+
 # SQLAlchemy部分
 Base = declarative_base()
 
@@ -54,6 +63,8 @@ class Document(Base):
     filepath = Column(String(500))
     file_type = Column(String(50))
     file_size = Column(Integer)
+    duration = Column(Float)
+    sample_rate = Column(Integer)
     upload_time = Column(DateTime, default=datetime.datetime.utcnow)
     description = Column(Text)
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
@@ -66,13 +77,18 @@ class AudioFile(Base):
     id = Column(Integer, primary_key=True)
     filename = Column(String(200), nullable=False)
     filepath = Column(String(500))
+    file_size = Column(Integer)
+    duration = Column(Float)
+    sample_rate = Column(Integer)
     upload_time = Column(DateTime, default=datetime.datetime.utcnow)
     digital_human_id = Column(Integer, ForeignKey('digital_human.id'))
     digital_human = relationship("DigitalHuman", back_populates="audio_files")
 
 # 创建会话工厂
 engine_url = settings.DATABASE_URI
-Session = sessionmaker(bind=create_engine(engine_url))
+engine = create_engine(engine_url)
+instrument_sqlalchemy(engine)
+Session = sessionmaker(bind=engine)
 
 class DatabaseManager:
     def __init__(self, host=settings.DB_HOST, user=settings.DB_USER, password=settings.DB_PASSWORD, 
@@ -88,6 +104,7 @@ class DatabaseManager:
         }
         self.connection = None
         self.cursor = None
+        self._connection_gauge = None
         
         # 记录连接参数（不包含密码）
         logger.info(f"数据库连接参数: host={host}, user={user}, db={db}, port={port}")
@@ -97,6 +114,9 @@ class DatabaseManager:
         try:
             self.connection = pymysql.connect(**self.connection_params)
             self.cursor = self.connection.cursor(pymysql.cursors.DictCursor)
+            # 连接数指标：disconnect() 或对象被回收时减一
+            DB_CONNECTIONS_OPEN.inc()
+            self._connection_gauge = weakref.finalize(self, DB_CONNECTIONS_OPEN.dec)
             logger.info("数据库连接成功")
             return True
         except Exception as e:
@@ -111,32 +131,37 @@ class DatabaseManager:
             self.connection.close()
         self.cursor = None
         self.connection = None
+        if self._connection_gauge:
+            self._connection_gauge()
+            self._connection_gauge = None
     
     def execute_query(self, query: str, params: Tuple = None) -> Optional[List[Dict]]:
         """执行查询并返回结果"""
-        try:
-            if not self.connection:
-                self.connect()
-            
-            logger.info(f"执行SQL: {query}")
-            if params:
-                logger.info(f"SQL参数: {params}")
-            
-            self.cursor.execute(query, params)
-            if query.strip().upper().startswith('SELECT'):
-                results = self.cursor.fetchall()
-                logger.info(f"查询结果: {results}")
-                return results
-            else:
-                self.connection.commit()
-                row_count = self.cursor.rowcount  # 获取受影响的行数
-                logger.info(f"非查询SQL执行成功，受影响的行数: {row_count}")
-                return row_count
-        except Exception as e:
-            logger.error(f"查询执行失败: {e}", exc_info=True)
-            if self.connection:
-                self.connection.rollback()
-            return None
+        with start_span("db.query", KIND_CLIENT, **db_attributes(query)) as span:
+            try:
+                if not self.connection:
+                    self.connect()
+            
+                logger.info(f"执行SQL: {query}")
+                if params:
+                    logger.info(f"SQL参数: {params}")
+            
+                self.cursor.execute(query, params)
+                if query.strip().upper().startswith('SELECT'):
+                    results = self.cursor.fetchall()
+                    logger.info(f"查询结果: {results}")
+                    return results
+                else:
+                    self.connection.commit()
+                    row_count = self.cursor.rowcount  # 获取受影响的行数
+                    logger.info(f"非查询SQL执行成功，受影响的行数: {row_count}")
+                    return row_count
+            except Exception as e:
+                logger.error(f"查询执行失败: {e}", exc_info=True)
+                span.record_error(e)
+                if self.connection:
+                    self.connection.rollback()
+                return None
         
     def register_user(self, user_data: Dict[str, Any]) -> Tuple[bool, Dict[str, Any], str]:
         """注册新用户
@@ -256,7 +281,9 @@ class DatabaseManager:
         for key, value in digital_human_data.items():
             # 如果存在映射关系，则使用映射后的字段名
             db_field = field_mapping.get(key, key)
-            # 保留完整文件路径，不做任何修改
+            # 媒体文件只保存存储键，其他字段保持原样
+            if db_field in MEDIA_FIELDS:
+                value = self._stored_path(value)
             formatted_data[db_field] = value
             logger.info(f"映射字段: {key} -> {db_field} = {value}")
         
@@ -355,12 +382,13 @@ class DatabaseManager:
             for path in all_file_paths:
                 if path:  # 确保路径不为空
                     try:
-                        full_path = os.path.join("static", path) if not os.path.isabs(path) else path
-                        if os.path.exists(full_path):
-                            os.remove(full_path)
-                            logger.info(f"成功删除文件: {full_path}")
+                        file_key = self._storage_key(path)
+                        if not file_key:
+                            logger.info(f"跳过非存储文件: {path}")
+                        elif storage.delete(file_key):
+                            logger.info(f"成功删除文件: {file_key}")
                         else:
-                            logger.warning(f"文件不存在: {full_path}")
+                            logger.warning(f"文件不存在: {file_key}")
                     except Exception as e:
                         logger.error(f"删除文件失败 {path}: {e}")
         except Exception as e:
@@ -423,6 +451,8 @@ class DatabaseManager:
         for key, value in db_record.items():
             # 如果存在映射关系，则使用映射后的字段名
             frontend_field = field_mapping.get(key, key)
+            if key in MEDIA_FIELDS:
+                value = self._media_url(value)
             formatted_record[frontend_field] = value
             logger.info(f"映射响应字段: {key} -> {frontend_field} = {value}")
         
@@ -598,6 +628,8 @@ class DatabaseManager:
         for key, value in update_data.items():
             # 如果存在映射关系，则使用映射后的字段名
             db_field = field_mapping.get(key, key)
+            if db_field in MEDIA_FIELDS:
+                value = self._stored_path(value)
             formatted_data[db_field] = value
         
         valid_fields = [
@@ -633,10 +665,10 @@ class DatabaseManager:
         query = """
             SELECT COUNT(*) as count 
             FROM information_schema.tables 
-            WHERE table_schema = %s 
+            WHERE table_schema = DATABASE() 
             AND table_name = 'digital_human'
         """
-        result = self.execute_query(query, (self.connection_params['db'],))
+        result = self.execute_query(query)
         table_exists = result[0]['count'] > 0 if result else False
         logger.info(f"表是否存在: {table_exists}")
         return table_exists
@@ -688,6 +720,8 @@ class DatabaseManager:
                 filepath VARCHAR(500),
                 file_type VARCHAR(50),
                 file_size INT,
+                duration FLOAT,
+                sample_rate INT,
                 upload_time DATETIME DEFAULT CURRENT_TIMESTAMP,
                 description TEXT,
                 user_id INT NOT NULL,
@@ -704,6 +738,9 @@ class DatabaseManager:
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 filename VARCHAR(200) NOT NULL,
                 filepath VARCHAR(500),
+                file_size INT,
+                duration FLOAT,
+                sample_rate INT,
                 upload_time DATETIME DEFAULT CURRENT_TIMESTAMP,
                 digital_human_id INT,
                 FOREIGN KEY (digital_human_id) REFERENCES digital_human(id)
@@ -720,26 +757,39 @@ class DatabaseManager:
     def add_missing_columns(self) -> bool:
         """检查并添加可能缺失的列"""
         try:
-            # 检查user表
-            user_columns = {
-                'role': 'INT DEFAULT 0',
-                'bound_to_user_id': 'INT',
-                'email': 'VARCHAR(100)',
-                'phone': 'VARCHAR(20)'
+            # 各表需要检查的列
+            table_columns = {
+                'user': {
+                    'role': 'INT DEFAULT 0',
+                    'bound_to_user_id': 'INT',
+                    'email': 'VARCHAR(100)',
+                    'phone': 'VARCHAR(20)'
+                },
+                'document': {
+                    'duration': 'FLOAT',
+                    'sample_rate': 'INT'
+                },
+                'audio_file': {
+                    'file_size': 'INT',
+                    'duration': 'FLOAT',
+                    'sample_rate': 'INT'
+                }
             }
             
-            for column, definition in user_columns.items():
-                query = f"""
-                SELECT COUNT(*)
-                FROM information_schema.columns
-                WHERE table_name = 'user'
-                AND column_name = '{column}'
-                """
-                result = self.execute_query(query)
-                if result and result[0]['COUNT(*)'] == 0:
-                    alter_query = f"ALTER TABLE user ADD COLUMN {column} {definition}"
-                    self.execute_query(alter_query)
-                    logger.info(f"添加列 {column} 到 user 表")
+            for table, columns in table_columns.items():
+                for column, definition in columns.items():
+                    query = f"""
+                    SELECT COUNT(*)
+                    FROM information_schema.columns
+                    WHERE table_schema = DATABASE()
+                    AND table_name = '{table}'
+                    AND column_name = '{column}'
+                    """
+                    result = self.execute_query(query)
+                    if result and result[0]['COUNT(*)'] == 0:
+                        alter_query = f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+                        self.execute_query(alter_query)
+                        logger.info(f"添加列 {column} 到 {table} 表")
             
             return True
         except Exception as e:
@@ -769,21 +819,17 @@ class DatabaseManager:
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"chat_history_{timestamp}.txt"
 
-            # 保存文件到指定目录
-            save_dir = os.path.join("static", "uploads", "digital_humans", "documents")
-            os.makedirs(save_dir, exist_ok=True)
-            filepath = os.path.join(save_dir, filename)
-
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.write(chat_content)
+            # 保存文件到存储后端
+            file_key = f"{DOCUMENTS_PREFIX}/{filename}"
+            file_size = storage.save(file_key, chat_content.encode("utf-8"), "text/plain; charset=utf-8")
 
             # 创建文档记录
             document = Document(
                 title=f"与{digital_human.name}的对话记录",
                 filename=filename,
-                filepath=f"digital_humans/documents/{filename}",
+                filepath=file_key,
                 file_type="txt",
-                file_size=os.path.getsize(filepath),
+                file_size=file_size,
                 description=f"与数字人 {digital_human.name} 的对话记录",
                 digital_human_id=digital_human.id,
                 user_id=digital_human.user_id  # 使用数字人所属的用户ID
@@ -814,18 +860,26 @@ class DatabaseManager:
                 'id': doc.id,
                 'title': doc.title,
                 'file_type': doc.file_type,
+                'file_size': doc.file_size,
+                'duration': doc.duration,
+                'sample_rate': doc.sample_rate,
                 'upload_time': doc.upload_time
             } for doc in documents]
         finally:
             session.close()
 
-    def save_audio_to_database(self, filename: str, filepath: str, digital_human_id: int) -> Dict[str, Any]:
+    def save_audio_to_database(self, filename: str, filepath: str, digital_human_id: int,
+                               file_size: Optional[int] = None, duration: Optional[float] = None,
+                               sample_rate: Optional[int] = None) -> Dict[str, Any]:
         """保存音频文件信息到数据库
         
         Args:
             filename: 文件名
             filepath: 文件路径
             digital_human_id: 数字人ID
+            file_size: 文件大小（字节）
+            duration: 时长（秒）
+            sample_rate: 采样率
             
         Returns:
             Dict: 包含操作结果的字典
@@ -835,6 +889,9 @@ class DatabaseManager:
             audio = AudioFile(
                 filename=filename,
                 filepath=filepath,
+                file_size=file_size,
+                duration=duration,
+                sample_rate=sample_rate,
                 digital_human_id=digital_human_id
             )
             session.add(audio)
@@ -916,7 +973,7 @@ class DatabaseManager:
             List[Dict]: 包含文档信息的列表，按创建时间倒序排列
         """
         query = """
-            SELECT id, title, filepath, 
+            SELECT id, title, filepath, file_type, file_size, duration, sample_rate,
                    upload_time, digital_human_id, user_id 
             FROM document 
             WHERE user_id = %s
@@ -925,12 +982,35 @@ class DatabaseManager:
         results = self.execute_query(query, (user_id,))
         return [self._format_document_response(record) for record in results] if results else []
 
+    def _storage_key(self, path: str) -> Optional[str]:
+        """将数据库中保存的文件路径转换为存储键"""
+        file_key = storage.key_from_url(path)
+        # 早期的对话记录保存为 digital_humans/documents/xxx，实际位于 uploads 下
+        if file_key and file_key.startswith("digital_humans/"):
+            file_key = f"uploads/{file_key}"
+        return file_key
+
+    def _stored_path(self, url: Optional[str]) -> Optional[str]:
+        """入库前将访问URL转换为存储键，外部URL和远端URI保持原样"""
+        if not url:
+            return url
+        return self._storage_key(url) or url
+
+    def _media_url(self, path: Optional[str]) -> Optional[str]:
+        """将数据库中保存的文件路径转换为当前可访问的URL"""
+        file_key = self._storage_key(path) if path else None
+        return storage.url_for(file_key) if file_key else path
+
     def _format_document_response(self, record: Dict) -> Dict:
         """格式化文档记录响应"""
         return {
             "id": record["id"],
             "title": record["title"],
-            "file_url": f"/{record['filepath']}",  # 生成完整访问URL
+            "file_url": self._media_url(record['filepath']),  # 生成完整访问URL
+            "file_type": record.get("file_type"),
+            "file_size": record.get("file_size"),
+            "duration": record.get("duration"),
+            "sample_rate": record.get("sample_rate"),
             "upload_time": record["upload_time"].strftime("%Y-%m-%d %H:%M:%S"),
             "digital_human_id": record["digital_human_id"],
             "user_id": record["user_id"]
@@ -1,6 +1,5 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 import uvicorn
 import logging
 import pymysql
@@ -9,7 +8,10 @@ from pathlib import Path
 
 from api.routes import api_router
 from core.config import settings
+from core.metrics import CONTENT_TYPE_LATEST, METRICS_AVAILABLE, render_metrics
 from middleware.logging import logging_middleware
+from middleware.metrics import metrics_middleware
+from utils.static_media import MediaStaticFiles
 from db.db_digital_manage import DatabaseManager
 from services.register_service import RegisterService
 from services.login_service import LoginService
@@ -86,9 +88,18 @@ app.add_middleware(
 
 # Add custom middleware
 app.middleware("http")(logging_middleware)
+app.middleware("http")(metrics_middleware)
 
 # Mount static files directory
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount(
+    "/static",
+    MediaStaticFiles(
+        directory="static",
+        immutable_max_age=settings.STATIC_IMMUTABLE_MAX_AGE,
+        zero_copy=settings.STATIC_ZERO_COPY
+    ),
+    name="static"
+)
 
 # Initialize DatabaseManager
 db_manager = DatabaseManager(
@@ -107,6 +118,13 @@ login_service = LoginService(db_manager)
 # Include routers
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics endpoint"""
+    if not METRICS_AVAILABLE:
+        return Response("请安装prometheus_client库以启用指标: pip install prometheus_client", status_code=503)
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 @app.on_event("startup")
 async def startup_db_client():
     """Ensure database exists and static directories are created when the application starts"""
@@ -2,20 +2,36 @@ import time
 from fastapi import Request
 import logging
 
+from core.tracing import KIND_SERVER, start_span
+from middleware.metrics import route_label
+
 logger = logging.getLogger(__name__)
 
 async def logging_middleware(request: Request, call_next):
     """
-    Middleware for logging request information
+    Middleware for logging request information and opening the root trace span
     """
     start_time = time.time()
-    response = await call_next(request)
+    with start_span(
+        f"{request.method} {request.url.path}",
+        KIND_SERVER,
+        traceparent=request.headers.get("traceparent"),
+        **{"http.method": request.method, "http.target": request.url.path}
+    ) as span:
+        response = await call_next(request)
+        route = route_label(request)
+        span.name = f"{request.method} {route}"
+        span.set_attribute("http.route", route)
+        span.set_attribute("http.status_code", response.status_code)
+        response.headers["X-Trace-Id"] = span.trace_id
+        response.headers["traceparent"] = span.traceparent
     process_time = time.time() - start_time
     
     logger.info(
         f"Request: {request.method} {request.url.path} | "
         f"Status: {response.status_code} | "
-        f"Process Time: {process_time:.3f}s"
+        f"Process Time: {process_time:.3f}s | "
+        f"Trace: {span.trace_id}"
     )
     
-    return response 
\ No newline at end of file
+    return response
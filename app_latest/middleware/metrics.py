@@ -0,0 +1,56 @@
+import time
+from fastapi import Request
+
+from core.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS, HTTP_REQUESTS_IN_PROGRESS
+
+
+def route_label(request: Request) -> str:
+    """
+    取匹配到的完整路由模板（如 /api/v1/voice/generate/{digital_human_id}）作为标签，
+    未匹配任何路由时统一记为 unmatched
+
+    新版 FastAPI 的 scope["route"] 是最内层路由器中的路由，path 不含 include_router 的前缀；
+    用请求路径减去该路由按路径参数还原出的部分得到前缀，新旧版本都能得到完整模板
+    """
+    route = request.scope.get("route")
+    template = getattr(route, "path", None)
+    if not template:
+        return "unmatched"
+
+    try:
+        params = {
+            name: route.param_convertors[name].to_string(value)
+            for name, value in request.path_params.items()
+        }
+        matched = route.path_format.format(**params)
+    except (AttributeError, KeyError, ValueError):
+        return template
+
+    path = request.scope.get("path", "")
+    root_path = request.scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    if not path.endswith(matched):
+        return template
+    return path[:len(path) - len(matched)] + template
+
+
+async def metrics_middleware(request: Request, call_next):
+    """
+    Middleware for recording request count and latency by route
+    """
+    if request.url.path == "/metrics":
+        return await call_next(request)
+
+    status = 500
+    start_time = time.perf_counter()
+    HTTP_REQUESTS_IN_PROGRESS.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_REQUESTS_IN_PROGRESS.dec()
+        route = route_label(request)
+        HTTP_REQUEST_DURATION.labels(request.method, route).observe(time.perf_counter() - start_time)
+        HTTP_REQUESTS.labels(request.method, route, str(status)).inc()
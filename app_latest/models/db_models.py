@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -50,6 +50,8 @@ class Document(Base):
     filepath = Column(String(255), nullable=False)
     file_type = Column(String(50))
     file_size = Column(Integer)
+    duration = Column(Float)
+    sample_rate = Column(Integer)
     upload_time = Column(DateTime, default=datetime.datetime.utcnow)
     description = Column(Text)
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
@@ -63,6 +65,9 @@ class AudioFile(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     filename = Column(String(255))
     filepath = Column(String(255))
+    file_size = Column(Integer)
+    duration = Column(Float)
+    sample_rate = Column(Integer)
     upload_time = Column(DateTime, default=datetime.datetime.utcnow)
     digital_human_id = Column(Integer, ForeignKey('digital_human.id'))
     digital_human = relationship("DigitalHuman", back_populates="audio_files")
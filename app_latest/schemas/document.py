@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic import BaseModel
 
 class DocumentRequest(BaseModel):
@@ -7,6 +8,10 @@ class DocumentResponse(BaseModel):
     id: int
     title: str
     file_url: str
+    file_type: Optional[str] = None
+    file_size: Optional[int] = None
+    duration: Optional[float] = None
+    sample_rate: Optional[int] = None
     upload_time: str
     digital_human_id: int
     user_id: int
\ No newline at end of file
@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic import BaseModel
 
 class VoiceTrainRequest(BaseModel):
@@ -19,3 +20,5 @@ class VoiceGenerateRequest(BaseModel):
 class VoiceGenerateResponse(BaseModel):
     audio_url: str
     duration: float = 0.0 
+    sample_rate: Optional[int] = None
+    file_size: Optional[int] = None
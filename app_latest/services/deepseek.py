@@ -1,5 +1,7 @@
 import httpx
 from core.config import settings
+from core.metrics import track_external_call
+from core.tracing import KIND_CLIENT, traced
 import logging
 
 class DeepseekService:
@@ -10,6 +12,7 @@ class DeepseekService:
             "Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}"
         }
     
+    @traced("deepseek.get_response", KIND_CLIENT)
     async def get_response(self,description: str, user_input: str) -> str:
         """
         调用DeepSeek API获取回复
@@ -32,12 +35,14 @@ class DeepseekService:
             logging.info(f"发送到DeepSeek API的payload: {payload}")
             
             async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.api_url,
-                    headers=self.headers,
-                    json=payload,
-                    timeout=30.0
-                )
+                with track_external_call("deepseek") as call:
+                    response = await client.post(
+                        self.api_url,
+                        headers=self.headers,
+                        json=payload,
+                        timeout=30.0
+                    )
+                    call.status_code = response.status_code
                 
                 response.raise_for_status()
                 result = response.json()
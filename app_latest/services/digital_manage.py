@@ -1,26 +1,16 @@
 import logging
 import os
-import shutil
 import time
 import uuid
-from pathlib import Path
 from typing import Dict, Any, Tuple, List, Optional
 
+from services.storage import storage
+
 # 配置日志
 logger = logging.getLogger("digital_manage_service")
 
-# 设置路径
-STATIC_DIR = Path("./static")
-IMAGES_DIR = STATIC_DIR / "images"
-AUDIO_DIR = STATIC_DIR / "audio"
-UPLOADS_DIR = STATIC_DIR / "uploads"
-AVATARS_DIR = UPLOADS_DIR / "avatars"
-
-# 确保目录存在
-IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-AUDIO_DIR.mkdir(parents=True, exist_ok=True)
-UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
-AVATARS_DIR.mkdir(parents=True, exist_ok=True)
+# 存储键前缀
+AUDIO_PREFIX = "audio"
 
 # 临时存储，用于在网络异常时创建本地ID
 LOCAL_TEMP_DATA = {}
@@ -45,12 +35,12 @@ class DigitalManageService:
             
             # 处理音频文件路径
             if 'original_reference_audio_path' in digital_human_data and digital_human_data['original_reference_audio_path']:
-                reference_audio_url = self.copy_file_to_static(digital_human_data['original_reference_audio_path'], AUDIO_DIR)
+                reference_audio_url = self.copy_file_to_static(digital_human_data['original_reference_audio_path'], AUDIO_PREFIX)
                 if reference_audio_url:
                     digital_human_data['referenceAudio'] = reference_audio_url
             
             if 'original_training_audio_path' in digital_human_data and digital_human_data['original_training_audio_path']:
-                training_audio_url = self.copy_file_to_static(digital_human_data['original_training_audio_path'], AUDIO_DIR)
+                training_audio_url = self.copy_file_to_static(digital_human_data['original_training_audio_path'], AUDIO_PREFIX)
                 if training_audio_url:
                     digital_human_data['trainingAudio'] = training_audio_url
             
@@ -203,12 +193,12 @@ class DigitalManageService:
             
             # 处理音频文件路径
             if 'original_reference_audio_path' in update_data and update_data['original_reference_audio_path']:
-                reference_audio_url = self.copy_file_to_static(update_data['original_reference_audio_path'], AUDIO_DIR)
+                reference_audio_url = self.copy_file_to_static(update_data['original_reference_audio_path'], AUDIO_PREFIX)
                 if reference_audio_url:
                     LOCAL_TEMP_DATA[digital_human_id]['referenceAudio'] = reference_audio_url
             
             if 'original_training_audio_path' in update_data and update_data['original_training_audio_path']:
-                training_audio_url = self.copy_file_to_static(update_data['original_training_audio_path'], AUDIO_DIR)
+                training_audio_url = self.copy_file_to_static(update_data['original_training_audio_path'], AUDIO_PREFIX)
                 if training_audio_url:
                     LOCAL_TEMP_DATA[digital_human_id]['trainingAudio'] = training_audio_url
             
@@ -225,12 +215,12 @@ class DigitalManageService:
             
             # 处理音频文件路径
             if 'original_reference_audio_path' in update_data and update_data['original_reference_audio_path']:
-                reference_audio_url = self.copy_file_to_static(update_data['original_reference_audio_path'], AUDIO_DIR)
+                reference_audio_url = self.copy_file_to_static(update_data['original_reference_audio_path'], AUDIO_PREFIX)
                 if reference_audio_url:
                     update_data['referenceAudio'] = reference_audio_url
             
             if 'original_training_audio_path' in update_data and update_data['original_training_audio_path']:
-                training_audio_url = self.copy_file_to_static(update_data['original_training_audio_path'], AUDIO_DIR)
+                training_audio_url = self.copy_file_to_static(update_data['original_training_audio_path'], AUDIO_PREFIX)
                 if training_audio_url:
                     update_data['trainingAudio'] = training_audio_url
             
@@ -254,8 +244,8 @@ class DigitalManageService:
             logger.error(f"更新数字人信息出错: {e}", exc_info=True)
             return False, {}, "更新数字人信息时发生错误"
     
-    def copy_file_to_static(self, file_path, target_dir):
-        """复制文件到静态目录，返回访问URL"""
+    def copy_file_to_static(self, file_path, target_prefix):
+        """复制文件到媒体存储，返回访问URL"""
         try:
             if not os.path.exists(file_path):
                 logger.error(f"源文件不存在: {file_path}")
@@ -264,16 +254,14 @@ class DigitalManageService:
             # 生成唯一文件名
             file_name = os.path.basename(file_path)
             unique_filename = f"{int(time.time())}_{file_name}"
-            target_path = os.path.join(target_dir, unique_filename)
+            file_key = f"{target_prefix}/{unique_filename}"
             
-            # 复制文件
-            shutil.copy2(file_path, target_path)
+            # 流式复制到存储后端
+            with open(file_path, "rb") as f:
+                storage.save(file_key, f)
             
             # 返回URL路径
-            if str(target_dir).endswith("audio"):
-                return f"/static/audio/{unique_filename}"
-            else:
-                return f"/static/{unique_filename}"
+            return storage.url_for(file_key)
         except Exception as e:
             logger.error(f"复制文件失败: {e}", exc_info=True)
             return None
@@ -0,0 +1,257 @@
+"""
+Gemini 调用调度器
+
+所有 Gemini 请求共享的令牌桶限流：同时控制每分钟请求数和每分钟Token数，
+遇到配额错误时优先使用服务端给出的重试时间，否则按带抖动的指数退避重试。
+多线程并发处理视频片段时，所有线程通过同一个调度器排队，吞吐量贴近配额上限。
+"""
+import logging
+import random
+import re
+import threading
+import time
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+logger = logging.getLogger(__name__)
+
+# Gemini 多模态输入的Token计费（官方文档：视频每秒263个，音频每秒32个，图片258个）
+VIDEO_TOKENS_PER_SECOND = 263
+AUDIO_TOKENS_PER_SECOND = 32
+IMAGE_TOKENS = 258
+
+# 可以重试的HTTP状态码
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+RETRY_IN_PATTERN = re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE)
+
+# 没有状态码时只重试网络层错误；内容被拦截、参数错误等重试也不会成功
+TRANSPORT_ERRORS = (ConnectionError, TimeoutError)
+if google_exceptions is not None:
+    TRANSPORT_ERRORS += (google_exceptions.RetryError,)
+if requests is not None:
+    TRANSPORT_ERRORS += (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+class TokenBucket:
+    """线程安全的令牌桶，采用预约方式：先扣减令牌，再按欠额计算需要等待的时间"""
+
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+        self.updated = now
+
+    def reserve(self, amount):
+        """预约 amount 个令牌，返回需要等待的秒数"""
+        # 单次请求超过桶容量时按容量计算，避免永远等不到
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.refill_per_second
+
+    def adjust(self, amount):
+        """请求完成后按实际用量修正（正数为补扣，负数为退还）"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+def _duration_seconds(value):
+    """将 timedelta / protobuf Duration / "12.5s" 字符串转换为秒数"""
+    if value is None:
+        return None
+    if hasattr(value, "total_seconds"):
+        return value.total_seconds()
+    if hasattr(value, "seconds"):
+        return value.seconds + getattr(value, "nanos", 0) / 1e9
+    try:
+        return float(str(value).rstrip("s"))
+    except ValueError:
+        return None
+
+
+def get_status_code(error):
+    """获取异常对应的HTTP状态码，无法识别时返回None"""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error):
+    """判断调用失败后是否值得重试"""
+    status = get_status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, TRANSPORT_ERRORS)
+
+
+def get_retry_after(error):
+    """从异常中读取服务端建议的重试等待时间（秒）"""
+    # google.rpc.RetryInfo
+    for detail in getattr(error, "details", None) or []:
+        if isinstance(detail, dict):
+            delay = _duration_seconds(detail.get("retryDelay"))
+        else:
+            delay = _duration_seconds(getattr(detail, "retry_delay", None))
+        if delay:
+            return delay
+
+    # Retry-After 响应头
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers and headers.get("Retry-After"):
+        try:
+            return float(headers.get("Retry-After"))
+        except ValueError:
+            pass
+
+    # 错误信息中的 "Please retry in 37.5s"
+    match = RETRY_IN_PATTERN.search(str(error))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def estimate_tokens(contents):
+    """估算一次请求的输入Token数，用于发送前的限流"""
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+
+    total = 0
+    for part in contents:
+        if isinstance(part, str):
+            # 中文大约每个字1个Token，按字符数估算偏保守
+            total += len(part)
+            continue
+
+        if isinstance(part, dict):
+            # 内联数据 {'mime_type': ..., 'data': ...}
+            mime_type = part.get("mime_type", "") or ""
+        else:
+            mime_type = getattr(part, "mime_type", "") or ""
+        if mime_type.startswith("image/"):
+            total += IMAGE_TOKENS
+        elif mime_type.startswith(("video/", "audio/")):
+            metadata = getattr(part, "video_metadata", None)
+            duration = _duration_seconds(getattr(metadata, "video_duration", None)) or 0
+            per_second = AUDIO_TOKENS_PER_SECOND
+            if mime_type.startswith("video/"):
+                per_second += VIDEO_TOKENS_PER_SECOND
+            total += int(duration * per_second)
+    return total
+
+
+class GeminiScheduler:
+    """
+    共享的 Gemini 调用调度器
+
+    Args:
+        requests_per_minute: 每分钟请求数上限（RPM）
+        tokens_per_minute: 每分钟Token数上限（TPM），为None时不限制
+        max_retries: 最大尝试次数
+        base_delay: 退避的基础等待时间（秒）
+        max_delay: 退避的最长等待时间（秒）
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None, max_retries=6, base_delay=2.0, max_delay=120.0):
+        self.request_bucket = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.token_bucket = TokenBucket(tokens_per_minute, tokens_per_minute / 60) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """配额耗尽时暂停所有调用"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def backoff(self, attempt, retry_after=None):
+        """计算重试等待时间：有服务端提示时以其为准，否则为带抖动的指数退避"""
+        if retry_after:
+            return retry_after + random.uniform(0, 1)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt + 1)))
+        return random.uniform(self.base_delay, ceiling)
+
+    def _wait_for_capacity(self, tokens, count_request, description):
+        wait = 0.0
+        if count_request:
+            wait = max(wait, self.request_bucket.reserve(1))
+        if tokens and self.token_bucket:
+            wait = max(wait, self.token_bucket.reserve(tokens))
+        with self._lock:
+            wait = max(wait, self._blocked_until - time.monotonic())
+        if wait > 0:
+            logger.info(f"{description}：等待配额 {wait:.1f} 秒")
+            time.sleep(wait)
+
+    def _release_tokens(self, estimated_tokens):
+        """调用失败时退还预约的Token"""
+        if estimated_tokens and self.token_bucket:
+            self.token_bucket.adjust(-min(float(estimated_tokens), self.token_bucket.capacity))
+
+    def _record_usage(self, result, estimated_tokens):
+        if not self.token_bucket:
+            return
+        usage = getattr(result, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", None)
+        if actual:
+            self.token_bucket.adjust(actual - estimated_tokens)
+
+    def call(self, func, *args, estimated_tokens=0, count_request=True, description="Gemini请求", **kwargs):
+        """
+        在配额内执行一次调用，失败时按错误类型决定是否重试
+
+        Args:
+            func: 要执行的函数
+            estimated_tokens: 预估的输入Token数，调用完成后按实际用量修正
+            count_request: 是否计入每分钟请求数（文件上传、状态查询不计入）
+            description: 日志中的调用描述
+        """
+        for attempt in range(self.max_retries):
+            self._wait_for_capacity(estimated_tokens, count_request, description)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self._release_tokens(estimated_tokens)
+                status = get_status_code(e)
+                if not is_retryable(e) or attempt == self.max_retries - 1:
+                    logger.error(f"{description}失败，放弃重试 ({attempt + 1}/{self.max_retries}): {str(e)}")
+                    raise
+
+                retry_after = get_retry_after(e)
+                delay = self.backoff(attempt, retry_after)
+                if status == 429:
+                    # 配额耗尽时让所有线程一起等待，避免继续触发限流
+                    self.pause(delay)
+                logger.warning(
+                    f"{description}失败（{status or type(e).__name__}），"
+                    f"{delay:.1f} 秒后重试 ({attempt + 1}/{self.max_retries}): {str(e)}"
+                )
+                time.sleep(delay)
+                continue
+
+            self._record_usage(result, estimated_tokens)
+            return result
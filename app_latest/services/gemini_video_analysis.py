@@ -3,18 +3,22 @@
 # 为了更好的识别效果，本程序会对每个视频进行两轮对话，第一轮对话输入待提交角色的图片，生成特征信息，
 # 第二轮对话输入视频，生成视频分析结果。
 # 单段对视频进行分析的参考3.1gemini_analysis_single.py
+# 无界面运行：python gemini_video_analysis.py --video a.mp4 --video b.mp4 [--image role.png]，不指定 --video 时弹窗选择
 
+import argparse
 import os
 import time
 import google.generativeai as genai
-import tkinter as tk
-from tkinter import filedialog
 import logging
 from datetime import datetime
 import re
 import json
-import subprocess
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from gemini_scheduler import GeminiScheduler, estimate_tokens
+from media_probe import get_duration
+from character_cache import CharacterCache
+from file_tracker import FileStateTracker
 
 # 加载 .env 文件
 load_dotenv()
@@ -36,6 +40,23 @@ MODEL_CONFIG = {
 }
 SELECTED_MODEL = 'gemini-1.5-pro'  # 默认选择快速版
 
+# Gemini API 配额（按所用模型和账号等级填写），所有请求共享同一个调度器
+GEMINI_REQUESTS_PER_MINUTE = 15  # 每分钟请求数（RPM）
+GEMINI_TOKENS_PER_MINUTE = 1000000  # 每分钟Token数（TPM）
+gemini_scheduler = GeminiScheduler(
+    requests_per_minute=GEMINI_REQUESTS_PER_MINUTE,
+    tokens_per_minute=GEMINI_TOKENS_PER_MINUTE
+)
+
+# 角色图片句柄和角色分析结果的缓存，各视频和之后的运行共用
+CHARACTER_CACHE_PATH = os.path.join('outputs', 'character_cache.json')
+character_cache = CharacterCache(CHARACTER_CACHE_PATH, gemini_scheduler)
+
+# 提前上传的视频数：分析当前视频时，后续视频已在上传和等待服务端处理
+MAX_PENDING_UPLOADS = 3
+# 上传文件的处理状态由一个后台线程统一轮询；状态查询不经过调度器重试，失败时按间隔在下次轮询重新查询
+file_tracker = FileStateTracker(genai.get_file)
+
 # 固定的图片路径和提示词
 CHARACTER_IMAGE_PATH = r"C:\Users\29159\Downloads\VideoClipExtractionToolGemini-main\VideoClipExtractionToolGemini-main\input\Feilun.png"
 CHARACTER_PROMPT = """这个是菲伦，紫色头发的，你需要仔细记住她的人物特征，等下会基于此进行视频分析"""
@@ -66,7 +87,10 @@ os.environ['HTTP_PROXY'] = 'http://127.0.0.1:7897'
 
 
 def get_video_files():
-    """获取多个视频文件路径"""
+    """弹窗选择多个视频文件路径"""
+    # tkinter 只在弹窗时导入，无界面的服务器上通过 --video 指定视频
+    import tkinter as tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()
     
@@ -82,74 +106,46 @@ def get_video_files():
 
 def upload_media_with_retry(file_path, media_type):
     """带重试机制的媒体文件上传"""
-    max_retries = 5
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            logger.info(f"正在上传{media_type}... (尝试 {retry_count + 1}/{max_retries})")
-            media_file = genai.upload_file(file_path)
-            logger.info(f"上传完成: {media_file.uri}")
-            return media_file
-        except Exception as e:
-            retry_count += 1
-            if retry_count == max_retries:
-                raise e
-            logger.warning(f"上传失败，正在重试: {str(e)}")
-            time.sleep(5)
+    logger.info(f"正在上传{media_type}...")
+    media_file = gemini_scheduler.call(
+        genai.upload_file, file_path,
+        count_request=False,
+        description=f"上传{media_type}"
+    )
+    logger.info(f"上传完成: {media_file.uri}")
+    return media_file
 
-def send_message_with_retry(chat, message, max_retries=5, retry_delay=30):
-    """带重试机制的消息发送"""
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"[尝试 {attempt + 1}/{max_retries}] 开始发送消息...")
-            response = chat.send_message(message, stream=False)
-            logger.info(f"[尝试 {attempt + 1}/{max_retries}] 消息发送成功")
-            return response
-        except Exception as e:
-            error_code = str(e).split()[0]  # 获取错误代码
-            
-            # 根据错误类型调整等待时间
-            if error_code == "429":  # 配额限制
-                wait_time = retry_delay * (attempt + 1)  # 递增等待时间
-                logger.warning(f"达到API限制，等待 {wait_time} 秒后重试...")
-            elif error_code == "500":  # 服务器错误
-                wait_time = retry_delay * 2  # 服务器错误等待更长时间
-                logger.warning(f"服务器暂时不可用，等待 {wait_time} 秒后重试...")
-            else:
-                wait_time = retry_delay
-                logger.warning(f"发生错误: {str(e)}，等待 {wait_time} 秒后重试...")
-            
-            if attempt == max_retries - 1:  # 最后一次尝试
-                logger.error(f"达到最大重试次数 ({max_retries})，放弃处理")
-                raise e
-                
-            time.sleep(wait_time)
-            continue
+def send_message_with_retry(chat, message):
+    """通过共享调度器发送消息，配额不足时排队，失败时按错误类型退避重试"""
+    logger.info("开始发送消息...")
+    response = gemini_scheduler.call(
+        chat.send_message, message, stream=False,
+        estimated_tokens=estimate_tokens(message),
+        description="发送消息"
+    )
+    logger.info("消息发送成功")
+    return response
 
-def process_single_video(video_path, model, chat, image_file, total_videos, current_index, character_response):
-    """处理单个视频文件"""
+def upload_video_for_analysis(video_path):
+    """上传视频并等待 Gemini 处理完成，处理失败或超时时抛出异常"""
+    video_file = upload_media_with_retry(video_path, "视频")
+    video_file = file_tracker.wait_active(video_file)
+    logger.info(f"视频处理已完成: {os.path.basename(video_path)}")
+    return video_file
+
+def process_single_video(video_path, model, chat, image_file, total_videos, current_index, character_response, video_future=None):
+    """处理单个视频文件，video_future 为提前提交的上传任务"""
     try:
         video_name = os.path.splitext(os.path.basename(video_path))[0]
         logger.info(f"=== 开始处理视频 [{current_index}/{total_videos}]: {video_name} ===")
         logger.info(f"视频路径: {video_path}")
         
-        # 上传视频
-        video_file = upload_media_with_retry(video_path, "视频")
-        
-        # 等待视频处理
+        # 上传视频并等待处理完成
         logger.info("等待视频处理完成...")
-        process_start_time = time.time()
-        while video_file.state.name == "PROCESSING":
-            print('.', end='', flush=True)
-            time.sleep(10)
-            video_file = genai.get_file(video_file.name)
-            if time.time() - process_start_time > 300:  # 5分钟超时
-                raise TimeoutError("视频处理超时")
-        logger.info("视频处理已完成")
-        
-        if video_file.state.name == "FAILED":
-            raise ValueError(f"视频处理失败: {video_file.state.name}")
+        if video_future is not None:
+            video_file = video_future.result()
+        else:
+            video_file = upload_video_for_analysis(video_path)
         
         # 发送第二轮问题
         logger.info(f"[{current_index}/{total_videos}] 开始发送视频分析请求...")
@@ -202,6 +198,8 @@ def process_single_video(video_path, model, chat, image_file, total_videos, curr
             f.write(f"- **图片**:\n\n![角色图片]({safe_path})\n\n")
             f.write(f"- **提示词**: {CHARACTER_PROMPT}\n\n")
             f.write("### 分析结果\n")
+            if getattr(character_response, 'cached', False):
+                f.write("（使用缓存的角色分析，本次未消耗Token）\n\n")
             f.write(f"{character_response.text}\n\n")
             f.write("### Token统计\n")
             f.write("| 类型 | 数量 |\n")
@@ -237,10 +235,6 @@ def process_single_video(video_path, model, chat, image_file, total_videos, curr
         logger.info(f"处理时间: {response_time:.2f}秒")
         logger.info(f"结果已保存到: {output_file}")
         
-        # 等待10秒后进行JSON调整
-        logger.info(f"[{current_index}/{total_videos}] 等待10秒后进行JSON调整...")
-        time.sleep(10)
-        
         # 提取基础名称和Part编号
         video_name = os.path.splitext(os.path.basename(video_path))[0]
         base_name = re.sub(r'^Part\d+_|_compressedPart\d+.*$', '', video_name)
@@ -279,12 +273,8 @@ def process_single_video(video_path, model, chat, image_file, total_videos, curr
             logger.info(f"[{current_index}/{total_videos}] 已创建新的JSON文件: {json_path}")
         
         try:
-            # 读取txt文件内容
-            with open(output_file, 'r', encoding='utf-8') as f:
-                txt_content = f.read()
-            
-            # 提取JSON内容
-            analysis_json = extract_json_from_txt(txt_content)
+            # 直接从模型响应中提取JSON，不再回读 markdown 报告
+            analysis_json = extract_json_from_txt(video_response.text)
             if not analysis_json:
                 logger.error(f"[{current_index}/{total_videos}] 无法从分析结果中提取JSON内容")
                 return True
@@ -315,15 +305,15 @@ def process_single_video(video_path, model, chat, image_file, total_videos, curr
         logger.error(f"[{current_index}/{total_videos}] 处理视频失败: {str(e)}")
         return False
 
-def batch_process():
-    """批量处理多个视频"""
+def batch_process(video_paths=None):
+    """批量处理多个视频，未指定 video_paths 时弹窗选择"""
     start_time = time.time()
     logger.info("\n=== 3.gemini_analysis 开始 ===")
     logger.info("=== 批量视频分析启动 ===")
     
     try:
         # 获取视频文件列表
-        video_paths = get_video_files()
+        video_paths = list(video_paths) if video_paths else get_video_files()
         total_videos = len(video_paths)
         logger.info(f"共选择 {total_videos} 个视频文件")
         
@@ -338,45 +328,49 @@ def batch_process():
         successful = 0
         failed = 0
         
-        # 处理每个视频
-        for i, video_path in enumerate(video_paths, 1):
-            video_name = os.path.splitext(os.path.basename(video_path))[0]
-            logger.info(f"=== 第 {i}/{total_videos} 个视频开始处理 ===")
-            logger.info(f"视频名称: {video_name}")
-            
-            # 为每个视频创建新的会话
-            chat = model.start_chat()
-
-            # 上传角色图片
-            logger.info(f"上传角色示例图片: {CHARACTER_IMAGE_PATH}")
-            image_file = upload_media_with_retry(CHARACTER_IMAGE_PATH, "图片")
-            
-            # 首先进行角色分析
-            logger.info(f"[{i}/{total_videos}] 发送角色分析请求...")
-            character_response = send_message_with_retry(chat, [CHARACTER_PROMPT, image_file])
-            
-            # 显示角色分析结果
-            logger.info(f"[{i}/{total_videos}] 角色特征分析完成:")
-            logger.info("="*50)
-            logger.info(character_response.text)
-            logger.info("="*50)
-            
-            # 处理视频
-            if process_single_video(video_path, model, chat, image_file, total_videos, i, character_response):
-                successful += 1
-                logger.info(f"[{i}/{total_videos}] 视频处理成功完成")
-            else:
-                failed += 1
-                logger.error(f"[{i}/{total_videos}] 视频处理失败")
-            
-            # 关闭当前会话
-            logger.info(f"[{i}/{total_videos}] 关闭当前会话...")
-            chat = None
-            
-            # 处理间隔
-            if i < total_videos:
-                logger.info(f"[{i}/{total_videos}] 等待10秒后处理下一个视频...")
-                time.sleep(10)
+        # 按顺序提前上传视频，与前面视频的分析重叠进行；只提交当前视频之后 MAX_PENDING_UPLOADS 个，
+        # 避免一次性把所有视频都上传到服务端
+        upload_executor = ThreadPoolExecutor(max_workers=MAX_PENDING_UPLOADS, thread_name_prefix="upload")
+        video_futures = []
+        
+        try:
+            # 处理每个视频
+            for i, video_path in enumerate(video_paths, 1):
+                for path in video_paths[len(video_futures):i + MAX_PENDING_UPLOADS]:
+                    video_futures.append(upload_executor.submit(upload_video_for_analysis, path))
+                
+                video_name = os.path.splitext(os.path.basename(video_path))[0]
+                logger.info(f"=== 第 {i}/{total_videos} 个视频开始处理 ===")
+                logger.info(f"视频名称: {video_name}")
+                
+                # 为每个视频创建新的会话，角色图片和角色分析优先使用缓存
+                logger.info(f"[{i}/{total_videos}] 准备角色分析: {CHARACTER_IMAGE_PATH}")
+                chat, character_response, image_file = character_cache.start_chat(
+                    model, SELECTED_MODEL, CHARACTER_IMAGE_PATH, CHARACTER_PROMPT,
+                    lambda path: upload_media_with_retry(path, "图片"), send_message_with_retry
+                )
+                
+                # 显示角色分析结果
+                logger.info(f"[{i}/{total_videos}] 角色特征分析完成:")
+                logger.info("="*50)
+                logger.info(character_response.text)
+                logger.info("="*50)
+                
+                # 处理视频
+                if process_single_video(video_path, model, chat, image_file, total_videos, i, character_response, video_futures[i - 1]):
+                    successful += 1
+                    logger.info(f"[{i}/{total_videos}] 视频处理成功完成")
+                else:
+                    failed += 1
+                    logger.error(f"[{i}/{total_videos}] 视频处理失败")
+                
+                # 关闭当前会话
+                logger.info(f"[{i}/{total_videos}] 关闭当前会话...")
+                chat = None
+        
+        finally:
+            # 出错时取消尚未开始的上传
+            upload_executor.shutdown(cancel_futures=True)
         
         # 输出最终统计
         end_time = time.time()
@@ -452,36 +446,21 @@ def update_json_content(json_data, part_number):
     return json_data
 
 def get_video_info(input_file):
-    """获取视频信息"""
-    try:
-        cmd = ['ffmpeg', '-i', str(input_file)]
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            encoding='utf-8',
-            errors='ignore'
-        )
-        
-        _, stderr = process.communicate()
-        
-        duration = 0
-        for line in stderr.split('\n'):
-            if 'Duration' in line:
-                time_str = line.split('Duration: ')[1].split(',')[0].strip()
-                h, m, s = time_str.split(':')
-                duration = float(h) * 3600 + float(m) * 60 + float(s)
-                break
-                
-        if duration == 0:
-            logger.warning("无法从视频中获取时长信息")
-            
-        return duration
-        
-    except Exception as e:
-        logger.error(f"获取视频信息失败: {str(e)}")
-        return 0
+    """获取视频时长（秒）"""
+    duration = get_duration(str(input_file))
+    if duration == 0:
+        logger.warning("无法从视频中获取时长信息")
+    return duration
+
+def main():
+    global CHARACTER_IMAGE_PATH
+    parser = argparse.ArgumentParser(description="批量视频分析")
+    parser.add_argument('--video', action='append', help="视频路径，可重复指定；不指定时弹窗选择")
+    parser.add_argument('--image', help="角色图片路径，默认使用 CHARACTER_IMAGE_PATH")
+    args = parser.parse_args()
+    if args.image:
+        CHARACTER_IMAGE_PATH = args.image
+    batch_process(args.video)
 
 if __name__ == "__main__":
-    batch_process()
+    main()
@@ -0,0 +1,157 @@
+"""
+媒体文件探测
+
+通过一次 ffprobe -print_format json 调用读取时长、码率、音视频流信息，
+需要时顺带读取关键帧时间（只读包信息，不解码）。结果按 路径+修改时间+大小
+缓存，同一文件重复探测不会再启动进程。没有 ffprobe 时退回解析 ffmpeg -i 的输出。
+"""
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = 512
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+
+
+def _cache_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _run(cmd):
+    return subprocess.run(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        encoding='utf-8',
+        errors='ignore'
+    )
+
+
+def _ffprobe(path, with_keyframes):
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-print_format', 'json',
+        '-show_format', '-show_streams',
+    ]
+    if with_keyframes:
+        cmd += ['-show_entries', 'packet=stream_index,pts_time,flags']
+    cmd.append(path)
+
+    result = _run(cmd)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"ffprobe 返回 {result.returncode}")
+    data = json.loads(result.stdout or '{}')
+
+    fmt = data.get('format', {})
+    streams = data.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    info = {
+        'duration': _to_float(fmt.get('duration')) or _to_float((video or {}).get('duration')) or 0,
+        'bit_rate': int(fmt['bit_rate']) if fmt.get('bit_rate', '').isdigit() else None,
+        'size': int(fmt['size']) if fmt.get('size', '').isdigit() else os.path.getsize(path),
+        'format_name': fmt.get('format_name'),
+        'streams': streams,
+        'video': video,
+        'audio': audio,
+    }
+
+    if with_keyframes:
+        video_index = video.get('index') if video else None
+        info['keyframes'] = sorted(
+            float(p['pts_time'])
+            for p in data.get('packets', [])
+            if p.get('stream_index') == video_index and 'K' in p.get('flags', '')
+            and _to_float(p.get('pts_time')) is not None
+        )
+    return info
+
+
+def _ffmpeg_fallback(path):
+    """没有 ffprobe 时只能从 ffmpeg -i 的输出中读取时长"""
+    result = _run(['ffmpeg', '-i', path])
+    match = DURATION_PATTERN.search(result.stderr)
+    if not match:
+        raise RuntimeError("无法获取视频时长")
+    hours, minutes, seconds = match.groups()
+    return {
+        'duration': int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+        'bit_rate': None,
+        'size': os.path.getsize(path),
+        'format_name': None,
+        'streams': [],
+        'video': None,
+        'audio': None,
+    }
+
+
+def probe(path, with_keyframes=False):
+    """
+    探测媒体文件信息
+
+    Args:
+        path: 文件路径
+        with_keyframes: 是否同时读取视频关键帧时间
+
+    Returns:
+        dict: duration, bit_rate, size, format_name, streams, video, audio[, keyframes]
+    """
+    key = _cache_key(path)
+    with _cache_lock:
+        info = _cache.get(key)
+        if info is not None and (not with_keyframes or 'keyframes' in info):
+            _cache.move_to_end(key)
+            return info
+
+    try:
+        info = _ffprobe(path, with_keyframes)
+    except FileNotFoundError:
+        logger.warning("未找到 ffprobe，使用 ffmpeg 读取时长")
+        info = _ffmpeg_fallback(path)
+        if with_keyframes:
+            info['keyframes'] = []
+
+    with _cache_lock:
+        _cache[key] = info
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
+
+
+def get_duration(path):
+    """获取媒体时长（秒），失败时返回0"""
+    try:
+        return probe(path)['duration']
+    except Exception as e:
+        logger.error(f"获取视频信息失败: {str(e)}")
+        return 0
+
+
+def get_keyframes(path):
+    """获取视频关键帧时间（秒），失败时返回空列表"""
+    try:
+        return probe(path, with_keyframes=True)['keyframes']
+    except Exception as e:
+        logger.warning(f"读取关键帧失败: {str(e)}")
+        return []
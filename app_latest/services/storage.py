@@ -0,0 +1,403 @@
+"""
+媒体文件存储后端
+
+所有媒体文件（头像、参考/训练/录音音频、生成的语音、对话记录）都通过
+存储键（如 ``audio/record_xxx.wav``）读写，具体落在本地磁盘还是 S3 兼容
+对象存储（AWS S3 / MinIO 等）由配置 ``STORAGE_BACKEND`` 决定。
+"""
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Iterator, Optional, Union
+
+import aiofiles
+
+from core.config import settings
+
+logger = logging.getLogger("storage")
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class StorageError(Exception):
+    """存储操作失败"""
+
+
+class StorageBackend:
+    """存储后端接口，键统一使用 '/' 分隔的相对路径"""
+
+    # ==================== #
+    #       URL 相关        #
+    # ==================== #
+    def url_for(self, key: str) -> str:
+        """生成可供前端访问的URL"""
+        raise NotImplementedError
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        """将 url_for 生成的URL（或数据库中保存的路径）还原为存储键，无法识别时返回None"""
+        if not url:
+            return None
+        url = url.split("?", 1)[0]
+        prefix = self.url_prefix.rstrip("/")
+        if prefix and url.startswith(prefix + "/"):
+            return url[len(prefix) + 1:]
+        if url.startswith("http://") or url.startswith("https://"):
+            return None
+        # 兼容 "static/audio/xxx" 以及直接保存的存储键
+        url = url.lstrip("/")
+        if url.startswith("static/"):
+            return url[len("static/"):]
+        if ":" in url:
+            # 例如 speech:xxx 之类的远端音色URI，不是本地文件
+            return None
+        return url
+
+    @property
+    def url_prefix(self) -> str:
+        raise NotImplementedError
+
+    # ==================== #
+    #       同步接口        #
+    # ==================== #
+    def save(self, key: str, data: Union[bytes, BinaryIO], content_type: Optional[str] = None) -> int:
+        """保存字节或文件对象，返回写入的字节数"""
+        raise NotImplementedError
+
+    def iter_chunks(self, key: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        """按块读取文件内容"""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> bool:
+        """删除文件，文件不存在时返回False"""
+        raise NotImplementedError
+
+    def size(self, key: str) -> Optional[int]:
+        """返回文件大小，文件不存在时返回None"""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        return self.size(key) is not None
+
+    # ==================== #
+    #       异步接口        #
+    # ==================== #
+    async def put_stream(
+        self,
+        key: str,
+        chunks: AsyncIterable[bytes],
+        content_type: Optional[str] = None,
+    ) -> int:
+        """流式写入，返回写入的字节数"""
+        raise NotImplementedError
+
+    async def get_stream(self, key: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """流式读取"""
+        iterator = await asyncio.to_thread(self.iter_chunks, key, chunk_size)
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, None)
+            if chunk is None:
+                break
+            yield chunk
+
+    async def read(self, key: str) -> bytes:
+        """读取完整文件内容"""
+        parts = []
+        async for chunk in self.get_stream(key):
+            parts.append(chunk)
+        return b"".join(parts)
+
+    async def delete_async(self, key: str) -> bool:
+        return await asyncio.to_thread(self.delete, key)
+
+    async def size_async(self, key: str) -> Optional[int]:
+        return await asyncio.to_thread(self.size, key)
+
+    async def exists_async(self, key: str) -> bool:
+        return await self.size_async(key) is not None
+
+
+class LocalStorage(StorageBackend):
+    """本地文件系统存储，目录即 /static 挂载目录"""
+
+    def __init__(self, root: str = "static", url_prefix: str = "/static"):
+        self.root = Path(root)
+        self._url_prefix = url_prefix
+
+    @property
+    def url_prefix(self) -> str:
+        return self._url_prefix
+
+    def url_for(self, key: str) -> str:
+        return f"{self._url_prefix.rstrip('/')}/{key.lstrip('/')}"
+
+    def path_for(self, key: str) -> Path:
+        """存储键对应的本地路径，禁止越出根目录"""
+        root = self.root.resolve()
+        path = (root / key.lstrip("/")).resolve()
+        if root != path and root not in path.parents:
+            raise StorageError(f"非法的存储路径: {key}")
+        return path
+
+    def _temp_path(self, path: Path) -> Path:
+        return path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+
+    def save(self, key: str, data: Union[bytes, BinaryIO], content_type: Optional[str] = None) -> int:
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self._temp_path(path)
+        try:
+            with open(temp_path, "wb") as f:
+                if isinstance(data, (bytes, bytearray)):
+                    f.write(data)
+                else:
+                    shutil.copyfileobj(data, f, DEFAULT_CHUNK_SIZE)
+            os.replace(temp_path, path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        return path.stat().st_size
+
+    def iter_chunks(self, key: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        path = self.path_for(key)
+        if not path.is_file():
+            raise FileNotFoundError(key)
+        return self._iter_file(path, chunk_size)
+
+    def _iter_file(self, path: Path, chunk_size: int) -> Iterator[bytes]:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def delete(self, key: str) -> bool:
+        path = self.path_for(key)
+        if not path.is_file():
+            return False
+        path.unlink()
+        return True
+
+    def size(self, key: str) -> Optional[int]:
+        path = self.path_for(key)
+        return path.stat().st_size if path.is_file() else None
+
+    async def put_stream(
+        self,
+        key: str,
+        chunks: AsyncIterable[bytes],
+        content_type: Optional[str] = None,
+    ) -> int:
+        path = self.path_for(key)
+        await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+        temp_path = self._temp_path(path)
+        written = 0
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+                    written += len(chunk)
+            await asyncio.to_thread(os.replace, temp_path, path)
+        finally:
+            if await asyncio.to_thread(temp_path.exists):
+                await asyncio.to_thread(temp_path.unlink)
+        return written
+
+    async def get_stream(self, key: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        path = self.path_for(key)
+        if not await asyncio.to_thread(path.is_file):
+            raise FileNotFoundError(key)
+        async with aiofiles.open(path, "rb") as f:
+            while True:
+                chunk = await f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+class S3Storage(StorageBackend):
+    """S3 兼容对象存储（AWS S3、MinIO 等）"""
+
+    # S3 分片上传要求除最后一片外每片不小于5MB
+    MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+        region: Optional[str] = None,
+        public_url: Optional[str] = None,
+        url_expire: int = 3600,
+    ):
+        try:
+            import boto3
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise StorageError("请安装boto3库以支持S3存储: pip install boto3")
+
+        self.bucket = bucket
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.url_expire = url_expire
+        self._client_error = ClientError
+        # MinIO 等本地替身只支持 path-style 访问
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+            config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+        )
+
+    @property
+    def url_prefix(self) -> str:
+        return self.public_url or ""
+
+    def url_for(self, key: str) -> str:
+        key = key.lstrip("/")
+        if self.public_url:
+            return f"{self.public_url}/{key}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=self.url_expire,
+        )
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        if url and not self.public_url and (url.startswith("http://") or url.startswith("https://")):
+            # 预签名URL: <endpoint>/<bucket>/<key>?X-Amz-...
+            path = url.split("?", 1)[0].split("://", 1)[1].split("/", 1)[-1]
+            if path.startswith(self.bucket + "/"):
+                return path[len(self.bucket) + 1:]
+            return None
+        return super().key_from_url(url)
+
+    def _is_not_found(self, error) -> bool:
+        code = error.response.get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def save(self, key: str, data: Union[bytes, BinaryIO], content_type: Optional[str] = None) -> int:
+        extra = {"ContentType": content_type} if content_type else {}
+        if isinstance(data, (bytes, bytearray)):
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=bytes(data), **extra)
+            return len(data)
+        # upload_fileobj 自动分片流式上传
+        self.client.upload_fileobj(data, self.bucket, key, ExtraArgs=extra or None)
+        return self.size(key) or 0
+
+    def iter_chunks(self, key: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+        except self._client_error as e:
+            if self._is_not_found(e):
+                raise FileNotFoundError(key)
+            raise StorageError(str(e))
+        return self._iter_body(body, chunk_size)
+
+    def _iter_body(self, body, chunk_size: int) -> Iterator[bytes]:
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    def delete(self, key: str) -> bool:
+        if not self.exists(key):
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+        return True
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        except self._client_error as e:
+            if self._is_not_found(e):
+                return None
+            raise StorageError(str(e))
+
+    async def put_stream(
+        self,
+        key: str,
+        chunks: AsyncIterable[bytes],
+        content_type: Optional[str] = None,
+    ) -> int:
+        extra = {"ContentType": content_type} if content_type else {}
+        buffer = bytearray()
+        upload_id = None
+        parts = []
+        written = 0
+
+        async def flush_part():
+            part_number = len(parts) + 1
+            response = await asyncio.to_thread(
+                self.client.upload_part,
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                PartNumber=part_number, Body=bytes(buffer),
+            )
+            parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+            buffer.clear()
+
+        try:
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                written += len(chunk)
+                if len(buffer) >= self.MULTIPART_CHUNK_SIZE:
+                    if upload_id is None:
+                        response = await asyncio.to_thread(
+                            self.client.create_multipart_upload,
+                            Bucket=self.bucket, Key=key, **extra,
+                        )
+                        upload_id = response["UploadId"]
+                    await flush_part()
+
+            if upload_id is None:
+                # 小文件直接一次性上传
+                await asyncio.to_thread(
+                    self.client.put_object,
+                    Bucket=self.bucket, Key=key, Body=bytes(buffer), **extra,
+                )
+                return written
+
+            if buffer:
+                await flush_part()
+            await asyncio.to_thread(
+                self.client.complete_multipart_upload,
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+            return written
+        except Exception:
+            if upload_id is not None:
+                await asyncio.to_thread(
+                    self.client.abort_multipart_upload,
+                    Bucket=self.bucket, Key=key, UploadId=upload_id,
+                )
+            raise
+
+
+def create_storage() -> StorageBackend:
+    """根据配置创建存储后端"""
+    backend = settings.STORAGE_BACKEND.lower()
+    if backend == "local":
+        return LocalStorage(settings.STORAGE_LOCAL_ROOT, settings.STORAGE_LOCAL_URL_PREFIX)
+    if backend == "s3":
+        return S3Storage(
+            bucket=settings.S3_BUCKET,
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            access_key=settings.S3_ACCESS_KEY,
+            secret_key=settings.S3_SECRET_KEY,
+            region=settings.S3_REGION,
+            public_url=settings.S3_PUBLIC_URL,
+            url_expire=settings.S3_URL_EXPIRE_SECONDS,
+        )
+    raise StorageError(f"不支持的存储后端: {settings.STORAGE_BACKEND}")
+
+
+# 创建存储实例
+storage = create_storage()
@@ -11,17 +11,27 @@ from pathlib import Path
 from typing import Dict, Any, Tuple, List, Optional
 import datetime
 from core.config import settings
+from core.metrics import ASR_IN_PROGRESS, stage_timer, track_external_call
+from core.tracing import KIND_CLIENT, start_span, traced
 #from web_app import app, get_all_digital_humans, get_digital_human, save_audio_to_database, save_chat_to_database, Document
 from vosk import Model, KaldiRecognizer
 import wave
 import json
 from .deepseek import deepseek_service
+from .storage import storage
+from utils.media_sniff import SNIFF_SIZE, MediaValidationError, audio_metadata, sniff_media
 from db import app_db
 from typing import Optional
-import aiofiles  
 from openai import OpenAI
 from openai import AsyncOpenAI
-import asyncio 
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+# 生成语音的存储键前缀
+SPEECH_AUDIO_PREFIX = "uploads/digital_humans/audio"
+# Vosk 模型要求的采样率
+ASR_SAMPLE_RATE = 16000
 
 class VoiceService:
     def __init__(self):
@@ -29,46 +39,28 @@ class VoiceService:
         self.headers = {"Authorization": f"Bearer {settings.TTS_API_KEY}"}
         self.output_dir = "/static/document"
     
+    @traced("voice.transcribe_audio_file")
     async def transcribe_audio_file(self, audio_path: str)-> str:
         """从音频文件转录文本"""
+        ASR_IN_PROGRESS.inc()
         try:
             # 加载Vosk模型
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            model_path = os.path.join(current_dir, "vosk-model-small-cn-0.22")
-            model = Model(model_path)
-            full_text = []
+            with stage_timer("asr_model_load"):
+                model = self._load_asr_model()
 
             # 下载文件
-            file_content = await self._read_local_file(audio_path)
+            with stage_timer("file_read"):
+                file_content = await self._read_local_file(audio_path)
             
             # 验证并获取文件类型
             content_type = self._validate_audio_file(file_content)
-            
-            # 生成唯一文件名
-            file_ext = self._get_file_extension(content_type)
-            unique_name = f"train_{uuid.uuid4()}_{int(time.time())}{file_ext}"
 
             # 使用pydub处理音频
             try:
-                from pydub import AudioSegment
-                import io
-                
-                # 将音频数据转换为AudioSegment对象
-                if content_type == "audio/wav":
-                    audio = AudioSegment.from_wav(io.BytesIO(file_content))
-                else:  # mp3
-                    audio = AudioSegment.from_mp3(io.BytesIO(file_content))
-                
-                # 转换为16kHz采样率
-                audio = audio.set_frame_rate(16000)
-                # 转换为单声道
-                audio = audio.set_channels(1)
-                
-                # 导出为WAV格式
-                wav_io = io.BytesIO()
-                audio.export(wav_io, format="wav")
-                wav_io.seek(0)
-                file_content = wav_io.read()
+                with stage_timer("decode"):
+                    audio = self._decode_audio(file_content, content_type)
+                with stage_timer("resample"):
+                    file_content = self._resample_to_wav(audio)
                 
             except ImportError:
                 raise HTTPException(
@@ -81,26 +73,8 @@ class VoiceService:
                     detail=f"音频处理失败: {str(e)}"
                 )
 
-            # 创建识别器
-            sample_rate = 16000
-            recognizer = KaldiRecognizer(model, sample_rate)
-            
-            # 处理音频数据
-            with wave.open(io.BytesIO(file_content), 'rb') as wf:
-                while True:
-                    data = wf.readframes(4000)
-                    if not data:
-                        break
-                    if recognizer.AcceptWaveform(data):
-                        result = json.loads(recognizer.Result())
-                        full_text.append(result.get("text", ""))
-
-            final_result = json.loads(recognizer.FinalResult())
-            full_text.append(final_result.get("text", ""))
-            
-            final_text = "".join(full_text)
-            # 处理空格
-            final_text = final_text.replace(" ", "")
+            with stage_timer("asr"):
+                final_text = self._recognize(model, file_content)
             
             if not final_text:
                 raise HTTPException(
@@ -117,6 +91,46 @@ class VoiceService:
                 status_code=500,
                 detail=f"语音识别失败: {str(e)}"
             )
+        finally:
+            ASR_IN_PROGRESS.dec()
+
+    def _load_asr_model(self):
+        """加载Vosk模型"""
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        model_path = os.path.join(current_dir, "vosk-model-small-cn-0.22")
+        return Model(model_path)
+
+    def _decode_audio(self, file_content: bytes, content_type: str):
+        """将WAV/MP3数据解码为pydub的AudioSegment"""
+        from pydub import AudioSegment
+
+        if content_type == "audio/wav":
+            return AudioSegment.from_wav(io.BytesIO(file_content))
+        return AudioSegment.from_mp3(io.BytesIO(file_content))
+
+    def _resample_to_wav(self, audio) -> bytes:
+        """转换为16kHz单声道WAV"""
+        audio = audio.set_frame_rate(ASR_SAMPLE_RATE).set_channels(1)
+        wav_io = io.BytesIO()
+        audio.export(wav_io, format="wav")
+        return wav_io.getvalue()
+
+    def _recognize(self, model, wav_content: bytes) -> str:
+        """用Vosk识别16kHz单声道WAV，返回去掉空格的文本"""
+        recognizer = KaldiRecognizer(model, ASR_SAMPLE_RATE)
+        full_text = []
+        with wave.open(io.BytesIO(wav_content), 'rb') as wf:
+            while True:
+                data = wf.readframes(4000)
+                if not data:
+                    break
+                if recognizer.AcceptWaveform(data):
+                    result = json.loads(recognizer.Result())
+                    full_text.append(result.get("text", ""))
+
+        final_result = json.loads(recognizer.FinalResult())
+        full_text.append(final_result.get("text", ""))
+        return "".join(full_text).replace(" ", "")
 
     
     async def upload_and_train(self, model: str, custom_name: str, id: int,audio_url:str) -> dict:
@@ -136,12 +150,14 @@ class VoiceService:
 
             files = {"file": (unique_name, file_content, content_type)}
             data = {"model": model, "customName": custom_name, "text": "你好，请问今天的天气怎么样？"}
-            response = await client.post(
-                f"{self.api_url}/uploads/audio/voice",
-                headers=self.headers,
-                files=files,
-                data=data
-            )
+            with track_external_call("siliconflow_voice_upload") as call:
+                response = await client.post(
+                    f"{self.api_url}/uploads/audio/voice",
+                    headers=self.headers,
+                    files=files,
+                    data=data
+                )
+                call.status_code = response.status_code
             if response.status_code != 200:
                 raise Exception(f"Training failed: {response.text}")
             
@@ -155,10 +171,12 @@ class VoiceService:
 
             return response.json()
 
+    @traced("voice.generate_audio")
     async def generate_audio(self, audio_url:str , id:str, model_name: str) -> dict:
         async with httpx.AsyncClient() as client:
             db_manager = app_db.DatabaseManager()
-            digital_human = db_manager.get_digital_human(id)
+            with stage_timer("db_read"):
+                digital_human = db_manager.get_digital_human(id)
             if not digital_human:
                 raise HTTPException(status_code=404, detail="数字人不存在")
             
@@ -171,55 +189,71 @@ class VoiceService:
             if not final_result:
                 raise HTTPException(status_code=400, detail="语音识别失败")
 
-            db_manager.save_chat_to_database(final_result, id)  # 把记录存入库中
+            with stage_timer("db_write"):
+                db_manager.save_chat_to_database(final_result, id)  # 把记录存入库中
 
-            text_res = await deepseek_service.get_response(description, final_result)  # 接入ds得到回答
+            with stage_timer("llm"):
+                text_res = await deepseek_service.get_response(description, final_result)  # 接入ds得到回答
             if not text_res:
                 raise HTTPException(status_code=500, detail="获取AI回复失败")
 
-            db_manager.save_chat_to_database(text_res, id)  # 把记录存入库中
+            with stage_timer("db_write"):
+                db_manager.save_chat_to_database(text_res, id)  # 把记录存入库中
 
             client = AsyncOpenAI(
-                api_key="sk-swldhdfbzrwtesarrhxwbovcivpzezfshaxvcxrtwvdzylss",
-                base_url="https://api.siliconflow.cn/v1"
+                api_key=settings.TTS_API_KEY,
+                base_url=self.api_url
             )
 
             try:
-                async with client.audio.speech.with_streaming_response.create(
-                    model=model_name,
-                    voice=video_path,
-                    input=text_res,
-                    response_format="mp3"
-                ) as response:
-                    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                    filename = f"speech_{timestamp}.mp3"
-                    
-                    # 确保输出目录存在
-                    output_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                                            "static", "uploads", "digital_humans", "audio")
-                    os.makedirs(output_dir, exist_ok=True)
-                    
-                    relative_path = f"/static/uploads/digital_humans/audio/{filename}"
-                    absolute_path = os.path.join(output_dir, filename)
-                    
-                    async with aiofiles.open(absolute_path, "wb") as f:
-                        async for chunk in response.iter_bytes():
-                            await f.write(chunk)
-
-                if not await asyncio.to_thread(os.path.exists, absolute_path):
+                with stage_timer("tts"), track_external_call("siliconflow_tts") as call, \
+                        start_span("siliconflow.tts", KIND_CLIENT, model=model_name) as span:
+                    async with client.audio.speech.with_streaming_response.create(
+                        model=model_name,
+                        voice=video_path,
+                        input=text_res,
+                        response_format="mp3"
+                    ) as response:
+                        call.status_code = response.status_code
+                        span.set_attribute("http.status_code", response.status_code)
+                        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+                        filename = f"speech_{timestamp}.mp3"
+                        file_key = f"{SPEECH_AUDIO_PREFIX}/{filename}"
+                        
+                        # 边接收边写入存储后端，同时保留文件头用于提取时长
+                        header = bytearray()
+
+                        async def capture_header(chunks):
+                            async for chunk in chunks:
+                                if len(header) < SNIFF_SIZE:
+                                    header.extend(chunk[:SNIFF_SIZE - len(header)])
+                                yield chunk
+
+                        file_size = await storage.put_stream(file_key, capture_header(response.iter_bytes()), "audio/mpeg")
+                        span.set_attribute("audio.bytes", file_size)
+
+                if not await storage.exists_async(file_key):
                     raise HTTPException(500, "文件保存失败")
                 
-                result = db_manager.save_audio_to_database(
-                    filename=filename,
-                    filepath=relative_path,
-                    digital_human_id=id,
-                )
+                metadata = self._extract_audio_metadata(bytes(header), file_size)
+                
+                with stage_timer("db_write"):
+                    result = db_manager.save_audio_to_database(
+                        filename=filename,
+                        filepath=file_key,
+                        digital_human_id=id,
+                        file_size=file_size,
+                        duration=metadata["duration"],
+                        sample_rate=metadata["sample_rate"],
+                    )
                 if not result["success"]:
                     print(f"音频保存到数据库失败: {result.get('error', '未知错误')}")
                 
                 return {
-                    "audio_url": relative_path,
-                    "duration": 0.0  # 暂时返回0，后续可以添加音频时长计算
+                    "audio_url": storage.url_for(file_key),
+                    "duration": metadata["duration"] or 0.0,
+                    "sample_rate": metadata["sample_rate"],
+                    "file_size": file_size
                 }
                 
             except Exception as e:
@@ -228,37 +262,44 @@ class VoiceService:
     async def _read_local_file(self, file_path: str, max_size: int = 50 * 1024 * 1024) -> bytes:
         """从本地路径读取音频文件内容"""
         try:
-            # 处理URL路径
-            if file_path.startswith('http'):
+            # 处理外部URL路径（存储后端生成的URL除外）
+            if file_path.startswith('http') and not storage.key_from_url(file_path):
                 async with httpx.AsyncClient() as client:
                     response = await client.get(file_path)
                     if response.status_code != 200:
                         raise HTTPException(status_code=404, detail=f"无法下载音频文件: {file_path}")
                     return response.content
 
-            # 处理本地文件路径
-            if file_path.startswith('/'):
-                file_path = file_path[1:]  # 移除开头的斜杠
-            
-            # 获取当前工作目录
-            current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            full_path = os.path.join(current_dir, file_path)
+            # 将URL或路径转换为存储键
+            file_key = storage.key_from_url(file_path)
+            if not file_key:
+                raise HTTPException(status_code=404, detail=f"音频文件不存在: {file_path}")
             
-            # 检查文件是否存在
-            if not os.path.isfile(full_path):
+            # 获取文件大小（同时检查文件是否存在）
+            file_size = await storage.size_async(file_key)
+            if file_size is None:
                 raise HTTPException(status_code=404, detail=f"音频文件不存在: {file_path}")
             
-            # 获取文件大小
-            file_size = os.path.getsize(full_path)
             if file_size > max_size:
                 raise HTTPException(
                     status_code=413,
                     detail=f"音频文件过大 ({file_size//1024//1024}MB)，最大支持{max_size//1024//1024}MB"
                 )
             
-            # 异步读取文件内容
-            async with aiofiles.open(full_path, 'rb') as f:
-                content = await f.read()
+            # 流式读取，文件头校验通过后才继续读取剩余内容
+            parts = []
+            received = 0
+            validated = False
+            async with contextlib.aclosing(storage.get_stream(file_key)) as chunks:
+                async for chunk in chunks:
+                    parts.append(chunk)
+                    received += len(chunk)
+                    if not validated and received >= SNIFF_SIZE:
+                        self._validate_audio_header(b"".join(parts)[:SNIFF_SIZE], file_size)
+                        validated = True
+            content = b"".join(parts)
+            if not validated:
+                self._validate_audio_header(content, file_size)
             return content
         
         except HTTPException as e:
@@ -293,20 +334,37 @@ class VoiceService:
 
     def _validate_audio_file(self, content: bytes) -> str:
         """验证音频文件类型"""
-        header = content[:32]
-    
-        # WAV文件头
-        if header.startswith(b'RIFF') and b'WAVE' in header:
-            return "audio/wav"
-    
-    # MP3文件头（ID3或帧同步）
-        if header.startswith(b'ID3') or (header[0] == 0xFF and (header[1] & 0xE0) == 0xE0):
-            return "audio/mpeg"
-    
-        raise HTTPException(
-            status_code=415,
-            detail="不支持的音频格式，仅接受WAV/MP3文件"
-        )
+        return self._validate_audio_header(content[:SNIFF_SIZE], len(content))["content_type"]
+
+    def _validate_audio_header(self, header: bytes, total_size: Optional[int] = None) -> Dict[str, Any]:
+        """根据文件头验证音频格式和时长，不解码音频"""
+        try:
+            info = sniff_media(header, total_size)
+        except MediaValidationError:
+            info = None
+
+        if not info or info["kind"] != "audio":
+            raise HTTPException(
+                status_code=415,
+                detail="不支持的音频格式，仅接受WAV/MP3文件"
+            )
+
+        duration = info.get("duration")
+        if duration and duration > settings.UPLOAD_MAX_AUDIO_DURATION:
+            raise HTTPException(
+                status_code=413,
+                detail=f"音频时长过长 ({duration:.0f}秒)，最大支持{settings.UPLOAD_MAX_AUDIO_DURATION}秒"
+            )
+        return info
+
+    def _extract_audio_metadata(self, header: bytes, file_size: Optional[int]) -> Dict[str, Any]:
+        """从文件头提取时长、采样率等信息，无法识别时返回空值"""
+        try:
+            info = sniff_media(header, file_size)
+        except MediaValidationError as e:
+            logger.warning(f"无法解析音频文件头: {e}")
+            info = {}
+        return audio_metadata(info, file_size)
 
     def _get_file_extension(self, content_type: str) -> str:
         """根据类型获取扩展名"""
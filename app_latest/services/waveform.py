@@ -0,0 +1,170 @@
+"""
+Waveform peak generation
+
+Computes a compact min/max peak array for an audio file so the frontend can
+draw a real waveform without downloading and decoding the audio. The
+sidecar uses the audiowaveform JSON layout (version 2, 8-bit, interleaved
+min/max pairs), which peaks.js and wavesurfer can load directly.
+"""
+import asyncio
+import io
+import json
+import logging
+import wave
+from typing import Any, Dict, Optional, Tuple
+
+from core.metrics import record_cache
+from services.storage import storage
+from utils.media_sniff import SNIFF_SIZE, MediaValidationError, sniff_media
+
+logger = logging.getLogger(__name__)
+
+# 默认输出的峰值点数（每个点包含一对 min/max）
+DEFAULT_PEAK_COUNT = 800
+PEAKS_SUFFIX = ".peaks.json"
+
+
+def peaks_key(audio_key: str) -> str:
+    """音频文件对应的峰值 sidecar 存储键"""
+    return f"{audio_key}{PEAKS_SUFFIX}"
+
+
+def _require_numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("请安装numpy库以支持波形计算: pip install numpy")
+    return np
+
+
+def decode_wav(content: bytes):
+    """将 PCM WAV 解码为 (frames, channels) 的 float32 数组"""
+    np = _require_numpy()
+    with wave.open(io.BytesIO(content), "rb") as wf:
+        channels = wf.getnchannels()
+        sample_width = wf.getsampwidth()
+        sample_rate = wf.getframerate()
+        raw = wf.readframes(wf.getnframes())
+
+    if sample_width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    elif sample_width == 3:
+        # 24位样本补齐为32位后再转换
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((packed.shape[0], 4), dtype=np.uint8)
+        padded[:, 1:] = packed
+        samples = padded.view("<i4").reshape(-1).astype(np.float32) / 2147483648
+    elif sample_width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise MediaValidationError(f"不支持的WAV采样位数: {sample_width * 8}")
+
+    return samples.reshape(-1, channels), sample_rate
+
+
+def decode_mp3(content: bytes):
+    """使用 pydub 将 MP3 解码为 (frames, channels) 的 float32 数组"""
+    np = _require_numpy()
+    try:
+        from pydub import AudioSegment
+    except ImportError:
+        raise RuntimeError("请安装pydub库以支持音频处理: pip install pydub")
+
+    audio = AudioSegment.from_file(io.BytesIO(content), format="mp3")
+    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    samples /= float(1 << (8 * audio.sample_width - 1))
+    return samples.reshape(-1, audio.channels), audio.frame_rate
+
+
+def decode_audio(content: bytes) -> Tuple[Any, int]:
+    """根据文件头选择解码方式"""
+    info = sniff_media(content[:SNIFF_SIZE], len(content))
+    if info["kind"] != "audio":
+        raise MediaValidationError("不是音频文件")
+    if info["content_type"] == "audio/wav" and info.get("codec") == "pcm":
+        return decode_wav(content)
+    if info["content_type"] == "audio/mpeg":
+        return decode_mp3(content)
+    raise MediaValidationError(f"不支持的音频编码: {info.get('codec')}")
+
+
+def compute_peaks(samples, sample_rate: int, peak_count: int = DEFAULT_PEAK_COUNT) -> Dict[str, Any]:
+    """
+    计算 min/max 峰值数组
+
+    Args:
+        samples: (frames, channels) 的 float32 数组，取值范围 [-1, 1]
+        sample_rate: 采样率
+        peak_count: 输出的峰值点数
+
+    Returns:
+        Dict: audiowaveform JSON 格式的数据
+    """
+    np = _require_numpy()
+    frames = samples.shape[0]
+    samples_per_pixel = max(1, -(-frames // peak_count))
+    length = -(-frames // samples_per_pixel)
+
+    # 空音频没有可计算的桶，返回空峰值
+    data = []
+    if frames:
+        # 补零到整桶后一次性计算每个桶的最小/最大值，多声道合并到同一个桶中
+        padded = np.zeros((length * samples_per_pixel, samples.shape[1]), dtype=np.float32)
+        padded[:frames] = samples
+        buckets = padded.reshape(length, -1)
+        mins = np.clip(np.round(buckets.min(axis=1) * 127), -128, 127).astype(np.int8)
+        maxs = np.clip(np.round(buckets.max(axis=1) * 127), -128, 127).astype(np.int8)
+
+        peaks = np.empty(length * 2, dtype=np.int8)
+        peaks[0::2] = mins
+        peaks[1::2] = maxs
+        data = peaks.tolist()
+
+    return {
+        "version": 2,
+        "channels": 1,
+        "sample_rate": sample_rate,
+        "samples_per_pixel": samples_per_pixel,
+        "bits": 8,
+        "length": int(length),
+        "duration": round(frames / sample_rate, 3) if sample_rate else 0,
+        "data": data,
+    }
+
+
+def generate_peaks_bytes(content: bytes, peak_count: int = DEFAULT_PEAK_COUNT) -> bytes:
+    """解码音频并生成紧凑的峰值 JSON"""
+    samples, sample_rate = decode_audio(content)
+    peaks = compute_peaks(samples, sample_rate, peak_count)
+    return json.dumps(peaks, separators=(",", ":")).encode("utf-8")
+
+
+async def generate_peaks(audio_key: str, peak_count: int = DEFAULT_PEAK_COUNT) -> bytes:
+    """为存储中的音频生成峰值 sidecar 并保存，返回 JSON 内容"""
+    content = await storage.read(audio_key)
+    data = await asyncio.to_thread(generate_peaks_bytes, content, peak_count)
+    await asyncio.to_thread(storage.save, peaks_key(audio_key), data, "application/json")
+    logger.info(f"波形峰值已生成: {peaks_key(audio_key)} ({len(data)} bytes)")
+    return data
+
+
+async def get_or_create_peaks(audio_key: str) -> Optional[bytes]:
+    """读取已有的峰值 sidecar，不存在时现场生成；音频不存在时返回None"""
+    sidecar = peaks_key(audio_key)
+    if await storage.exists_async(sidecar):
+        record_cache("waveform_peaks", True)
+        return await storage.read(sidecar)
+    record_cache("waveform_peaks", False)
+    if not await storage.exists_async(audio_key):
+        return None
+    return await generate_peaks(audio_key)
+
+
+async def precompute_peaks(audio_key: str) -> None:
+    """后台预计算峰值，失败时只记录日志"""
+    try:
+        await generate_peaks(audio_key)
+    except Exception as e:
+        logger.warning(f"波形峰值生成失败: {audio_key}, {e}")
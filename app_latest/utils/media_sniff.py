@@ -0,0 +1,276 @@
+"""
+Header-only media sniffing
+
+Identifies WAV / MP3 / JPEG / PNG files from their first bytes and reads
+audio parameters (sample rate, channels, duration) from container and
+frame headers, without decoding any audio.
+"""
+import os
+import struct
+from typing import Any, Dict, Optional
+
+# 嗅探时读取的文件头长度，足以覆盖常见的 ID3 标签和 WAV 头
+SNIFF_SIZE = 64 * 1024
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+# MPEG 音频帧头表，索引顺序: [version][layer][bitrate_index]
+# version: 3=MPEG1, 2=MPEG2, 0=MPEG2.5；layer: 3=Layer I, 2=Layer II, 1=Layer III
+_MPEG1_BITRATES = {
+    3: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+}
+_MPEG2_BITRATES = {
+    3: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    1: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+
+class MediaValidationError(ValueError):
+    """文件头无法识别或参数无效"""
+
+
+def sniff_media(header: bytes, total_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    根据文件头识别媒体类型并提取基本参数
+
+    Args:
+        header: 文件开头的若干字节（建议 SNIFF_SIZE）
+        total_size: 文件总大小（可选，用于估算时长）
+
+    Returns:
+        Dict: content_type, extension, kind 以及音频的 sample_rate/channels/duration 等
+
+    Raises:
+        MediaValidationError: 无法识别的文件格式
+    """
+    if header.startswith(PNG_MAGIC):
+        return {"kind": "image", "content_type": "image/png", "extension": ".png"}
+
+    if header.startswith(JPEG_MAGIC):
+        return {"kind": "image", "content_type": "image/jpeg", "extension": ".jpg"}
+
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return parse_wav_header(header, total_size)
+
+    if header.startswith(b"ID3") or _is_mp3_frame_at(header, 0):
+        return parse_mp3_header(header, total_size)
+
+    raise MediaValidationError("无法识别的文件格式")
+
+
+def parse_wav_header(header: bytes, total_size: Optional[int] = None) -> Dict[str, Any]:
+    """解析 RIFF/WAVE 头中的 fmt 和 data 块"""
+    info = {"kind": "audio", "content_type": "audio/wav", "extension": ".wav"}
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(header):
+        chunk_id = header[offset:offset + 4]
+        chunk_size = struct.unpack("<I", header[offset + 4:offset + 8])[0]
+        body = offset + 8
+
+        if chunk_id == b"fmt ":
+            if body + 16 > len(header):
+                break
+            audio_format, channels, sample_rate, byte_rate, _, bits = struct.unpack(
+                "<HHIIHH", header[body:body + 16]
+            )
+            fmt = (audio_format, channels, sample_rate, byte_rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                break
+            data_size = chunk_size
+            # 录音软件流式写入时可能来不及回填 data 大小
+            if total_size is not None and (data_size in (0, 0xFFFFFFFF) or body + data_size > total_size):
+                data_size = max(total_size - body, 0)
+            info["data_offset"] = body
+            info["data_size"] = data_size
+            break
+
+        # RIFF 块按2字节对齐
+        offset = body + chunk_size + (chunk_size & 1)
+
+    if fmt is None:
+        raise MediaValidationError("WAV文件缺少fmt块")
+
+    audio_format, channels, sample_rate, byte_rate, bits = fmt
+    if channels == 0 or sample_rate == 0 or byte_rate == 0:
+        raise MediaValidationError("WAV文件头参数无效")
+
+    info.update({
+        "codec": "pcm" if audio_format in (1, 0xFFFE) else f"wav_format_{audio_format}",
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "bits_per_sample": bits,
+        "bitrate": byte_rate * 8,
+    })
+    if "data_size" in info:
+        info["duration"] = round(info["data_size"] / byte_rate, 3)
+    return info
+
+
+def id3v2_size(header: bytes) -> int:
+    """ID3v2 标签总长度（含10字节标签头），没有标签时返回0"""
+    if len(header) < 10 or not header.startswith(b"ID3"):
+        return 0
+    size_bytes = header[6:10]
+    if any(b & 0x80 for b in size_bytes):
+        raise MediaValidationError("ID3标签长度无效")
+    # syncsafe 整数：每字节只用低7位
+    size = 0
+    for b in size_bytes:
+        size = (size << 7) | b
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def parse_mp3_frame_header(data: bytes, offset: int = 0) -> Optional[Dict[str, Any]]:
+    """解析单个 MPEG 音频帧头，无效时返回None"""
+    if offset + 4 > len(data):
+        return None
+    b1, b2, b3, b4 = data[offset:offset + 4]
+    if b1 != 0xFF or (b2 & 0xE0) != 0xE0:
+        return None
+
+    version = (b2 >> 3) & 0x03
+    layer = (b2 >> 1) & 0x03
+    bitrate_index = b3 >> 4
+    sample_rate_index = (b3 >> 2) & 0x03
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    table = _MPEG1_BITRATES if version == 3 else _MPEG2_BITRATES
+    bitrate = table[layer][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (b3 >> 1) & 0x01
+    channels = 1 if (b4 >> 6) == 3 else 2
+
+    if layer == 3:
+        samples_per_frame = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples_per_frame = 576 if (layer == 1 and version != 3) else 1152
+        frame_length = samples_per_frame // 8 * bitrate // sample_rate + padding
+
+    return {
+        "version": {3: "1", 2: "2", 0: "2.5"}[version],
+        "layer": 4 - layer,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "samples_per_frame": samples_per_frame,
+        "frame_length": frame_length,
+    }
+
+
+def _is_mp3_frame_at(data: bytes, offset: int) -> bool:
+    """offset 处是有效帧；若下一帧也在窗口内则要求其同样有效，以排除偶然的 0xFFE 字节"""
+    frame = parse_mp3_frame_header(data, offset)
+    if not frame:
+        return False
+    next_offset = offset + frame["frame_length"]
+    return next_offset + 4 > len(data) or parse_mp3_frame_header(data, next_offset) is not None
+
+
+def _find_mp3_frame(data: bytes, start: int) -> Optional[int]:
+    """从 start 开始查找第一个有效帧"""
+    offset = start
+    while offset + 4 <= len(data):
+        offset = data.find(b"\xff", offset)
+        if offset < 0:
+            return None
+        if _is_mp3_frame_at(data, offset):
+            return offset
+        offset += 1
+    return None
+
+
+def parse_vbr_header(data: bytes, frame_offset: int, frame: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    解析第一帧中的 Xing/Info 或 VBRI 标签，返回总帧数和音频字节数
+
+    编码器在可变码率文件的第一帧里记录这些信息，按帧数计算的时长是准确的
+    """
+    # Xing/Info 位于帧头和 side information 之后
+    if frame["version"] == "1":
+        side_info = 17 if frame["channels"] == 1 else 32
+    else:
+        side_info = 9 if frame["channels"] == 1 else 17
+    xing = frame_offset + 4 + side_info
+    if data[xing:xing + 4] in (b"Xing", b"Info") and xing + 8 <= len(data):
+        flags = struct.unpack(">I", data[xing + 4:xing + 8])[0]
+        pos = xing + 8
+        result = {"vbr_header": data[xing:xing + 4].decode("ascii")}
+        if flags & 0x01 and pos + 4 <= len(data):
+            result["frames"] = struct.unpack(">I", data[pos:pos + 4])[0]
+            pos += 4
+        if flags & 0x02 and pos + 4 <= len(data):
+            result["bytes"] = struct.unpack(">I", data[pos:pos + 4])[0]
+        return result
+
+    # VBRI 固定位于帧头之后32字节
+    vbri = frame_offset + 4 + 32
+    if data[vbri:vbri + 4] == b"VBRI" and vbri + 18 <= len(data):
+        audio_bytes, frames = struct.unpack(">II", data[vbri + 10:vbri + 18])
+        return {"vbr_header": "VBRI", "frames": frames, "bytes": audio_bytes}
+
+    return None
+
+
+def parse_mp3_header(header: bytes, total_size: Optional[int] = None) -> Dict[str, Any]:
+    """跳过 ID3v2 标签，解析第一帧；优先按 Xing/VBRI 帧数计算时长，否则按固定码率估算"""
+    info = {"kind": "audio", "content_type": "audio/mpeg", "extension": ".mp3", "codec": "mp3"}
+    tag_size = id3v2_size(header)
+    if tag_size >= len(header):
+        # 标签（通常是封面图片）超出嗅探窗口，只能确认是 MP3
+        info["audio_offset"] = tag_size
+        return info
+
+    frame_offset = _find_mp3_frame(header, tag_size)
+    if frame_offset is None:
+        raise MediaValidationError("未找到有效的MP3音频帧")
+
+    frame = parse_mp3_frame_header(header, frame_offset)
+    info.update({
+        "sample_rate": frame["sample_rate"],
+        "channels": frame["channels"],
+        "bitrate": frame["bitrate"],
+        "audio_offset": frame_offset,
+    })
+
+    vbr = parse_vbr_header(header, frame_offset, frame)
+    if vbr and vbr.get("frames"):
+        duration = vbr["frames"] * frame["samples_per_frame"] / frame["sample_rate"]
+        info["duration"] = round(duration, 3)
+        info["vbr_header"] = vbr["vbr_header"]
+        if vbr.get("bytes") and duration > 0:
+            info["bitrate"] = int(vbr["bytes"] * 8 / duration)
+    elif total_size is not None:
+        # 按固定码率估算
+        info["duration"] = round((total_size - frame_offset) * 8 / frame["bitrate"], 3)
+    return info
+
+
+def audio_metadata(info: Dict[str, Any], file_size: Optional[int] = None) -> Dict[str, Any]:
+    """从嗅探结果中取出需要持久化的音频元数据"""
+    return {
+        "duration": info.get("duration"),
+        "sample_rate": info.get("sample_rate"),
+        "channels": info.get("channels"),
+        "file_size": file_size,
+    }
+
+
+def probe_file(path: str) -> Dict[str, Any]:
+    """读取本地文件头并嗅探，文件不会被完整读取"""
+    with open(path, "rb") as f:
+        header = f.read(SNIFF_SIZE)
+    return sniff_media(header, os.path.getsize(path))
@@ -0,0 +1,209 @@
+"""
+进程内采样分析器
+
+线上 worker 变慢时不需要重新部署即可定位热点：
+- 后台线程按固定间隔读取所有线程的调用栈（sys._current_frames），输出 flamegraph.pl /
+  speedscope 可直接读取的 collapsed stack 格式；事件循环所在线程的栈以 event-loop
+  为根，阻塞在事件循环上的同步调用（如数据库查询）会直接显示在这一列下
+- 事件循环上的监测任务定期 sleep，用实际唤醒时间与预期的差值衡量事件循环延迟
+- 可选 tracemalloc 快照，对比开始和结束时按代码行统计的内存分配增量
+
+每个 worker 进程同一时间只允许一个分析会话，结果只反映处理该请求的 worker。
+"""
+import asyncio
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 事件循环延迟的探测间隔（秒）
+LOOP_LAG_INTERVAL = 0.05
+TRACEMALLOC_FRAMES = 10
+
+
+class ProfilerBusy(Exception):
+    """已有分析会话在运行"""
+
+
+def _short_path(filename: str) -> str:
+    """把源码路径缩短为 包/模块 形式，便于在火焰图中阅读"""
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    if filename.startswith(APP_DIR):
+        return os.path.relpath(filename, APP_DIR)
+    return os.path.basename(filename)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    一次分析会话
+
+    Args:
+        interval: 采样间隔（秒）
+        allocations: 是否记录 tracemalloc 内存分配增量
+        loop: 需要监测延迟的事件循环，默认为当前运行的事件循环
+    """
+
+    def __init__(self, interval: float = 0.01, allocations: bool = False,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.interval = interval
+        self.allocations = allocations
+        self.loop = loop or asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self.loop_lags: List[float] = []
+        self.started_at = None
+        self.stopped_at = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lag_task = None
+        self._snapshot = None
+        self._started_tracemalloc = False
+        self._allocation_diff = None
+
+    @property
+    def running(self) -> bool:
+        return self.started_at is not None and self.stopped_at is None
+
+    def start(self) -> None:
+        if self.allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._started_tracemalloc = True
+            self._snapshot = tracemalloc.take_snapshot()
+
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        self._lag_task = self.loop.create_task(self._watch_loop_lag())
+
+    def stop(self) -> Dict[str, Any]:
+        """停止采样并返回结果"""
+        if self.running:
+            self.stopped_at = time.time()
+            self._stop_event.set()
+            self._thread.join()
+            self._lag_task.cancel()
+
+            if self.allocations:
+                snapshot = tracemalloc.take_snapshot()
+                self._allocation_diff = self._diff_allocations(self._snapshot, snapshot)
+                self._snapshot = None
+                if self._started_tracemalloc:
+                    tracemalloc.stop()
+        return self.result()
+
+    def _sample_loop(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                root = "event-loop" if thread_id == self.loop_thread_id else names.get(thread_id, str(thread_id))
+                stack.append(root)
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    async def _watch_loop_lag(self) -> None:
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.loop_lags.append(max(0.0, self.loop.time() - start - LOOP_LAG_INTERVAL))
+
+    def _diff_allocations(self, before, after, limit: int = 30) -> List[Dict[str, Any]]:
+        ignored = (tracemalloc.__file__, __file__)
+        filters = [tracemalloc.Filter(False, path) for path in ignored]
+        stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+        return [
+            {
+                "location": f"{_short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                "size_diff_kb": round(stat.size_diff / 1024, 1),
+                "size_kb": round(stat.size / 1024, 1),
+                "count_diff": stat.count_diff,
+            }
+            for stat in stats[:limit]
+        ]
+
+    def collapsed(self) -> str:
+        """collapsed stack 格式：每行 "根;...;叶 次数" """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def loop_lag_summary(self) -> Dict[str, Any]:
+        lags = sorted(self.loop_lags)
+        if not lags:
+            return {"samples": 0}
+        return {
+            "samples": len(lags),
+            "mean_ms": round(sum(lags) / len(lags) * 1000, 2),
+            "p99_ms": round(lags[max(0, math.ceil(len(lags) * 0.99) - 1)] * 1000, 2),
+            "max_ms": round(lags[-1] * 1000, 2),
+            "over_100ms": sum(1 for lag in lags if lag > 0.1),
+        }
+
+    def result(self) -> Dict[str, Any]:
+        end = self.stopped_at or time.time()
+        loop_samples = sum(count for stack, count in self.stacks.items() if stack.startswith("event-loop;"))
+        return {
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "duration_seconds": round(end - self.started_at, 3) if self.started_at else 0,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "event_loop_samples": loop_samples,
+            "top_event_loop_stacks": [
+                {"stack": stack, "count": count}
+                for stack, count in self.stacks.most_common()
+                if stack.startswith("event-loop;")
+            ][:20],
+            "loop_lag": self.loop_lag_summary(),
+            "allocations": self._allocation_diff,
+        }
+
+
+_session: Optional[SamplingProfiler] = None
+_session_lock = threading.Lock()
+
+
+def start_session(interval: float, allocations: bool, max_seconds: Optional[float] = None) -> SamplingProfiler:
+    """开始分析会话，max_seconds 后自动停止；已有会话在运行时抛出 ProfilerBusy"""
+    global _session
+    with _session_lock:
+        if _session is not None and _session.running:
+            raise ProfilerBusy("已有分析会话在运行")
+        _session = SamplingProfiler(interval=interval, allocations=allocations)
+        _session.start()
+        if max_seconds:
+            _session.loop.call_later(max_seconds, _session.stop)
+        return _session
+
+
+def current_session() -> Optional[SamplingProfiler]:
+    return _session
+
+
+async def profile_for(seconds: float, interval: float, allocations: bool) -> SamplingProfiler:
+    """采样指定秒数后停止；等待期间事件循环照常处理其他请求"""
+    session = start_session(interval, allocations)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        session.stop()
+    return session
@@ -0,0 +1,214 @@
+"""
+Static media serving with strong ETags, long-lived caching and HTTP Range support
+"""
+import os
+import re
+import stat
+from email.utils import formatdate
+from mimetypes import guess_type
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+# 生成的语音、头像等文件名中带有 uuid 或微秒级时间戳，内容不会再变化
+CONTENT_ADDRESSED_PATTERN = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\d{8}_\d{6}_\d{6}",
+    re.IGNORECASE,
+)
+RANGE_PATTERN = re.compile(r"^(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+ZERO_COPY_EXTENSION = "http.response.zerocopysend"
+
+
+class RangeNotSatisfiable(Exception):
+    """请求的字节范围超出文件大小"""
+
+
+def make_strong_etag(stat_result: os.stat_result) -> str:
+    """
+    Build a strong ETag from inode, mtime (ns) and size
+    """
+    return f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def is_content_addressed(path: str) -> bool:
+    """
+    Whether the file name is unique per content (uuid / microsecond timestamp)
+    """
+    return bool(CONTENT_ADDRESSED_PATTERN.search(os.path.basename(path)))
+
+
+def parse_range_header(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single ``bytes=`` range into an inclusive (start, end) pair
+
+    Returns None when the header should be ignored (unknown unit or
+    multiple ranges), in which case the whole file is served.
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    match = RANGE_PATTERN.match(ranges.strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # bytes=-N 表示最后N个字节
+        suffix_length = int(last)
+        if suffix_length == 0 or file_size == 0:
+            raise RangeNotSatisfiable()
+        return max(file_size - suffix_length, 0), file_size - 1
+
+    start = int(first)
+    end = int(last) if last else file_size - 1
+    if start >= file_size or end < start:
+        raise RangeNotSatisfiable()
+    return start, min(end, file_size - 1)
+
+
+class MediaFileResponse(Response):
+    """
+    File response that streams either the whole file or a single byte range
+    """
+    chunk_size = CHUNK_SIZE
+
+    def __init__(
+        self,
+        path: str,
+        headers: dict,
+        media_type: str,
+        offset: int,
+        length: int,
+        status_code: int = 200,
+        method: str = "GET",
+        zero_copy: bool = False,
+    ):
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.status_code = status_code
+        self.media_type = media_type
+        self.send_body = method.upper() != "HEAD"
+        self.zero_copy = zero_copy
+        self.background = None
+        self.init_headers(headers)
+        self.raw_headers.append((b"content-length", str(length).encode("latin-1")))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if self.zero_copy and ZERO_COPY_EXTENSION in extensions:
+            # 服务器支持零拷贝时交给内核 sendfile 处理
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": ZERO_COPY_EXTENSION,
+                    "file": file,
+                    "offset": self.offset,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0,
+                })
+            if remaining > 0:
+                # 文件在传输过程中被截断
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class MediaStaticFiles(StaticFiles):
+    """
+    StaticFiles with strong ETags, immutable caching for unique file names,
+    Range requests for audio scrubbing and optional zero-copy sends
+    """
+
+    def __init__(self, *args, immutable_max_age: int = 31536000, zero_copy: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.immutable_max_age = immutable_max_age
+        self.zero_copy = zero_copy and hasattr(os, "sendfile")
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        full_path = os.fspath(full_path)
+        request_headers = Headers(scope=scope)
+        method = scope["method"]
+        file_size = stat_result.st_size
+        etag = make_strong_etag(stat_result)
+
+        headers = {
+            "etag": etag,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "accept-ranges": "bytes",
+        }
+        if status_code == 200 and is_content_addressed(full_path):
+            headers["cache-control"] = f"public, max-age={self.immutable_max_age}, immutable"
+        else:
+            headers["cache-control"] = "no-cache"
+
+        if status_code == 200 and self.is_not_modified(Headers(headers=headers), request_headers):
+            return NotModifiedResponse(Headers(headers=headers))
+
+        media_type = guess_type(full_path)[0] or "text/plain"
+        offset, length = 0, file_size
+
+        range_header = request_headers.get("range")
+        if range_header and status_code == 200 and stat.S_ISREG(stat_result.st_mode):
+            if_range = request_headers.get("if-range")
+            if if_range is None or if_range == etag:
+                try:
+                    byte_range = parse_range_header(range_header, file_size)
+                except RangeNotSatisfiable:
+                    return Response(
+                        status_code=416,
+                        headers={"content-range": f"bytes */{file_size}", "accept-ranges": "bytes"},
+                    )
+                if byte_range is not None:
+                    start, end = byte_range
+                    offset, length = start, end - start + 1
+                    status_code = 206
+                    headers["content-range"] = f"bytes {start}-{end}/{file_size}"
+
+        return MediaFileResponse(
+            full_path,
+            headers=headers,
+            media_type=media_type,
+            offset=offset,
+            length=length,
+            status_code=status_code,
+            method=method,
+            zero_copy=self.zero_copy,
+        )
@@ -0,0 +1,114 @@
+"""
+片段活动度预筛选
+
+上传 Gemini 之前，先在本地用 ffmpeg 以低分辨率灰度图按固定帧率抽帧，
+用 NumPy 一次性计算相邻帧差（运动）和灰度直方图差（场景切换）。
+画面静止或黑屏的片段标记为可跳过，不再压缩、上传和分析。
+"""
+import logging
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_FPS = 1  # 每秒抽取的帧数
+FRAME_WIDTH = 160
+FRAME_HEIGHT = 90
+HIST_BINS = 32
+
+PIXEL_DIFF_THRESHOLD = 12  # 像素灰度变化超过该值视为发生变化
+MOTION_THRESHOLD = 0.02  # 变化像素占比超过该值视为有运动
+SCENE_THRESHOLD = 0.35  # 直方图差超过该值视为场景切换
+MIN_ACTIVE_RATIO = 0.1  # 有运动的帧对占比低于该值且无场景切换时跳过
+BLANK_STD = 4.0  # 所有帧灰度标准差低于该值视为黑屏/纯色
+
+
+def _require_numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("请安装numpy库以支持片段预筛选: pip install numpy")
+    return np
+
+
+def sample_frames(video_path, fps=SAMPLE_FPS, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    """抽取低分辨率灰度帧，返回 (帧数, 高, 宽) 的 uint8 数组"""
+    np = _require_numpy()
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-i', video_path,
+        '-an',
+        '-vf', f'fps={fps},scale={width}:{height},format=gray',
+        '-f', 'rawvideo',
+        '-pix_fmt', 'gray',
+        'pipe:1'
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', errors='ignore').strip())
+
+    frame_size = width * height
+    count = len(result.stdout) // frame_size
+    return np.frombuffer(result.stdout[:count * frame_size], dtype=np.uint8).reshape(count, height, width)
+
+
+def compute_activity(frames):
+    """
+    计算运动和场景切换指标
+
+    Returns:
+        dict: motion（每对相邻帧的变化像素占比）、scene（每对相邻帧的直方图差）、frame_std
+    """
+    np = _require_numpy()
+    count = frames.shape[0]
+    if count < 2:
+        return {'motion': np.zeros(0), 'scene': np.zeros(0), 'frame_std': float(frames.std()) if count else 0.0}
+
+    # 相邻帧差
+    diffs = np.abs(frames[1:].astype(np.int16) - frames[:-1].astype(np.int16))
+    motion = (diffs > PIXEL_DIFF_THRESHOLD).mean(axis=(1, 2))
+
+    # 每帧灰度直方图：给每帧的 bin 编号加上偏移后一次 bincount
+    bins = (frames // (256 // HIST_BINS)).astype(np.int64)
+    bins += (np.arange(count) * HIST_BINS)[:, None, None]
+    hists = np.bincount(bins.ravel(), minlength=count * HIST_BINS).reshape(count, HIST_BINS)
+    hists = hists / float(frames.shape[1] * frames.shape[2])
+    scene = 0.5 * np.abs(hists[1:] - hists[:-1]).sum(axis=1)
+
+    return {'motion': motion, 'scene': scene, 'frame_std': float(frames.std())}
+
+
+def analyze_activity(video_path):
+    """
+    判断片段是否值得上传分析
+
+    Returns:
+        dict: skip（是否跳过）、reason（原因）以及各项指标
+    """
+    frames = sample_frames(video_path)
+    activity = compute_activity(frames)
+    motion = activity['motion']
+    scene = activity['scene']
+
+    active_ratio = float((motion > MOTION_THRESHOLD).mean()) if motion.size else 0.0
+    scene_changes = int((scene > SCENE_THRESHOLD).sum())
+    result = {
+        'frames': int(frames.shape[0]),
+        'active_ratio': round(active_ratio, 4),
+        'motion_mean': round(float(motion.mean()), 4) if motion.size else 0.0,
+        'motion_max': round(float(motion.max()), 4) if motion.size else 0.0,
+        'scene_changes': scene_changes,
+        'frame_std': round(activity['frame_std'], 2),
+        'skip': False,
+        'reason': '',
+    }
+
+    if frames.shape[0] == 0:
+        result['reason'] = '未能抽取到画面，按有效片段处理'
+    elif activity['frame_std'] < BLANK_STD:
+        result['skip'] = True
+        result['reason'] = f"画面为黑屏或纯色（灰度标准差 {result['frame_std']}）"
+    elif active_ratio < MIN_ACTIVE_RATIO and scene_changes == 0:
+        result['skip'] = True
+        result['reason'] = f"画面基本静止（运动帧占比 {active_ratio:.1%}，无场景切换）"
+
+    return result
@@ -0,0 +1,176 @@
+"""
+角色参考缓存
+
+角色图片上传后的文件句柄和第一轮角色分析结果按 图片内容哈希+提示词+模型 缓存，
+并持久化到 JSON 文件。同一次运行的所有片段、以及之后的运行都直接复用：
+新会话以缓存的角色分析作为历史记录开始，不再重复上传图片和发送角色分析请求。
+Gemini 上传的文件48小时后过期，过期或已被删除的文件句柄会重新上传。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# Gemini 文件保存48小时，提前一小时视为过期
+FILE_TTL = 47 * 3600
+
+
+def file_sha256(path):
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _expires_at(media_file):
+    """读取文件句柄的过期时间，取不到时按上传时间加 FILE_TTL 计算"""
+    expiration = getattr(media_file, 'expiration_time', None)
+    if hasattr(expiration, 'timestamp'):
+        return expiration.timestamp() - 3600
+    return time.time() + FILE_TTL
+
+
+def cached_response(text):
+    """缓存命中时代替角色分析响应，本次运行没有消耗Token"""
+    usage = SimpleNamespace(prompt_token_count=0, candidates_token_count=0, total_token_count=0)
+    return SimpleNamespace(text=text, usage_metadata=usage, cached=True)
+
+
+class CharacterCache:
+    """
+    角色参考缓存
+
+    Args:
+        cache_path: 缓存文件路径
+        scheduler: Gemini 调度器，查询文件状态时使用
+    """
+
+    def __init__(self, cache_path, scheduler=None):
+        self.cache_path = cache_path
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._verified = set()  # 本次运行已确认可用的文件
+        self._files = {}  # 文件名 -> 文件句柄
+        self._data = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.cache_path):
+            return {'files': {}, 'analyses': {}}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            data.setdefault('files', {})
+            data.setdefault('analyses', {})
+            return data
+        except (OSError, ValueError) as e:
+            logger.warning(f"角色缓存读取失败，重新建立: {str(e)}")
+            return {'files': {}, 'analyses': {}}
+
+    def _save(self):
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.cache_path)
+
+    def _get_remote_file(self, name):
+        """确认缓存的文件在服务端仍然可用"""
+        if self.scheduler:
+            media_file = self.scheduler.call(genai.get_file, name, count_request=False, description="查询图片状态")
+        else:
+            media_file = genai.get_file(name)
+        if media_file.state.name != 'ACTIVE':
+            raise ValueError(f"文件状态为 {media_file.state.name}")
+        return media_file
+
+    def get_image_file(self, image_path, upload_func):
+        """
+        获取角色图片的文件句柄，缓存有效时不重新上传
+
+        Args:
+            image_path: 角色图片路径
+            upload_func: 上传函数，接收路径返回文件句柄
+        """
+        image_hash = file_sha256(image_path)
+        with self._lock:
+            return self._get_image_file(image_path, image_hash, upload_func)
+
+    def _get_image_file(self, image_path, image_hash, upload_func):
+        entry = self._data['files'].get(image_hash)
+        if entry and entry['expires_at'] > time.time():
+            name = entry['name']
+            if name in self._verified:
+                return self._files[name]
+            try:
+                media_file = self._get_remote_file(name)
+                self._verified.add(name)
+                self._files[name] = media_file
+                logger.info(f"复用已上传的角色图片: {entry['uri']}")
+                return media_file
+            except Exception as e:
+                logger.info(f"缓存的角色图片不可用，重新上传: {str(e)}")
+
+        media_file = upload_func(image_path)
+        self._data['files'][image_hash] = {
+            'name': media_file.name,
+            'uri': media_file.uri,
+            'expires_at': _expires_at(media_file),
+        }
+        self._verified.add(media_file.name)
+        self._files[media_file.name] = media_file
+        self._save()
+        return media_file
+
+    def start_chat(self, model, model_name, image_path, prompt, upload_func, send_func):
+        """
+        创建已包含角色分析的会话
+
+        缓存中已有角色分析时，以 [提示词+图片, 角色分析] 作为历史记录开始新会话；
+        否则发送第一轮请求并把结果写入缓存。
+
+        Args:
+            model: GenerativeModel 实例
+            model_name: 模型名称，作为缓存键的一部分
+            image_path: 角色图片路径
+            prompt: 角色分析提示词
+            upload_func: 上传函数，接收路径返回文件句柄
+            send_func: 发送函数，接收 (chat, message) 返回响应
+
+        Returns:
+            tuple: (chat, character_response, image_file)
+        """
+        image_hash = file_sha256(image_path)
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        key = f"{image_hash}:{prompt_hash}:{model_name}"
+
+        # 持锁完成首次分析，并发的其他片段等待结果而不是各自重复请求
+        with self._lock:
+            image_file = self._get_image_file(image_path, image_hash, upload_func)
+            analysis = self._data['analyses'].get(key)
+            if analysis:
+                history = [
+                    {'role': 'user', 'parts': [prompt, image_file]},
+                    {'role': 'model', 'parts': [analysis['text']]},
+                ]
+                logger.info("使用缓存的角色分析结果")
+                return model.start_chat(history=history), cached_response(analysis['text']), image_file
+
+            chat = model.start_chat()
+            response = send_func(chat, [prompt, image_file])
+            self._data['analyses'][key] = {
+                'text': response.text,
+                'created_at': time.time(),
+            }
+            self._save()
+            return chat, response, image_file
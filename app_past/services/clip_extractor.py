@@ -0,0 +1,121 @@
+"""
+视频片段提取引擎
+
+一个分割片段中的所有 clip 由同一个 ffmpeg 进程输出：每个 clip 作为一路带
+输入端 -ss 的输入（直接跳到目标位置，不用从头解码），各自映射到一个输出文件。
+clip 起点前最近的关键帧在容差范围内时直接流复制（-c copy），否则才重新编码。
+"""
+import bisect
+import logging
+import os
+import subprocess
+import threading
+
+from media_probe import get_keyframes
+
+logger = logging.getLogger(__name__)
+
+# 关键帧对齐容差（秒）：起点前移不超过该值时使用流复制
+KEYFRAME_TOLERANCE = 2.0
+# 单个 ffmpeg 进程最多输出的 clip 数，避免同时打开过多输入
+MAX_CLIPS_PER_COMMAND = 16
+# 同时运行的 ffmpeg 进程数，默认与CPU核数一致
+MAX_FFMPEG_PROCESSES = os.cpu_count() or 2
+
+_ffmpeg_slots = threading.BoundedSemaphore(MAX_FFMPEG_PROCESSES)
+
+
+def plan_clip(start, end, keyframes, tolerance=KEYFRAME_TOLERANCE):
+    """
+    决定单个 clip 的切割方式
+
+    Returns:
+        tuple: (实际起点, 时长, 是否流复制)
+    """
+    index = bisect.bisect_right(keyframes, start + 1e-3) - 1
+    if index >= 0 and start - keyframes[index] <= tolerance:
+        # 流复制只能从关键帧开始，起点前移到关键帧，时长相应加长
+        keyframe = keyframes[index]
+        return keyframe, end - keyframe, True
+    return start, end - start, False
+
+
+def build_extract_command(video_path, planned_clips):
+    """
+    构建一次输出多个 clip 的 ffmpeg 命令
+
+    Args:
+        planned_clips: [(起点, 时长, 是否流复制, 输出路径)]
+    """
+    command = ['ffmpeg', '-y', '-v', 'error']
+    for start, duration, _, _ in planned_clips:
+        command += ['-ss', f'{start:.3f}', '-t', f'{duration:.3f}', '-i', video_path]
+
+    for index, (_, _, stream_copy, output_file) in enumerate(planned_clips):
+        command += ['-map', f'{index}:v:0', '-map', f'{index}:a:0?']
+        if stream_copy:
+            command += ['-c', 'copy', '-avoid_negative_ts', 'make_zero']
+        else:
+            command += ['-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'aac']
+        command += ['-movflags', '+faststart', output_file]
+    return command
+
+
+def run_ffmpeg(command, timeout):
+    """运行 ffmpeg，受全局进程数限制"""
+    with _ffmpeg_slots:
+        try:
+            result = subprocess.run(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                encoding='utf-8',
+                errors='ignore',
+                timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            logger.error(f"ffmpeg 执行超时（{timeout}秒）")
+            return False
+    if result.returncode != 0:
+        logger.error(f"ffmpeg 执行失败: {result.stderr.strip()}")
+        return False
+    return True
+
+
+def extract_clip_batch(video_path, clips, stream_copy=True, tolerance=KEYFRAME_TOLERANCE):
+    """
+    从一个视频中批量提取 clip
+
+    Args:
+        video_path: 视频路径
+        clips: [(起点秒, 终点秒, 输出路径)]
+        stream_copy: 是否允许关键帧对齐的流复制
+        tolerance: 关键帧对齐容差（秒）
+
+    Returns:
+        list: 成功生成的输出文件路径
+    """
+    if not clips:
+        return []
+
+    keyframes = get_keyframes(video_path) if stream_copy else []
+    planned = []
+    for start, end, output_file in clips:
+        # 删除上次运行留下的文件，避免把旧文件当作本次结果
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        clip_start, duration, copy = plan_clip(start, end, keyframes, tolerance)
+        planned.append((clip_start, duration, copy, output_file))
+
+    copied = sum(1 for clip in planned if clip[2])
+    logger.info(f"提取 {len(planned)} 个片段：流复制 {copied} 个，重新编码 {len(planned) - copied} 个")
+
+    for i in range(0, len(planned), MAX_CLIPS_PER_COMMAND):
+        batch = planned[i:i + MAX_CLIPS_PER_COMMAND]
+        encoded_seconds = sum(duration for _, duration, copy, _ in batch if not copy)
+        timeout = max(int(encoded_seconds * 2), 60)
+        run_ffmpeg(build_extract_command(video_path, batch), timeout)
+
+    return [output_file for _, _, _, output_file in planned
+            if os.path.exists(output_file) and os.path.getsize(output_file) > 0]
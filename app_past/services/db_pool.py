@@ -0,0 +1,112 @@
+"""
+pymysql 连接池
+
+各数据库函数沿用 "获取连接 -> 执行 -> close()" 的写法，close() 不再断开连接，
+而是回滚未提交的事务后放回池中复用。取出空闲连接时先 ping，断开的连接自动重连。
+"""
+import logging
+import queue
+import threading
+
+import pymysql
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection:
+    """借出的连接，close() 时归还到连接池，其余属性直接转发给 pymysql 连接"""
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        self._pool.release(connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    固定上限的连接池
+
+    Args:
+        config: pymysql.connect 的参数
+        max_size: 最大连接数，连接全部借出时 get() 等待归还
+        timeout: 等待空闲连接的最长时间（秒）
+    """
+
+    def __init__(self, config, max_size=8, timeout=30):
+        self.config = dict(config)
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """借出一个连接"""
+        connection = None
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.max_size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    connection = pymysql.connect(**self.config)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    connection = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"等待数据库连接超时（{self.timeout}秒）")
+
+        try:
+            connection.ping(reconnect=True)
+        except Exception:
+            self._discard(connection)
+            raise
+        return PooledConnection(self, connection)
+
+    def release(self, connection):
+        """归还连接，未提交的事务回滚"""
+        try:
+            connection.rollback()
+        except Exception as e:
+            logger.warning(f"归还数据库连接时回滚失败，关闭连接: {str(e)}")
+            self._discard(connection)
+            return
+        self._idle.put(connection)
+
+    def _discard(self, connection):
+        with self._lock:
+            self._created -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(connection)
@@ -0,0 +1,121 @@
+"""
+Gemini 文件状态跟踪
+
+上传后的视频需要等服务端处理完成（PROCESSING -> ACTIVE）才能用于分析。
+所有待处理文件由一个后台线程统一轮询：刚上传时间隔短，之后逐渐拉长，
+每个文件就绪后立即完成对应的 Future，等待方不再各自 sleep 轮询。
+"""
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+INITIAL_INTERVAL = 2.0  # 第一次查询前的等待时间（秒）
+MAX_INTERVAL = 15.0  # 查询间隔上限（秒）
+INTERVAL_BACKOFF = 1.5  # 每次查询后间隔放大的倍数
+PROCESS_TIMEOUT = 300  # 单个文件处理超时（秒）
+
+
+class FileStateTracker:
+    """
+    共享的文件状态轮询器
+
+    Args:
+        get_file: 按文件名查询文件状态的函数，每次轮询只调用一次，失败时按间隔在下次轮询重试；
+            所有文件共用一个轮询线程，不要传入自带重试和退避的函数，否则一次查询失败会拖住其他文件
+        initial_interval: 第一次查询前的等待时间（秒）
+        max_interval: 查询间隔上限（秒）
+        timeout: 单个文件处理超时（秒）
+    """
+
+    def __init__(self, get_file, initial_interval=INITIAL_INTERVAL, max_interval=MAX_INTERVAL,
+                 timeout=PROCESS_TIMEOUT):
+        self.get_file = get_file
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self._pending = []  # 堆：(下次查询时间, 序号, 文件名, 间隔, 截止时间, Future)
+        self._counter = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def track(self, media_file):
+        """
+        开始跟踪一个文件
+
+        Returns:
+            Future: 文件变为 ACTIVE 时返回最新的文件对象；处理失败或超时时抛出异常
+        """
+        future = Future()
+        state = media_file.state.name
+        if state != 'PROCESSING':
+            self._resolve(future, media_file)
+            return future
+
+        now = time.monotonic()
+        with self._condition:
+            self._counter += 1
+            heapq.heappush(self._pending, (
+                now + self.initial_interval, self._counter, media_file.name,
+                self.initial_interval, now + self.timeout, future
+            ))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="file-tracker", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def wait_active(self, media_file):
+        """阻塞等待文件处理完成，返回最新的文件对象"""
+        return self.track(media_file).result()
+
+    @staticmethod
+    def _resolve(future, media_file):
+        state = media_file.state.name
+        if state == 'ACTIVE':
+            future.set_result(media_file)
+        else:
+            future.set_exception(ValueError(f"文件处理失败: {media_file.name} 状态为 {state}"))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    # 没有待处理文件时空闲一段时间后退出，下次 track 时重新启动
+                    if not self._condition.wait(timeout=60) and not self._pending:
+                        self._thread = None
+                        return
+                due, _, name, interval, deadline, future = self._pending[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(timeout=wait)
+                    continue
+                heapq.heappop(self._pending)
+
+            self._poll(name, interval, deadline, future)
+
+    def _poll(self, name, interval, deadline, future):
+        try:
+            media_file = self.get_file(name)
+        except Exception as e:
+            logger.warning(f"查询文件状态失败 {name}: {str(e)}")
+            media_file = None
+
+        if media_file is not None and media_file.state.name != 'PROCESSING':
+            self._resolve(future, media_file)
+            return
+
+        now = time.monotonic()
+        if now >= deadline:
+            future.set_exception(TimeoutError(f"文件处理超时: {name}"))
+            return
+
+        interval = min(interval * INTERVAL_BACKOFF, self.max_interval)
+        with self._condition:
+            self._counter += 1
+            heapq.heappush(self._pending, (
+                min(now + interval, deadline), self._counter, name, interval, deadline, future
+            ))
@@ -1,27 +1,34 @@
 # 将选择的视频按固定长度分割，对每一 Part 压缩，并上传到 Gemini，生成分析结果，并根据生成的 json 时间线提取片段。
 # 需配置 GOOGLE_API_KEY，SELECTED_MODEL，SEGMENT_DURATION，CHARACTER_IMAGE_PATH，CHARACTER_PROMPT，VIDEO_PROMPT，CLIP_TIME_BUFFER
 # CLIP_TIME_BUFFER 的作用是在片段时长过短时，延长提取出的片段长度。
+# 无界面服务器上使用 video_jobs.py（命令行或HTTP任务API）运行，不弹出对话框。
 
 # -*- coding: utf-8 -*-
 
 import os
 import time
 import google.generativeai as genai
-import tkinter as tk
-from tkinter import filedialog
 import logging
 from datetime import datetime
 import re
 import json
+import csv
 import subprocess
 import math
-from tkinter.filedialog import askopenfilename, askopenfilenames
 from dotenv import load_dotenv
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import ffmpeg
-from tkinter.simpledialog import askstring
 import pymysql
-from tkinter import simpledialog, Toplevel, Text, Button, Label, Scrollbar, WORD, END
+from gemini_scheduler import GeminiScheduler, estimate_tokens
+from clip_extractor import extract_clip_batch
+from media_probe import get_duration
+from activity_filter import analyze_activity
+from frame_sampler import build_frame_message
+from character_cache import CharacterCache
+from file_tracker import FileStateTracker
+from video_compressor import compress_video
+from db_pool import ConnectionPool
 
 # 加载 .env 文件
 load_dotenv()
@@ -49,10 +56,37 @@ SELECTED_MODEL = 'gemini-1.5-flash'  # 默认选择快速版
 SEGMENT_DURATION = 180  # 视频分段时长（秒）
 ENABLE_COMPRESSION = True  # 是否启用视频压缩，默认为True
 COMPRESSION_SIZE = 50  # 视频压缩大小，默认为50MB
+COMPRESSION_MODE = 'fast'  # 压缩模式：'fast' 单遍快速预设，'two_pass' 两遍编码贴近目标大小，'crf' 画质优先并限制峰值码率
+MAX_CONCURRENT_SEGMENTS = 3  # 同时处理的视频片段数，根据API配额调整，设为1时按顺序处理
+MAX_PENDING_UPLOADS = 3  # 并发处理时，可以提前压缩上传、等待服务端处理的额外片段数
+RESUME_MODE = True  # 断点续跑：复用未完成记录的分割文件和分析结果，跳过已完成的片段
+ENABLE_ACTIVITY_FILTER = True  # 上传前在本地检测画面活动度，跳过静止/黑屏片段
+ANALYSIS_MODE = 'video'  # 分析模式：'video' 上传完整视频，'frames' 只发送均匀抽取的关键帧
+FRAME_SAMPLE_COUNT = 36  # frames 模式下每个片段抽取的帧数
+FRAME_SAMPLE_WIDTH = 640  # frames 模式下抽取帧的宽度（像素）
+
+# Gemini API 配额（按所用模型和账号等级填写），所有请求共享同一个调度器
+GEMINI_REQUESTS_PER_MINUTE = 15  # 每分钟请求数（RPM）
+GEMINI_TOKENS_PER_MINUTE = 1000000  # 每分钟Token数（TPM）
+gemini_scheduler = GeminiScheduler(
+    requests_per_minute=GEMINI_REQUESTS_PER_MINUTE,
+    tokens_per_minute=GEMINI_TOKENS_PER_MINUTE
+)
+
+# 角色图片句柄和角色分析结果的缓存，各片段和之后的运行共用
+CHARACTER_CACHE_PATH = os.path.join('outputs', 'character_cache.json')
+character_cache = CharacterCache(CHARACTER_CACHE_PATH, gemini_scheduler)
+
+# 上传文件的处理状态由一个后台线程统一轮询；状态查询不经过调度器重试，失败时按间隔在下次轮询重新查询
+file_tracker = FileStateTracker(genai.get_file)
+# 同时进行视频分析请求的片段数，上传和等待处理不占用
+analysis_slots = threading.BoundedSemaphore(max(1, MAX_CONCURRENT_SEGMENTS))
 
 # 使用Tkinter弹窗获取用户输入
 def get_text_input(title, prompt, default_text="", width=80, height=15):
     """创建一个自定义对话框以获取多行文本输入"""
+    # tkinter 只在弹出对话框时导入，无界面的服务器上通过 video_jobs 运行
+    import tkinter as tk
     result = []
     
     def on_ok():
@@ -193,6 +227,7 @@ def get_prompts():
     return CHARACTER_PROMPT, VIDEO_PROMPT
 
 CLIP_TIME_BUFFER = 2  # 视频片段前后的缓冲时间（秒）
+CLIP_STREAM_COPY = True  # 起点附近有关键帧时直接流复制，不重新编码
 
 # 确保log目录存在
 log_dir = 'log'
@@ -218,6 +253,22 @@ os.environ['HTTP_PROXY'] = 'http://127.0.0.1:7897'
 is_paused = False
 pause_event = threading.Event()
 
+# 以任务方式运行时（video_jobs）由任务进程设置：
+# job_state_getter 返回 'running' / 'paused' / 'cancelled'，event_callback 接收 (事件名, 数据)
+job_state_getter = None
+event_callback = None
+
+class JobCancelled(BaseException):
+    """任务被取消。继承 BaseException，不会被各处理步骤的 except Exception 当作普通失败吞掉"""
+
+class LeaseLost(JobCancelled):
+    """片段租约已被其他 worker 接管，当前 worker 放弃处理"""
+
+# 以队列 worker 方式运行时（segment_worker）按线程设置：
+# worker_id 为持有片段租约的 worker，片段状态只在租约仍归它时写入，失败时不改状态，由 release_segment 按尝试次数决定；
+# lease_lost 返回租约是否已丢失
+worker_context = threading.local()
+
 # 数据库配置
 DB_CONFIG = {
     'host': 'localhost',  # 数据库服务器地址
@@ -227,6 +278,10 @@ DB_CONFIG = {
     'charset': 'utf8mb4'
 }
 
+# 数据库连接池，大小覆盖同时处理的片段线程
+DB_POOL_SIZE = MAX_CONCURRENT_SEGMENTS + MAX_PENDING_UPLOADS + 2
+db_pool = ConnectionPool(DB_CONFIG, max_size=DB_POOL_SIZE)
+
 def init_database():
     """初始化数据库和表结构"""
     try:
@@ -255,6 +310,8 @@ def init_database():
                     total_parts INT,
                     processed_parts INT DEFAULT 0,
                     character_image_path TEXT,
+                    character_prompt TEXT,
+                    video_prompt TEXT,
                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             """)
@@ -271,8 +328,13 @@ def init_database():
                     duration INT,
                     status VARCHAR(50) NOT NULL,
                     analysis_result TEXT,
+                    worker_id VARCHAR(100),
+                    lease_expires_at DATETIME,
+                    heartbeat_at DATETIME,
+                    attempts INT DEFAULT 0,
                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (video_record_id) REFERENCES video_process_records(id)
+                    FOREIGN KEY (video_record_id) REFERENCES video_process_records(id),
+                    INDEX idx_segment_queue (status, lease_expires_at)
                 )
             """)
             
@@ -286,11 +348,36 @@ def init_database():
                     end_time VARCHAR(20) NOT NULL,
                     description TEXT,
                     extracted_clip_path TEXT,
+                    video_record_id INT,
+                    start_seconds DOUBLE,
+                    end_seconds DOUBLE,
                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (segment_id) REFERENCES video_segments(id)
+                    FOREIGN KEY (segment_id) REFERENCES video_segments(id),
+                    INDEX idx_timeline (video_record_id, start_seconds)
                 )
             """)
             
+            # 旧表补齐任务队列（segment_worker）使用的列
+            add_missing_columns(cursor, 'video_process_records', {
+                'character_prompt': 'TEXT',
+                'video_prompt': 'TEXT',
+            })
+            add_missing_columns(cursor, 'video_segments', {
+                'worker_id': 'VARCHAR(100)',
+                'lease_expires_at': 'DATETIME',
+                'heartbeat_at': 'DATETIME',
+                'attempts': 'INT DEFAULT 0',
+            })
+            add_missing_index(cursor, 'video_segments', 'idx_segment_queue', 'status, lease_expires_at')
+            
+            # 分析结果的绝对时间轴（按时间段查询）
+            add_missing_columns(cursor, 'analysis_results', {
+                'video_record_id': 'INT',
+                'start_seconds': 'DOUBLE',
+                'end_seconds': 'DOUBLE',
+            })
+            add_missing_index(cursor, 'analysis_results', 'idx_timeline', 'video_record_id, start_seconds')
+            
         connection.commit()
         logger.info("数据库初始化成功")
         return True
@@ -302,16 +389,32 @@ def init_database():
         if connection:
             connection.close()
 
+def add_missing_columns(cursor, table, columns):
+    """为已存在的表补齐缺少的列"""
+    cursor.execute(f"SHOW COLUMNS FROM {table}")
+    existing = {row[0] for row in cursor.fetchall()}
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+            logger.info(f"表 {table} 添加列: {name}")
+
+def add_missing_index(cursor, table, name, columns):
+    """为已存在的表补建索引"""
+    cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", (name,))
+    if not cursor.fetchone():
+        cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+        logger.info(f"表 {table} 添加索引: {name}")
+
 def get_db_connection():
-    """获取数据库连接"""
+    """从连接池获取数据库连接，用完调用 close() 归还"""
     try:
-        connection = pymysql.connect(**DB_CONFIG)
+        connection = db_pool.get()
         return connection
     except Exception as e:
         logger.error(f"数据库连接失败: {str(e)}")
         return None
 
-def create_video_record(video_path, character_image_path):
+def create_video_record(video_path, character_image_path, total_parts=None):
     """创建视频处理记录"""
     try:
         connection = get_db_connection()
@@ -321,8 +424,8 @@ def create_video_record(video_path, character_image_path):
         with connection.cursor() as cursor:
             sql = """
                 INSERT INTO video_process_records 
-                (video_name, video_path, process_start_time, status, character_image_path)
-                VALUES (%s, %s, %s, %s, %s)
+                (video_name, video_path, process_start_time, status, character_image_path, total_parts, processed_parts)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
             """
             video_name = os.path.basename(video_path)
             cursor.execute(sql, (
@@ -330,7 +433,9 @@ def create_video_record(video_path, character_image_path):
                 video_path,
                 datetime.now(),
                 'STARTED',
-                character_image_path
+                character_image_path,
+                total_parts,
+                0
             ))
             connection.commit()
             return cursor.lastrowid
@@ -380,12 +485,20 @@ def update_video_record(record_id, status, total_parts=None, processed_parts=Non
         if connection:
             connection.close()
 
-def create_segment_record(video_record_id, part_number, segment_path):
-    """创建视频片段记录"""
+def create_segment_records(video_record_id, segment_paths):
+    """
+    批量创建视频片段记录
+    
+    Args:
+        segment_paths: [(Part编号, 片段路径)]
+    
+    Returns:
+        dict: {Part编号: 片段记录ID}
+    """
     try:
         connection = get_db_connection()
         if not connection:
-            return None
+            return {}
             
         with connection.cursor() as cursor:
             sql = """
@@ -393,23 +506,86 @@ def create_segment_record(video_record_id, part_number, segment_path):
                 (video_record_id, part_number, segment_path, status)
                 VALUES (%s, %s, %s, %s)
             """
-            cursor.execute(sql, (
-                video_record_id,
-                part_number,
-                segment_path,
-                'CREATED'
-            ))
+            cursor.executemany(sql, [
+                (video_record_id, part_number, segment_path, 'CREATED')
+                for part_number, segment_path in segment_paths
+            ])
+            # 批量插入的自增ID不保证连续，插入后按Part编号查回
+            cursor.execute(
+                "SELECT part_number, id FROM video_segments WHERE video_record_id = %s",
+                (video_record_id,)
+            )
+            segment_ids = dict(cursor.fetchall())
             connection.commit()
-            return cursor.lastrowid
+            return segment_ids
     except Exception as e:
         logger.error(f"创建片段记录失败: {str(e)}")
-        return None
+        return {}
     finally:
         if connection:
             connection.close()
 
-def create_analysis_result(segment_id, clip_data):
-    """创建分析结果记录"""
+def save_analysis_results(segment_id, clips, status='EXTRACTED'):
+    """
+    在一个事务中替换片段的分析结果并更新片段状态
+    
+    Args:
+        clips: [{clip_number, start, end, description, extracted_clip_path, start_seconds, end_seconds}]，
+            start_seconds/end_seconds 为在原视频中的绝对时间（秒）
+    """
+    try:
+        connection = get_db_connection()
+        if not connection:
+            return False
+            
+        with connection.cursor() as cursor:
+            # 重新提取时先删除旧记录，避免重复
+            worker_id = getattr(worker_context, 'worker_id', None)
+            if worker_id:
+                # 锁住片段行，租约已被其他 worker 接管时放弃写入
+                cursor.execute("SELECT id FROM video_segments WHERE id = %s AND worker_id = %s FOR UPDATE",
+                               (segment_id, worker_id))
+                if not cursor.fetchone():
+                    connection.rollback()
+                    logger.warning(f"片段 {segment_id} 的租约已丢失，放弃写入分析结果")
+                    return False
+            cursor.execute("DELETE FROM analysis_results WHERE segment_id = %s", (segment_id,))
+            if clips:
+                cursor.execute("SELECT video_record_id FROM video_segments WHERE id = %s", (segment_id,))
+                row = cursor.fetchone()
+                video_record_id = row[0] if row else None
+                sql = """
+                    INSERT INTO analysis_results 
+                    (segment_id, clip_number, start_time, end_time, description, extracted_clip_path,
+                     video_record_id, start_seconds, end_seconds)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """
+                cursor.executemany(sql, [
+                    (
+                        segment_id,
+                        clip['clip_number'],
+                        clip['start'],
+                        clip['end'],
+                        clip['description'],
+                        clip.get('extracted_clip_path', ''),
+                        video_record_id,
+                        clip.get('start_seconds'),
+                        clip.get('end_seconds')
+                    )
+                    for clip in clips
+                ])
+            cursor.execute("UPDATE video_segments SET status = %s WHERE id = %s", (status, segment_id))
+            connection.commit()
+            return True
+    except Exception as e:
+        logger.error(f"保存分析结果记录失败: {str(e)}")
+        return False
+    finally:
+        if connection:
+            connection.close()
+
+def find_resumable_video_record(video_path):
+    """查找该视频最近一次未完成的处理记录，已加入队列（QUEUED）的记录由 segment_worker 处理，不参与续跑"""
     try:
         connection = get_db_connection()
         if not connection:
@@ -417,29 +593,121 @@ def create_analysis_result(segment_id, clip_data):
             
         with connection.cursor() as cursor:
             sql = """
-                INSERT INTO analysis_results 
-                (segment_id, clip_number, start_time, end_time, description, extracted_clip_path)
-                VALUES (%s, %s, %s, %s, %s, %s)
+                SELECT id FROM video_process_records
+                WHERE video_path = %s AND status NOT IN ('COMPLETED', 'QUEUED')
+                ORDER BY id DESC LIMIT 1
             """
-            cursor.execute(sql, (
-                segment_id,
-                clip_data['clip_number'],
-                clip_data['start'],
-                clip_data['end'],
-                clip_data['description'],
-                clip_data.get('extracted_clip_path', '')
-            ))
-            connection.commit()
-            return cursor.lastrowid
+            cursor.execute(sql, (video_path,))
+            row = cursor.fetchone()
+            return row[0] if row else None
     except Exception as e:
-        logger.error(f"创建分析结果记录失败: {str(e)}")
+        logger.error(f"查询视频记录失败: {str(e)}")
         return None
     finally:
         if connection:
             connection.close()
 
+def get_segment_records(video_record_id):
+    """获取视频的所有片段记录，返回 {part_number: {id, segment_path, status}}"""
+    try:
+        connection = get_db_connection()
+        if not connection:
+            return {}
+            
+        with connection.cursor() as cursor:
+            sql = """
+                SELECT id, part_number, segment_path, status
+                FROM video_segments
+                WHERE video_record_id = %s
+                ORDER BY part_number
+            """
+            cursor.execute(sql, (video_record_id,))
+            return {
+                row[1]: {'id': row[0], 'segment_path': row[2], 'status': row[3]}
+                for row in cursor.fetchall()
+            }
+    except Exception as e:
+        logger.error(f"查询片段记录失败: {str(e)}")
+        return {}
+    finally:
+        if connection:
+            connection.close()
+
+def update_segment_record(segment_id, status, analysis_result=None):
+    """更新视频片段状态：CREATED -> ANALYZED -> EXTRACTED，失败为 FAILED，预筛选跳过为 SKIPPED"""
+    try:
+        connection = get_db_connection()
+        if not connection:
+            return False
+            
+        with connection.cursor() as cursor:
+            if analysis_result is not None:
+                sql = "UPDATE video_segments SET status = %s, analysis_result = %s WHERE id = %s"
+                params = [status, analysis_result, segment_id]
+            else:
+                sql = "UPDATE video_segments SET status = %s WHERE id = %s"
+                params = [status, segment_id]
+            worker_id = getattr(worker_context, 'worker_id', None)
+            if worker_id:
+                sql += " AND worker_id = %s"
+                params.append(worker_id)
+            cursor.execute(sql, params)
+            connection.commit()
+            return True
+    except Exception as e:
+        logger.error(f"更新片段记录失败: {str(e)}")
+        return False
+    finally:
+        if connection:
+            connection.close()
+
+def prepare_video_record(input_file, character_image_path, segment_duration):
+    """
+    获取视频处理记录和片段列表
+    
+    断点续跑模式下，如果存在未完成的记录且分割文件都还在，直接复用，
+    不再重新分割；否则重新分割并创建新的记录
+    
+    Returns:
+        tuple: (视频记录ID, 按Part排序的片段列表 [(片段路径, 片段记录)])
+    """
+    if RESUME_MODE:
+        video_record_id = find_resumable_video_record(input_file)
+        if video_record_id:
+            segments = get_segment_records(video_record_id)
+            if segments and all(os.path.exists(seg['segment_path']) for seg in segments.values()):
+                done = sum(1 for seg in segments.values() if seg['status'] == 'EXTRACTED')
+                logger.info(f"断点续跑：复用记录 {video_record_id}，共 {len(segments)} 个片段，已完成 {done} 个")
+                update_video_record(video_record_id, 'STARTED')
+                return video_record_id, [(seg['segment_path'], seg) for _, seg in sorted(segments.items())]
+            logger.info(f"记录 {video_record_id} 的分割文件不完整，重新分割")
+    
+    # 执行视频分割
+    success, split_files = split_video(input_file, segment_duration)
+    if not success:
+        return None, []
+    
+    # 对分割后的视频文件按Part编号排序
+    split_files.sort(key=lambda x: int(re.search(r'Part(\d+)', os.path.basename(x)).group(1)))
+    
+    video_record_id = create_video_record(input_file, character_image_path, total_parts=len(split_files))
+    if not video_record_id:
+        logger.error("创建视频处理记录失败")
+        return None, []
+    
+    segment_paths = [
+        (int(re.search(r'Part(\d+)', os.path.basename(segment_path)).group(1)), segment_path)
+        for segment_path in split_files
+    ]
+    segment_ids = create_segment_records(video_record_id, segment_paths)
+    segments = [
+        (segment_path, {'id': segment_ids.get(part_number), 'segment_path': segment_path, 'status': 'CREATED'})
+        for part_number, segment_path in segment_paths
+    ]
+    return video_record_id, segments
+
 def compress_video_before_upload(input_file, target_size_mb):
-    """在上传前压缩视频"""
+    """在上传前压缩视频，压缩失败或仍超过目标大小时抛出异常，不再退回上传原视频"""
     logger.info(f"开始压缩视频: {input_file}")
     logger.info(f"目标大小: {target_size_mb}MB")
     
@@ -467,89 +735,27 @@ def compress_video_before_upload(input_file, target_size_mb):
     
     logger.info(f"压缩文件将保存至：{compressed_file}")
     
-    # 获取视频时长
-    
     try:
-        # 获取视频时长
-        cmd = ['ffmpeg', '-i', str(input_file)]
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            encoding='utf-8',
-            errors='ignore'
-        )
-        
-        _, stderr = process.communicate()
-        
-        duration = 0
-        for line in stderr.split('\n'):
-            if 'Duration' in line:
-                time_str = line.split('Duration: ')[1].split(',')[0].strip()
-                h, m, s = time_str.split(':')
-                duration = float(h) * 3600 + float(m) * 60 + float(s)
-                break
-        
-        if duration == 0:
-            logger.warning("无法获取视频时长，使用原始视频")
-            return input_file
-            
-        # 计算目标比特率
-        target_size_bits = target_size_mb * 8 * 1024 * 1024
-        audio_bitrate = 128 * 1024  # 128kbps for audio
-        video_bitrate = int((target_size_bits / duration) - audio_bitrate)
-        
-        if video_bitrate < 100 * 1024:
-            logger.warning("计算出的视频比特率太低，使用最低比特率")
-            video_bitrate = 100 * 1024
-            
-        logger.info(f"目标视频比特率：{video_bitrate/1024:.2f}k")
-        
-        # 压缩视频
-        compress_cmd = [
-            'ffmpeg',
-            '-i', input_file,
-            '-c:v', 'libx264',    # 视频编码器
-            '-b:v', f'{video_bitrate}',  # 视频比特率
-            '-c:a', 'aac',     # 音频编码器
-            '-b:a', '128k',     # 音频比特率
-            '-preset', 'medium',   # 编码速度预设
-            '-y',                  # 覆盖输出文件
-            compressed_file
-        ]
-        
         logger.info("开始压缩...")
-        process = subprocess.Popen(
-            compress_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            encoding='utf-8',
-            errors='ignore'
-        )
-        
-        process.communicate()
-        
-        if process.returncode == 0:
-            original_size = os.path.getsize(input_file) / (1024 * 1024)
-            compressed_size = os.path.getsize(compressed_file) / (1024 * 1024)
-            logger.info(f"压缩完成！")
-            logger.info(f"原始大小: {original_size:.2f}MB")
-            logger.info(f"压缩后大小: {compressed_size:.2f}MB")
-            logger.info(f"压缩率: {(1 - compressed_size/original_size) * 100:.2f}%")
-            logger.info(f"压缩文件已保存: {compressed_file}")
-            return compressed_file
-        else:
-            logger.error("压缩过程中出现错误，使用原始视频")
-            return input_file
+        result_file = compress_video(input_file, compressed_file, target_size_mb, COMPRESSION_MODE)
+        original_size = os.path.getsize(input_file) / (1024 * 1024)
+        compressed_size = os.path.getsize(result_file) / (1024 * 1024)
+        logger.info(f"压缩完成！")
+        logger.info(f"原始大小: {original_size:.2f}MB")
+        logger.info(f"压缩后大小: {compressed_size:.2f}MB")
+        logger.info(f"压缩率: {(1 - compressed_size/original_size) * 100:.2f}%")
+        logger.info(f"压缩文件已保存: {result_file}")
+        return result_file
             
     except Exception as e:
-        logger.error(f"压缩失败: {str(e)}，使用原始视频")
-        return input_file
+        # 原视频更大，上传后同样会因超出大小失败，直接让该片段失败
+        logger.error(f"压缩失败: {str(e)}")
+        raise
 
 def get_video_files():
     """获取多个视频文件路径"""
+    import tkinter as tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()
     
@@ -565,50 +771,25 @@ def get_video_files():
 
 def upload_media_with_retry(file_path, media_type):
     """带重试机制的媒体文件上传"""
-    max_retries = 5
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            logger.info(f"正在上传{media_type}... (尝试 {retry_count + 1}/{max_retries})")
-            media_file = genai.upload_file(file_path)
-            logger.info(f"上传完成: {media_file.uri}")
-            return media_file
-        except Exception as e:
-            retry_count += 1
-            if retry_count == max_retries:
-                raise e
-            logger.warning(f"上传失败，正在重试: {str(e)}")
-            time.sleep(30)
-
-def send_message_with_retry(chat, message, max_retries=5, retry_delay=30):
-    """带重试机制的消息发送"""
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"[尝试 {attempt + 1}/{max_retries}] 开始发送消息...")
-            response = chat.send_message(message, stream=False)
-            logger.info(f"[尝试 {attempt + 1}/{max_retries}] 消息发送成功")
-            return response
-        except Exception as e:
-            error_code = str(e).split()[0]  # 获取错误代码
-            
-            # 根据错误类型调整等待时间
-            if error_code == "429":  # 配额限制
-                wait_time = retry_delay * (attempt + 1)  # 递增等待时间
-                logger.warning(f"达到API限制，等待 {wait_time} 秒后重试...")
-            elif error_code == "500":  # 服务器错误
-                wait_time = retry_delay * 2  # 服务器错误等待更长时间
-                logger.warning(f"服务器暂时不可用，等待 {wait_time} 秒后重试...")
-            else:
-                wait_time = retry_delay
-                logger.warning(f"发生错误: {str(e)}，等待 {wait_time} 秒后重试...")
-            
-            if attempt == max_retries - 1:  # 最后一次尝试
-                logger.error(f"达到最大重试次数 ({max_retries})，放弃处理")
-                raise e
-                
-            time.sleep(wait_time)
-            continue
+    logger.info(f"正在上传{media_type}...")
+    media_file = gemini_scheduler.call(
+        genai.upload_file, file_path,
+        count_request=False,
+        description=f"上传{media_type}"
+    )
+    logger.info(f"上传完成: {media_file.uri}")
+    return media_file
+
+def send_message_with_retry(chat, message):
+    """通过共享调度器发送消息，配额不足时排队，失败时按错误类型退避重试"""
+    logger.info("开始发送消息...")
+    response = gemini_scheduler.call(
+        chat.send_message, message, stream=False,
+        estimated_tokens=estimate_tokens(message),
+        description="发送消息"
+    )
+    logger.info("消息发送成功")
+    return response
 
 def time_to_seconds(time_str):
     """将 "分:秒" 格式转换为秒数"""
@@ -665,82 +846,29 @@ def extract_clips(video_path, json_path, total_videos, current_index):
             logger.error(f"JSON文件中没有找到 Appearances 数组")
             return False
             
-        # 遍历每个时间段并切割视频
+        # 计算每个时间段的切割范围
+        clips = []
         for i, clip in enumerate(timeline['Appearances'], 1):
-            try:
-                if not all(k in clip for k in ['start', 'end']):
-                    logger.error(f"片段 {i} 缺少必要的时间信息")
-                    continue
-                    
-                start_time = max(0, time_to_seconds(clip['start']) - CLIP_TIME_BUFFER)
-                end_time = time_to_seconds(clip['end']) + CLIP_TIME_BUFFER
-                duration = end_time - start_time
-                
-                if duration <= 0:
-                    logger.error(f"片段 {i} 的时长无效：{duration}秒")
-                    continue
-                
-                output_file = os.path.join(extract_dir, f'Part{part_number}_clip_{i}.mp4')
-                
-                logger.info(f'[{current_index}/{total_videos}] 正在处理片段 {i}: {clip["start"]} - {clip["end"]}')
-                logger.info(f'开始时间: {start_time}秒, 结束时间: {end_time}秒, 时长: {duration}秒')
+            if not all(k in clip for k in ['start', 'end']):
+                logger.error(f"片段 {i} 缺少必要的时间信息")
+                continue
                 
-                try:
-                    # 构建 ffmpeg 命令
-                    command = [
-                        'ffmpeg',
-                        '-y',
-                        '-i', video_path,
-                        '-ss', str(start_time),
-                        '-t', str(duration),
-                        '-c:v', 'libx264',
-                        '-c:a', 'aac',
-                        output_file
-                    ]
-                    
-                    # 运行 ffmpeg 命令
-                    logger.info(f'开始提取片段 {i}...')
-                    
-                    process = subprocess.Popen(
-                        command,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        universal_newlines=True,
-                        encoding='utf-8',
-                        errors='ignore'
-                    )
-                    
-                    # 设置超时时间（秒）
-                    timeout = max(int(duration * 2), 30)  # 至少30秒
-                    start_process_time = time.time()
-                    
-                    while process.poll() is None:
-                        # 检查是否超时
-                        if time.time() - start_process_time > timeout:
-                            process.kill()
-                            logger.error(f'片段 {i} 处理超时（{timeout}秒）')
-                            break
-                        
-                        # 显示进度
-                        elapsed = time.time() - start_process_time
-                        logger.info(f'片段 {i} 处理中... 已用时：{int(elapsed)}秒')
-                        time.sleep(2)  # 每2秒更新一次进度
-                    
-                    # 获取进程输出
-                    stdout, stderr = process.communicate()
-                    
-                    if process.returncode == 0:
-                        logger.info(f'片段 {i} 提取成功：{output_file}')
-                    else:
-                        logger.error(f'片段 {i} 提取失败：{stderr}')
-                        
-                except Exception as e:
-                    logger.error(f"运行 ffmpeg 命令时发生错误: {str(e)}")
-                    continue
-                    
-            except Exception as e:
-                logger.error(f"处理片段 {i} 时发生错误: {str(e)}")
+            start_time = max(0, time_to_seconds(clip['start']) - CLIP_TIME_BUFFER)
+            end_time = time_to_seconds(clip['end']) + CLIP_TIME_BUFFER
+            duration = end_time - start_time
+            
+            if duration <= 0:
+                logger.error(f"片段 {i} 的时长无效：{duration}秒")
                 continue
+            
+            output_file = os.path.join(extract_dir, f'Part{part_number}_clip_{i}.mp4')
+            logger.info(f'[{current_index}/{total_videos}] 片段 {i}: {clip["start"]} - {clip["end"]}，'
+                        f'开始时间: {start_time}秒, 结束时间: {end_time}秒')
+            clips.append((start_time, end_time, output_file))
+        
+        # 所有片段由一次 ffmpeg 调用输出
+        extracted = extract_clip_batch(video_path, clips, stream_copy=CLIP_STREAM_COPY)
+        logger.info(f"[{current_index}/{total_videos}] 成功提取 {len(extracted)}/{len(clips)} 个片段")
         
         return True
         
@@ -748,51 +876,47 @@ def extract_clips(video_path, json_path, total_videos, current_index):
         logger.error(f"[{current_index}/{total_videos}] 提取片段时发生错误: {str(e)}")
         return False
 
-def process_single_video(video_path, model, chat, image_file, total_videos, current_index, character_response, VIDEO_PROMPT, character_image_path, CHARACTER_PROMPT):
+def upload_video_for_analysis(video_path):
+    """压缩（按配置）并上传视频，等待 Gemini 处理完成后返回文件对象"""
+    # 根据配置决定是否压缩视频
+    if ENABLE_COMPRESSION:
+        video_path_for_analysis = compress_video_before_upload(video_path, COMPRESSION_SIZE)
+        logger.info(f"视频压缩已启用，使用压缩后的视频进行分析，压缩后大小为{COMPRESSION_SIZE}MB")
+    else:
+        video_path_for_analysis = video_path
+        logger.info("视频压缩已禁用，使用原始视频进行分析")
+    
+    # 上传视频
+    video_file = upload_media_with_retry(video_path_for_analysis, "视频")
+    check_pause()  # 检查是否需要暂停
+    
+    # 等待视频处理，处理失败或超时时抛出异常
+    logger.info("等待视频处理完成...")
+    video_file = file_tracker.wait_active(video_file)
+    logger.info("视频处理已完成")
+    return video_file
+
+def process_single_video(video_path, model, chat, image_file, total_videos, current_index, character_response, VIDEO_PROMPT, character_image_path, CHARACTER_PROMPT, segment_id=None):
     """处理单个视频文件"""
     try:
-        # 创建视频处理记录
-        video_record_id = create_video_record(video_path, character_image_path)
-        if not video_record_id:
-            logger.error("创建视频处理记录失败")
-            return False
-            
         check_pause()  # 检查是否需要暂停
         video_name = os.path.splitext(os.path.basename(video_path))[0]
         logger.info(f"=== 开始处理视频 [{current_index}/{total_videos}]: {video_name} ===")
         logger.info(f"视频路径: {video_path}")
         
-        # 根据配置决定是否压缩视频
-        if ENABLE_COMPRESSION:
-            video_path_for_analysis = compress_video_before_upload(video_path, COMPRESSION_SIZE)
-            logger.info(f"视频压缩已启用，使用压缩后的视频进行分析，压缩后大小为{COMPRESSION_SIZE}MB")
+        if ANALYSIS_MODE == 'frames':
+            # 本地抽帧，以内联图片发送，不需要压缩、上传和等待服务端处理
+            logger.info(f"使用关键帧模式，抽取 {FRAME_SAMPLE_COUNT} 帧")
+            video_message = build_frame_message(video_path, VIDEO_PROMPT, FRAME_SAMPLE_COUNT, FRAME_SAMPLE_WIDTH)
         else:
-            video_path_for_analysis = video_path
-            logger.info("视频压缩已禁用，使用原始视频进行分析")
-        
-        # 上传视频
-        video_file = upload_media_with_retry(video_path_for_analysis, "视频")
-        check_pause()  # 检查是否需要暂停
-        
-        # 等待视频处理
-        logger.info("等待视频处理完成...")
-        process_start_time = time.time()
-        while video_file.state.name == "PROCESSING":
-            print('.', end='', flush=True)
-            time.sleep(10)
-            video_file = genai.get_file(video_file.name)
-            if time.time() - process_start_time > 300:  # 5分钟超时
-                raise TimeoutError("视频处理超时")
-        logger.info("视频处理已完成")
-        
-        if video_file.state.name == "FAILED":
-            raise ValueError(f"视频处理失败: {video_file.state.name}")
+            video_message = [VIDEO_PROMPT, upload_video_for_analysis(video_path)]
         
         # 发送第二轮问题
         check_pause()  # 检查是否需要暂停
         logger.info(f"[{current_index}/{total_videos}] 开始发送视频分析请求...")
-        start_time = time.time()
-        video_response = send_message_with_retry(chat, [VIDEO_PROMPT, video_file])
+        with analysis_slots:
+            start_time = time.time()
+            video_response = send_message_with_retry(chat, video_message)
         end_time = time.time()
         response_time = end_time - start_time
         
@@ -824,6 +948,7 @@ def process_single_video(video_path, model, chat, image_file, total_videos, curr
             f.write(f"- **时间**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write(f"- **视频**: {video_path}\n\n")            
             f.write(f"- **使用模型**: {SELECTED_MODEL}\n")
+            f.write(f"- **分析模式**: {'关键帧（' + str(FRAME_SAMPLE_COUNT) + '帧）' if ANALYSIS_MODE == 'frames' else '完整视频'}\n")
             
             # 获取相对路径
             relative_path = os.path.relpath(character_image_path, os.path.dirname(output_file))
@@ -836,6 +961,8 @@ def process_single_video(video_path, model, chat, image_file, total_videos, curr
             f.write(f"- **图片**:\n\n![角色图片]({safe_path})\n\n")
             f.write(f"- **提示词**: {CHARACTER_PROMPT}\n\n")
             f.write("### 分析结果\n")
+            if getattr(character_response, 'cached', False):
+                f.write("（使用缓存的角色分析，本次未消耗Token）\n\n")
             f.write(f"{character_response.text}\n\n")
             f.write("### Token统计\n")
             f.write("| 类型 | 数量 |\n")
@@ -871,10 +998,6 @@ def process_single_video(video_path, model, chat, image_file, total_videos, curr
         logger.info(f"处理时间: {response_time:.2f}秒")
         logger.info(f"结果已保存到: {output_file}")
         
-        # 等待5秒后进行JSON调整
-        logger.info(f"[{current_index}/{total_videos}] 等待5秒后进行JSON调整...")
-        time.sleep(5)
-        
         # 提取基础名称和Part编号
         video_name = os.path.splitext(os.path.basename(video_path))[0]
         base_name = re.sub(r'^Part\d+_|_compressedPart\d+.*$', '', video_name)
@@ -895,12 +1018,8 @@ def process_single_video(video_path, model, chat, image_file, total_videos, curr
             return True
             
         try:
-            # 读取txt文件内容
-            with open(output_file, 'r', encoding='utf-8') as f:
-                txt_content = f.read()
-            
-            # 提取JSON内容
-            analysis_json = extract_json_from_txt(txt_content)
+            # 直接从模型响应中提取JSON，不再回读 markdown 报告
+            analysis_json = extract_json_from_txt(video_response.text)
             if not analysis_json:
                 logger.error(f"[{current_index}/{total_videos}] 无法从分析结果中提取JSON内容")
                 return True
@@ -925,29 +1044,77 @@ def process_single_video(video_path, model, chat, image_file, total_videos, curr
             logger.error(f"[{current_index}/{total_videos}] JSON处理失败: {str(e)}")
             return True
         
-        # JSON处理完成后，等待5秒再开始提取视频片段
-        logger.info(f"[{current_index}/{total_videos}] JSON处理完成，等待5秒后开始提取视频片段...")
-        time.sleep(5)
-        
-        # 开始提取视频片段
-        logger.info(f"[{current_index}/{total_videos}] 开始提取视频片段...")
-        if extract_clips(video_path, json_path, total_videos, current_index):
-            logger.info(f"[{current_index}/{total_videos}] 视频片段提取完成")
-        else:
-            logger.error(f"[{current_index}/{total_videos}] 视频片段提取失败")
+        # 分析结果已写入JSON，续跑时不再重复分析
+        if segment_id:
+            update_segment_record(segment_id, 'ANALYZED', analysis_result=video_response.text)
         
-        # 在处理完成后更新记录
-        update_video_record(video_record_id, 'COMPLETED')
-        
-        return True
+        return extract_segment_clips(video_path, json_path, total_videos, current_index, segment_id)
             
     except Exception as e:
-        # 更新失败状态
-        if 'video_record_id' in locals():
-            update_video_record(video_record_id, 'FAILED')
+        # 更新失败状态；队列 worker 由 release_segment 按剩余尝试次数决定是否标记失败
+        if segment_id and not getattr(worker_context, 'worker_id', None):
+            update_segment_record(segment_id, 'FAILED')
         logger.error(f"处理视频失败: {str(e)}")
         return False
 
+def get_split_json_path(video_path):
+    """分割片段对应的 splitjson 文件路径"""
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    base_name = re.sub(r'^Part\d+_|_compressedPart\d+.*$', '', video_name)
+    part_number = re.search(r'Part(\d+)', video_name).group(1)
+    return os.path.join('outputs', base_name, 'splitjson', f'Part{part_number}_{base_name}.json')
+
+def extract_segment_clips(video_path, json_path, total_videos, current_index, segment_id=None):
+    """按JSON提取视频片段，并记录提取结果"""
+    logger.info(f"[{current_index}/{total_videos}] 开始提取视频片段...")
+    if not extract_clips(video_path, json_path, total_videos, current_index):
+        logger.error(f"[{current_index}/{total_videos}] 视频片段提取失败")
+        return True
+    logger.info(f"[{current_index}/{total_videos}] 视频片段提取完成")
+    check_pause()  # 检查是否需要暂停
+    
+    if segment_id:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            split_json = json.load(f)
+        appearances = split_json.get('Appearances', [])
+        
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        base_name = re.sub(r'^Part\d+_|_compressedPart\d+.*$', '', video_name)
+        part_number = re.search(r'Part(\d+)', video_name).group(1)
+        extract_dir = os.path.join('outputs', base_name, 'extract')
+        # 旧的分割JSON没有记录起点，绝对时间留空
+        start_key = f"{video_name}_start"
+        offset = float(split_json[start_key]) if start_key in split_json else None
+        
+        clips = []
+        for i, clip in enumerate(appearances, 1):
+            clip_path = os.path.join(extract_dir, f'Part{part_number}_clip_{i}.mp4')
+            clips.append({
+                'clip_number': i,
+                'start': clip.get('start', ''),
+                'end': clip.get('end', ''),
+                'description': clip.get('description', ''),
+                'extracted_clip_path': clip_path if os.path.exists(clip_path) else '',
+                'start_seconds': None if offset is None else offset + time_to_seconds(clip.get('start', '')),
+                'end_seconds': None if offset is None else offset + time_to_seconds(clip.get('end', ''))
+            })
+        save_analysis_results(segment_id, clips, 'EXTRACTED')
+    
+    return True
+
+def read_segment_list(segment_list):
+    """读取 ffmpeg segment 输出的 csv 列表，返回 {文件名: (起点秒, 时长)}"""
+    segments = {}
+    try:
+        with open(segment_list, 'r', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) >= 3:
+                    start, end = float(row[1]), float(row[2])
+                    segments[os.path.basename(row[0])] = (round(start, 3), round(end - start, 3))
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取分段列表失败: {str(e)}")
+    return segments
+
 def split_video(input_file, segment_duration):
     """分割视频为指定时长的片段"""
     logger.info("=== 开始视频分割 ===")
@@ -981,6 +1148,8 @@ def split_video(input_file, segment_duration):
         
         # 设置FFmpeg命令
         output_pattern = os.path.join(split_output_dir, f'Part%d_{name}.mp4')
+        # 分段列表记录每段的起止时间，不用再逐个探测分段时长
+        segment_list = os.path.join(split_output_dir, f'{name}_segments.csv')
         
         cmd = [
             'ffmpeg',
@@ -991,6 +1160,8 @@ def split_video(input_file, segment_duration):
             '-c:a', 'copy',
             '-f', 'segment',
             '-segment_time', str(segment_duration),
+            '-segment_list', segment_list,
+            '-segment_list_type', 'csv',
             '-reset_timestamps', '1',
             '-avoid_negative_ts', 'make_zero',
             '-y',
@@ -1011,6 +1182,7 @@ def split_video(input_file, segment_duration):
             # 获取分割后的视频文件列表
             split_files = [os.path.join(split_output_dir, f) for f in os.listdir(split_output_dir) 
                          if f.startswith('Part') and f.endswith('.mp4') and name in f]
+            segment_times = read_segment_list(segment_list)
             
             # 为每个分割视频创建对应的JSON文件
             for video_file in split_files:
@@ -1018,14 +1190,18 @@ def split_video(input_file, segment_duration):
                 json_name = f'{video_name}.json'
                 json_path = os.path.join(json_output_dir, json_name)
                 
-                # 获取视频时长
-                duration = get_video_info(video_file)
+                # 获取视频时长和在原视频中的起点
+                start, duration = segment_times.get(os.path.basename(video_file), (None, None))
+                if duration is None:
+                    duration = get_video_info(video_file)
                 
                 # 创建JSON内容
                 json_content = {
                     f"{video_name}_time": str(int(duration)),
                     "Appearances": []
                 }
+                if start is not None:
+                    json_content[f"{video_name}_start"] = f"{start:.3f}"
                 
                 # 写入JSON文件
                 with open(json_path, 'w', encoding='utf-8') as f:
@@ -1044,7 +1220,7 @@ def split_video(input_file, segment_duration):
         return False, []
 
 def merge_json_files(json_files):
-    """合并JSON文件"""
+    """合并JSON文件，返回 (输出路径, 统计信息)"""
     if not json_files:
         logger.error("未选择JSON文件")
         return None, "请先选择JSON文件"
@@ -1074,16 +1250,19 @@ def merge_json_files(json_files):
             # 如果无法按Part数字排序,就按文件名字母顺序排序
             sorted_files = sorted(json_files)
         
-        merged_data = {
-            "total_time": 0,
-            "part_times": [],
-            "Appearances": []
-        }
+        # 逐个读取分段JSON，Appearances 边读边写入输出文件，内存占用与分段数量无关
+        total_time = 0
+        part_times = []
+        appearance_count = 0
         
-        # 遍历所有JSON文件
-        for json_file in sorted_files:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+        temp_path = f"{output_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as out:
+            out.write('{\n  "Appearances": [')
+            
+            # 遍历所有JSON文件
+            for json_file in sorted_files:
+                with open(json_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
                 
                 # 获取完整的文件名（不含扩展名）
                 full_part_name = os.path.splitext(os.path.basename(json_file))[0]
@@ -1092,21 +1271,35 @@ def merge_json_files(json_files):
                 time_key = f"{full_part_name}_time"
                 part_time = int(data.get(time_key, 0))
                 
-                merged_data["part_times"].append({
+                part_times.append({
                     "part": full_part_name,
                     "time": part_time
                 })
-                merged_data["total_time"] += part_time
+                # 分段在原视频中的起点：优先使用分割时记录的精确值，否则累加前面分段的时长
+                offset = float(data.get(f"{full_part_name}_start", total_time))
+                total_time += part_time
                 
-                # 直接添加 Appearances 数据
+                # 写入 Appearances 数据，附加在原视频中的绝对时间（秒）
                 for appearance in data.get("Appearances", []):
-                    merged_data["Appearances"].append(appearance)
-        
-        # 保存合并后的文件
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(merged_data, f, ensure_ascii=False, indent=2)
+                    appearance = dict(appearance)
+                    appearance["start_seconds"] = offset + time_to_seconds(appearance.get("start", ""))
+                    appearance["end_seconds"] = offset + time_to_seconds(appearance.get("end", ""))
+                    out.write(',\n    ' if appearance_count else '\n    ')
+                    out.write(json.dumps(appearance, ensure_ascii=False))
+                    appearance_count += 1
             
-        return output_path, merged_data
+            out.write('\n  ],\n  "part_times": ')
+            out.write(json.dumps(part_times, ensure_ascii=False))
+            out.write(f',\n  "total_time": {total_time}\n}}\n')
+        
+        # 写完后再替换，中途失败不会留下不完整的文件
+        os.replace(temp_path, output_path)
+        
+        return output_path, {
+            "total_time": total_time,
+            "parts": len(part_times),
+            "appearance_count": appearance_count
+        }
         
     except Exception as e:
         logger.error(f"合并失败: {str(e)}")
@@ -1114,6 +1307,8 @@ def merge_json_files(json_files):
 
 def get_character_image():
     """获取角色图片路径"""
+    import tkinter as tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()
     
@@ -1132,66 +1327,170 @@ def get_character_image():
     
     return file_path
 
-def batch_process():
-    """批量处理视频"""
+def process_segment(video_path, model, image_file, part_idx, total_parts, file_idx, total_files,
+                    CHARACTER_PROMPT, VIDEO_PROMPT, character_image_path, segment=None):
+    """处理单个分割片段：新建会话、角色分析、视频分析"""
+    check_pause()  # 检查是否需要暂停
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    base_name = re.sub(r'^Part\d+_|_compressedPart\d+.*$', '', video_name)
+    part_number = re.search(r'Part(\d+)', video_name).group(1)
+    segment = segment or {}
+    segment_id = segment.get('id')
+    status = segment.get('status')
+    
+    logger.info(f"=== 视频 [{file_idx}/{total_files}] - Part {part_number} [{part_idx}/{total_parts}] ===")
+    logger.info(f"视频名称: {video_name}")
+    logger.info(f"基础名称: {base_name}")
+    
+    # 断点续跑：跳过已完成的步骤
+    if status in ('EXTRACTED', 'SKIPPED'):
+        logger.info(f"[视频 {file_idx}/{total_files} - Part {part_number}] 已完成，跳过")
+        return True
+    if status == 'ANALYZED':
+        logger.info(f"[视频 {file_idx}/{total_files} - Part {part_number}] 已分析，复用JSON直接提取片段")
+        return extract_segment_clips(video_path, get_split_json_path(video_path), total_parts, part_idx, segment_id)
+    
+    # 本地预筛选：静止或黑屏的片段不上传
+    if ENABLE_ACTIVITY_FILTER:
+        try:
+            activity = analyze_activity(video_path)
+            logger.info(f"[视频 {file_idx}/{total_files} - Part {part_number}] 活动度: "
+                        f"运动帧占比 {activity['active_ratio']:.1%}，场景切换 {activity['scene_changes']} 次")
+            if activity['skip']:
+                logger.info(f"[视频 {file_idx}/{total_files} - Part {part_number}] 跳过分析: {activity['reason']}")
+                if segment_id:
+                    update_segment_record(segment_id, 'SKIPPED', analysis_result=json.dumps(activity, ensure_ascii=False))
+                return True
+        except Exception as e:
+            logger.warning(f"[视频 {file_idx}/{total_files} - Part {part_number}] 预筛选失败，继续分析: {str(e)}")
+    
+    # 为每个视频创建新的会话，角色分析优先使用缓存
+    logger.info(f"[视频 {file_idx}/{total_files} - Part {part_number}] 准备角色分析...")
+    chat, character_response, image_file = character_cache.start_chat(
+        model, SELECTED_MODEL, character_image_path, CHARACTER_PROMPT,
+        upload_image_with_retry, send_message_with_retry
+    )
+    logger.info(f"[视频 {file_idx}/{total_files} - Part {part_number}] 角色特征分析完成")
+    
+    # 处理视频片段
+    success = process_single_video(video_path, model, chat, image_file, total_parts, part_idx, character_response, VIDEO_PROMPT, character_image_path, CHARACTER_PROMPT, segment_id)
+    if success:
+        check_pause()  # 检查是否需要暂停
+        logger.info(f"[视频 {file_idx}/{total_files} - Part {part_number}] 处理成功")
+    else:
+        logger.error(f"[视频 {file_idx}/{total_files} - Part {part_number}] 处理失败")
+    
+    # 关闭当前会话
+    logger.info(f"[{part_idx}/{total_parts}] 关闭当前会话...")
+    return success
+
+def process_segments(segments, model, image_file, file_idx, total_files,
+                     CHARACTER_PROMPT, VIDEO_PROMPT, character_image_path, video_record_id=None):
+    """
+    处理一个视频的所有片段，返回 (成功数, 失败数)
+    
+    segments 为 [(片段路径, 片段记录)]。MAX_CONCURRENT_SEGMENTS 大于1时多个片段同时上传和分析，
+    各片段的结果写入各自的JSON文件，合并时再按Part顺序排列
+    """
+    total_parts = len(segments)
+    successful = 0
+    failed = 0
+    
+    def on_done(success):
+        nonlocal successful, failed
+        if success:
+            successful += 1
+        else:
+            failed += 1
+        if video_record_id:
+            update_video_record(video_record_id, None, processed_parts=successful)
+        emit_event('segment_finished', video_index=file_idx, success=bool(success),
+                   successful=successful, failed=failed, total_parts=total_parts)
+    
+    if MAX_CONCURRENT_SEGMENTS <= 1:
+        for part_idx, (video_path, segment) in enumerate(segments, 1):
+            on_done(process_segment(video_path, model, image_file, part_idx, total_parts, file_idx, total_files,
+                                    CHARACTER_PROMPT, VIDEO_PROMPT, character_image_path, segment))
+        return successful, failed
+    
+    # 额外的线程用于提前上传后续片段，分析请求的并发数由 analysis_slots 控制
+    workers = min(MAX_CONCURRENT_SEGMENTS + MAX_PENDING_UPLOADS, total_parts)
+    logger.info(f"[视频 {file_idx}/{total_files}] 并发处理 {total_parts} 个片段，"
+                f"同时分析 {MAX_CONCURRENT_SEGMENTS} 个，提前上传 {MAX_PENDING_UPLOADS} 个")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segment") as executor:
+        futures = {
+            executor.submit(process_segment, video_path, model, image_file, part_idx, total_parts, file_idx, total_files,
+                            CHARACTER_PROMPT, VIDEO_PROMPT, character_image_path, segment): video_path
+            for part_idx, (video_path, segment) in enumerate(segments, 1)
+        }
+        for future in as_completed(futures):
+            try:
+                on_done(future.result())
+            except Exception as e:
+                on_done(False)
+                logger.error(f"片段处理异常 {os.path.basename(futures[future])}: {str(e)}")
+    
+    return successful, failed
+
+def merge_video_json(base_name):
+    """合并一个视频所有片段的JSON文件"""
+    try:
+        # 获取splitjson目录中的所有片段JSON文件
+        json_dir = os.path.join('outputs', base_name, 'splitjson')
+        json_files = [os.path.join(json_dir, f) for f in os.listdir(json_dir) 
+                     if f.startswith('Part') and f.endswith('.json') and base_name in f]
+        
+        if json_files:
+            logger.info(f"=== 开始合并JSON文件: {base_name} ===")
+            output_path, merged_data = merge_json_files(json_files)
+            
+            if output_path and merged_data:
+                logger.info("JSON文件合并完成！")
+                logger.info(f"总时长：{merged_data['total_time']}秒")
+                logger.info(f"总片段数：{merged_data['appearance_count']}")
+                logger.info(f"输出文件：{output_path}")
+            else:
+                logger.error("JSON合并失败")
+    except Exception as e:
+        logger.error(f"JSON合并过程中发生错误: {str(e)}")
+
+def run_analysis(input_files, character_image_path, CHARACTER_PROMPT, VIDEO_PROMPT):
+    """
+    分析一组视频：分割、逐段分析、提取片段、合并JSON，不依赖任何界面交互
+    
+    Args:
+        input_files: 视频文件路径列表
+        character_image_path: 角色图片路径
+        CHARACTER_PROMPT: 角色分析提示词
+        VIDEO_PROMPT: 视频分析提示词
+    
+    Returns:
+        dict: videos, successful, failed, total_time
+    """
     # 初始化数据库
     if not init_database():
-        logger.error("数据库初始化失败，程序退出")
-        return
-        
-    # 启动暂停处理线程
-    pause_thread = threading.Thread(target=pause_handler, daemon=True)
-    pause_thread.start()
+        raise RuntimeError("数据库初始化失败")
     
     start_time = time.time()
-    logger.info("\n=== 7.videoprocess 开始 ===")
-    logger.info("=== 批量视频处理启动 ===")
-    logger.info("随时可以输入 pause 暂停程序，输入 continue 继续运行")
+    file_idx = 0
+    total_successful = 0
+    total_failed = 0
+    emit_event('job_started', videos=len(input_files))
     
     try:
-        # 获取角色图片
-        logger.info("请选择角色图片...")
-        character_image_path = get_character_image()
-        logger.info(f"已选择角色图片: {character_image_path}")
-        
-        # 获取提示词
-        CHARACTER_PROMPT, VIDEO_PROMPT = get_prompts()
-        logger.info("已获取提示词")
-        
-        # 选择要分割的多个视频文件
-        logger.info("请选择要处理的视频文件（可多选）...")
-        input_files = askopenfilenames(
-            title="选择要分割的视频文件（可多选）",
-            filetypes=[("视频文件", "*.mp4;*.mkv;*.avi;*.mov;*.wmv")]
-        )
-        
-        if not input_files:
-            logger.error("未选择视频文件，程序退出")
-            return
-            
-        # 将文件列表转换为列表并按名称排序
-        input_files = sorted(list(input_files))
-        logger.info(f"选择了 {len(input_files)} 个视频文件:")
-        for idx, file_path in enumerate(input_files, 1):
-            logger.info(f"  {idx}. {file_path}")
-        
         # 分段时长使用配置值
         segment_duration = SEGMENT_DURATION
         logger.info(f"设定的分段时长: {segment_duration}秒")
         
-        # 初始化总体统计
-        total_successful = 0
-        total_failed = 0
-        
         # 初始化模型
         logger.info("正在初始化 Gemini 模型...")
         model = genai.GenerativeModel(SELECTED_MODEL)
         logger.info(f"当前使用模型: {SELECTED_MODEL}")
         logger.info(f"模型说明: {MODEL_CONFIG.get(SELECTED_MODEL, '未知模型')}")
         
-        # 上传角色图片
-        logger.info(f"上传角色示例图片: {character_image_path}")
-        image_file = upload_image_with_retry(character_image_path)
+        # 上传角色图片（缓存中的句柄未过期时直接复用）
+        logger.info(f"准备角色示例图片: {character_image_path}")
+        image_file = character_cache.get_image_file(character_image_path, upload_image_with_retry)
         
         # 处理每个输入视频
         for file_idx, input_file in enumerate(input_files, 1):
@@ -1199,116 +1498,51 @@ def batch_process():
             video_basename = os.path.basename(input_file)
             logger.info(f"=== 处理视频文件 [{file_idx}/{len(input_files)}]: {video_basename} ===")
             logger.info(f"视频路径: {input_file}")
+            emit_event('video_started', video_index=file_idx, videos=len(input_files), video=video_basename)
             
-            # 执行视频分割
-            success, split_files = split_video(input_file, segment_duration)
-            if not success:
+            # 分割视频（断点续跑时复用已有的分割文件）
+            video_record_id, segments = prepare_video_record(input_file, character_image_path, segment_duration)
+            if not segments:
                 logger.error(f"[{file_idx}/{len(input_files)}] 视频 {video_basename} 分割失败，跳过此视频")
+                emit_event('video_failed', video_index=file_idx, video=video_basename, error="视频分割失败")
                 continue
             
-            # 对分割后的视频文件按Part编号排序
-            split_files.sort(key=lambda x: int(re.search(r'Part(\d+)', os.path.basename(x)).group(1)))
-            logger.info(f"[{file_idx}/{len(input_files)}] 视频分割完成，共 {len(split_files)} 个片段")
+            logger.info(f"[{file_idx}/{len(input_files)}] 视频分割完成，共 {len(segments)} 个片段")
+            emit_event('video_split', video_index=file_idx, total_parts=len(segments))
             
             # 处理当前视频的所有片段
-            for part_idx, video_path in enumerate(split_files, 1):
-                check_pause()  # 检查是否需要暂停
-                video_name = os.path.splitext(os.path.basename(video_path))[0]
-                base_name = re.sub(r'^Part\d+_|_compressedPart\d+.*$', '', video_name)
-                part_number = re.search(r'Part(\d+)', video_name).group(1)
-                
-                logger.info(f"=== 视频 [{file_idx}/{len(input_files)}] - Part {part_number} [{part_idx}/{len(split_files)}] ===")
-                logger.info(f"视频名称: {video_name}")
-                logger.info(f"基础名称: {base_name}")
-                
-                # 为每个视频创建新的会话
-                chat = model.start_chat()
-                
-                # 角色分析
-                logger.info(f"[视频 {file_idx}/{len(input_files)} - Part {part_number}] 发送角色分析请求...")
-                character_response = send_message_with_retry(chat, [CHARACTER_PROMPT, image_file])
-                logger.info(f"[视频 {file_idx}/{len(input_files)} - Part {part_number}] 角色特征分析完成")
-                
-                # 处理视频片段
-                if process_single_video(video_path, model, chat, image_file, len(split_files), part_idx, character_response, VIDEO_PROMPT, character_image_path, CHARACTER_PROMPT):
-                    check_pause()  # 检查是否需要暂停
-                    total_successful += 1
-                    logger.info(f"[视频 {file_idx}/{len(input_files)} - Part {part_number}] 处理成功")
-                else:
-                    total_failed += 1
-                    logger.error(f"[视频 {file_idx}/{len(input_files)} - Part {part_number}] 处理失败")
-                
-                # 关闭当前会话
-                logger.info(f"[{part_idx}/{split_files}] 关闭当前会话...")
-                chat = None
-
-                # 处理间隔
-                if part_idx < len(split_files):
-                    logger.info(f"[视频 {file_idx}/{len(input_files)} - Part {part_number}] 等待5秒后处理下一个片段...")
-                    time.sleep(5)
+            successful, failed = process_segments(
+                segments, model, image_file, file_idx, len(input_files),
+                CHARACTER_PROMPT, VIDEO_PROMPT, character_image_path, video_record_id
+            )
+            total_successful += successful
+            total_failed += failed
+            update_video_record(video_record_id, 'COMPLETED' if failed == 0 else 'FAILED')
             
-            # 当前视频的所有片段处理完成，准备处理下一个视频
-            if file_idx < len(input_files):
-                logger.info(f"[{file_idx}/{len(input_files)}] {video_basename} 处理完成，等待5秒后处理下一个视频...")
-                time.sleep(5)
-        
-        # 输出最终统计
-        end_time = time.time()
-        total_time = end_time - start_time
-        
-        logger.info("\n=== 批量处理完成 ===")
-        logger.info(f"处理的视频文件数: {len(input_files)}")
-        logger.info(f"处理的视频片段总数: {total_successful + total_failed}")
-        logger.info(f"成功: {total_successful}")
-        logger.info(f"失败: {total_failed}")
-        logger.info(f"总耗时: {total_time:.2f}秒")
-        logger.info(f"平均每个视频耗时: {total_time/len(input_files):.2f}秒")
-        logger.info(f"平均每个片段耗时: {total_time/(total_successful + total_failed):.2f}秒")
+            # 当前视频的所有片段处理完成后，按Part顺序合并JSON
+            merge_video_json(os.path.splitext(video_basename)[0])
+            emit_event('video_finished', video_index=file_idx, video=video_basename,
+                       successful=successful, failed=failed)
         
-        # 在处理完当前视频的所有片段后，执行JSON合并
-        try:
-            # 获取splitjson目录中的所有JSON文件
-            json_dir = os.path.join('outputs', base_name, 'splitjson')
-            json_files = [os.path.join(json_dir, f) for f in os.listdir(json_dir) 
-                         if f.endswith('.json') and base_name in f]
-            
-            if json_files:
-                logger.info(f"=== 开始合并JSON文件 [{file_idx}/{len(input_files)}] ===")
-                output_path, merged_data = merge_json_files(json_files)
-                
-                if output_path and merged_data:
-                    logger.info("JSON文件合并完成！")
-                    logger.info(f"总时长：{merged_data['total_time']}秒")
-                    logger.info(f"总片段数：{len(merged_data['Appearances'])}")
-                    logger.info(f"输出文件：{output_path}")
-                else:
-                    logger.error("JSON合并失败")
-        except Exception as e:
-            logger.error(f"JSON合并过程中发生错误: {str(e)}")
-
-        logger.info("=== 7.videoprocess 结束 ===")
-        
-    except Exception as e:
+    except BaseException as e:
         # 计算处理时间
-        end_time = time.time()
-        total_time = end_time - start_time
+        total_time = time.time() - start_time
         
         # 输出错误发生时的处理进度
-        logger.error("\n=== 处理过程中发生错误 ===")
-        logger.error(f"错误信息: {str(e)}")
+        if isinstance(e, JobCancelled):
+            logger.info("\n=== 任务已取消 ===")
+        else:
+            logger.error("\n=== 处理过程中发生错误 ===")
+            logger.error(f"错误信息: {str(e)}")
         
         # 显示当前处理进度
-        if 'file_idx' in locals() and 'input_files' in locals():
+        if file_idx:
             current_video = os.path.basename(input_files[file_idx-1])
-            logger.error(f"错误发生在第 {file_idx}/{len(input_files)} 个视频: {current_video}")
-            
-            if 'part_idx' in locals() and 'split_files' in locals():
-                current_part = os.path.basename(split_files[part_idx-1])
-                logger.error(f"错误发生在视频的第 {part_idx}/{len(split_files)} 个片段: {current_part}")
+            logger.error(f"中断发生在第 {file_idx}/{len(input_files)} 个视频: {current_video}")
         
         # 输出已处理的统计信息
         logger.info("\n=== 处理中断时的统计 ===")
-        logger.info(f"处理的视频文件数: {file_idx if 'file_idx' in locals() else 0}/{len(input_files)}")
+        logger.info(f"处理的视频文件数: {file_idx}/{len(input_files)}")
         logger.info(f"处理的视频片段总数: {total_successful + total_failed}")
         logger.info(f"成功: {total_successful}")
         logger.info(f"失败: {total_failed}")
@@ -1317,14 +1551,86 @@ def batch_process():
         if total_successful + total_failed > 0:
             logger.info(f"平均每个片段耗时: {total_time/(total_successful + total_failed):.2f}秒")
         
-        if 'file_idx' in locals():
+        if file_idx:
             logger.info(f"平均每个视频耗时: {total_time/file_idx:.2f}秒")
         
         # 重新抛出异常
         raise
+    
+    # 输出最终统计
+    total_time = time.time() - start_time
+    
+    logger.info("\n=== 批量处理完成 ===")
+    logger.info(f"处理的视频文件数: {len(input_files)}")
+    logger.info(f"处理的视频片段总数: {total_successful + total_failed}")
+    logger.info(f"成功: {total_successful}")
+    logger.info(f"失败: {total_failed}")
+    logger.info(f"总耗时: {total_time:.2f}秒")
+    if input_files:
+        logger.info(f"平均每个视频耗时: {total_time/len(input_files):.2f}秒")
+    if total_successful + total_failed > 0:
+        logger.info(f"平均每个片段耗时: {total_time/(total_successful + total_failed):.2f}秒")
+    
+    stats = {
+        'videos': len(input_files),
+        'successful': total_successful,
+        'failed': total_failed,
+        'total_time': round(total_time, 2),
+    }
+    emit_event('job_finished', **stats)
+    return stats
+
+def batch_process():
+    """批量处理视频：通过对话框选择输入，控制台输入 pause/continue 控制暂停"""
+    from tkinter.filedialog import askopenfilenames
+    
+    # 启动暂停处理线程
+    pause_thread = threading.Thread(target=pause_handler, daemon=True)
+    pause_thread.start()
+    
+    logger.info("\n=== 7.videoprocess 开始 ===")
+    logger.info("=== 批量视频处理启动 ===")
+    logger.info("随时可以输入 pause 暂停程序，输入 continue 继续运行")
+    
+    # 获取角色图片
+    logger.info("请选择角色图片...")
+    character_image_path = get_character_image()
+    logger.info(f"已选择角色图片: {character_image_path}")
+    
+    # 获取提示词
+    CHARACTER_PROMPT, VIDEO_PROMPT = get_prompts()
+    logger.info("已获取提示词")
+    
+    # 选择要分割的多个视频文件
+    logger.info("请选择要处理的视频文件（可多选）...")
+    input_files = askopenfilenames(
+        title="选择要分割的视频文件（可多选）",
+        filetypes=[("视频文件", "*.mp4;*.mkv;*.avi;*.mov;*.wmv")]
+    )
+    
+    if not input_files:
+        logger.error("未选择视频文件，程序退出")
+        return
+        
+    # 将文件列表转换为列表并按名称排序
+    input_files = sorted(list(input_files))
+    logger.info(f"选择了 {len(input_files)} 个视频文件:")
+    for idx, file_path in enumerate(input_files, 1):
+        logger.info(f"  {idx}. {file_path}")
+    
+    run_analysis(input_files, character_image_path, CHARACTER_PROMPT, VIDEO_PROMPT)
+    logger.info("=== 7.videoprocess 结束 ===")
 
 def extract_json_from_txt(txt_content):
     """从txt文件内容中提取JSON部分"""
+    # 响应本身就是JSON时直接解析，不走正则
+    try:
+        potential_json = json.loads(txt_content.strip())
+        if isinstance(potential_json, dict) and isinstance(potential_json.get('Appearances'), list):
+            return potential_json
+    except ValueError:
+        pass
+    
     try:
         # 尝试多种可能的JSON格式
         patterns = [
@@ -1397,63 +1703,40 @@ def update_json_content(json_data, part_number):
 
 def get_video_info(video_path):
     """获取视频时长（秒）"""
-    try:
-        # 使用ffmpeg获取视频信息
-        cmd = [
-            'ffmpeg',
-            '-i', video_path
-        ]
-        
-        # 运行命令并捕获输出
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            encoding='utf-8',
-            errors='ignore'
-        )
-        
-        # 在ffmpeg输出中查找持续时间信息
-        duration_match = re.search(r'Duration: (\d{2}):(\d{2}):(\d{2})\.(\d{2})', result.stderr)
-        if duration_match:
-            hours = int(duration_match.group(1))
-            minutes = int(duration_match.group(2))
-            seconds = int(duration_match.group(3))
-            centiseconds = int(duration_match.group(4))
-            
-            total_seconds = hours * 3600 + minutes * 60 + seconds + centiseconds / 100
-            return total_seconds
-        else:
-            raise ValueError("无法获取视频时长")
-            
-    except Exception as e:
-        logger.error(f"获取视频信息失败: {str(e)}")
-        return 0
+    return get_duration(video_path)
 
 def upload_image_with_retry(image_path):
     """带重试机制的图片文件上传"""
-    max_retries = 5
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            logger.info(f"正在上传图片... (尝试 {retry_count + 1}/{max_retries})")
-            image_file = genai.upload_file(image_path)
-            logger.info(f"上传完成: {image_file.uri}")
-            return image_file
-        except Exception as e:
-            retry_count += 1
-            if retry_count == max_retries:
-                raise e
-            logger.warning(f"上传失败，正在重试: {str(e)}")
-            time.sleep(30)
+    return upload_media_with_retry(image_path, "图片")
 
 def check_pause():
-    """检查是否需要暂停"""
+    """检查是否需要暂停，任务被取消时抛出 JobCancelled，队列 worker 的租约丢失时抛出 LeaseLost"""
     global is_paused
     while is_paused:
         pause_event.wait()  # 等待继续信号
+    
+    lease_lost = getattr(worker_context, 'lease_lost', None)
+    if lease_lost and lease_lost():
+        raise LeaseLost()
+    
+    if job_state_getter is None:
+        return
+    while True:
+        state = job_state_getter()
+        if state == 'cancelled':
+            raise JobCancelled()
+        if state != 'paused':
+            return
+        time.sleep(1)
+
+def emit_event(event, **data):
+    """发送进度事件，回调出错不影响处理流程"""
+    if event_callback is None:
+        return
+    try:
+        event_callback(event, data)
+    except Exception as e:
+        logger.warning(f"发送进度事件失败: {str(e)}")
 
 def pause_handler():
     """处理暂停命令"""
@@ -0,0 +1,93 @@
+"""
+关键帧抽样
+
+从片段中按时间均匀抽取若干帧，缩小后编码为 JPEG，连同每帧的时间戳一起
+作为内联图片发送给 Gemini。相比上传整段视频，请求体小得多，也不需要等待
+服务端的 PROCESSING 过程，代价是两帧之间的画面会被遗漏。
+"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+from media_probe import get_duration
+
+logger = logging.getLogger(__name__)
+
+FRAMES_PROMPT = (
+    "下面是从一段视频中按时间顺序抽取的画面，每张图片前标注了它在视频中的时间（分:秒）。"
+    "请把这些画面当作连续的视频来分析，start 和 end 使用画面标注的时间。"
+)
+
+
+def format_timestamp(seconds):
+    """秒数转换为 "分:秒" 格式，与分析结果的时间格式一致"""
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def extract_frames(video_path, count, width=640, quality=5):
+    """
+    均匀抽取 count 帧
+
+    Args:
+        video_path: 视频路径
+        count: 抽取的帧数
+        width: 缩放后的宽度
+        quality: JPEG 质量（ffmpeg -q:v，2-31，越小越清晰）
+
+    Returns:
+        list: [(时间秒, JPEG字节)]
+    """
+    duration = get_duration(video_path)
+    if duration <= 0:
+        raise ValueError(f"无法获取视频时长: {video_path}")
+
+    interval = duration / count
+    temp_dir = tempfile.mkdtemp(prefix='frames_')
+    try:
+        # fps 滤镜按固定间隔取帧，一次 ffmpeg 调用输出全部帧
+        cmd = [
+            'ffmpeg', '-v', 'error',
+            '-i', video_path,
+            '-an',
+            '-vf', f'fps=1/{interval:.6f},scale={width}:-2',
+            '-frames:v', str(count),
+            '-q:v', str(quality),
+            os.path.join(temp_dir, 'frame_%04d.jpg')
+        ]
+        result = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            encoding='utf-8',
+            errors='ignore'
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"抽帧失败: {result.stderr.strip()}")
+
+        frames = []
+        for index, filename in enumerate(sorted(os.listdir(temp_dir))):
+            with open(os.path.join(temp_dir, filename), 'rb') as f:
+                frames.append((index * interval, f.read()))
+        return frames
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def build_frame_message(video_path, prompt, count, width=640):
+    """
+    构建带时间戳的图片批量消息，格式为 [说明, 时间, 图片, 时间, 图片, ..., 提示词]
+    """
+    frames = extract_frames(video_path, count, width)
+    total_bytes = sum(len(data) for _, data in frames)
+    logger.info(f"已抽取 {len(frames)} 帧，共 {total_bytes / 1024:.0f}KB")
+
+    message = [FRAMES_PROMPT]
+    for timestamp, data in frames:
+        message.append(f"时间 {format_timestamp(timestamp)}")
+        message.append({'mime_type': 'image/jpeg', 'data': data})
+    message.append(prompt)
+    return message
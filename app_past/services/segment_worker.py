@@ -0,0 +1,415 @@
+"""
+分布式片段任务队列
+
+以 video_segments 表作为任务队列：enqueue 分割视频并把记录标记为 QUEUED，
+任意台机器上的 worker 进程用 SELECT ... FOR UPDATE SKIP LOCKED 领取片段，
+领取时写入租约（lease_expires_at），处理期间后台线程定时续约。worker 崩溃后
+租约过期，片段会被其他 worker 重新领取；超过最大尝试次数的片段标记为 FAILED。
+一个视频的所有片段都结束后，由最后完成的 worker 合并JSON并更新视频记录。
+
+多台机器同时处理时，分割文件和 outputs 目录需要放在所有机器都能访问的共享存储上。
+需要 MySQL 8.0 以上（SKIP LOCKED）。
+
+    python segment_worker.py enqueue --video a.mp4 --image role.png
+    python segment_worker.py work --concurrency 3
+"""
+import argparse
+import os
+import signal
+import socket
+import threading
+
+import google.generativeai as genai
+
+import final_videoprocess as vp
+
+logger = vp.logger
+
+LEASE_SECONDS = 600  # 租约时长（秒），需大于单个片段的心跳间隔
+HEARTBEAT_INTERVAL = 60  # 续约间隔（秒）
+POLL_INTERVAL = 5  # 队列为空时的等待时间（秒）
+MAX_ATTEMPTS = 3  # 单个片段的最大尝试次数
+
+
+def enqueue_video(input_file, character_image_path, character_prompt, video_prompt):
+    """分割视频并加入队列，返回视频记录ID"""
+    video_record_id, segments = vp.prepare_video_record(input_file, character_image_path, vp.SEGMENT_DURATION)
+    if not segments:
+        logger.error(f"视频 {os.path.basename(input_file)} 分割失败，未加入队列")
+        return None
+
+    try:
+        connection = vp.get_db_connection()
+        if not connection:
+            return None
+
+        with connection.cursor() as cursor:
+            sql = """
+                UPDATE video_process_records
+                SET status = 'QUEUED', character_prompt = %s, video_prompt = %s
+                WHERE id = %s
+            """
+            cursor.execute(sql, (character_prompt, video_prompt, video_record_id))
+            connection.commit()
+        logger.info(f"视频 {os.path.basename(input_file)} 已加入队列，记录 {video_record_id}，共 {len(segments)} 个片段")
+        return video_record_id
+    except Exception as e:
+        logger.error(f"加入队列失败: {str(e)}")
+        return None
+    finally:
+        if connection:
+            connection.close()
+
+
+def claim_segment(worker_id, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """
+    领取一个待处理片段
+
+    Returns:
+        dict: 片段和所属视频的信息；队列为空时返回None
+    """
+    try:
+        connection = vp.get_db_connection()
+        if not connection:
+            return None
+
+        with connection.cursor() as cursor:
+            # 被其他 worker 锁住的行直接跳过，多个 worker 同时领取不会互相等待
+            cursor.execute("""
+                SELECT s.id FROM video_segments s
+                JOIN video_process_records r ON r.id = s.video_record_id
+                WHERE r.status = 'QUEUED'
+                  AND s.status IN ('CREATED', 'ANALYZED')
+                  AND (s.lease_expires_at IS NULL OR s.lease_expires_at < NOW())
+                  AND s.attempts < %s
+                ORDER BY s.video_record_id, s.part_number
+                LIMIT 1
+                FOR UPDATE OF s SKIP LOCKED
+            """, (max_attempts,))
+            row = cursor.fetchone()
+            if not row:
+                connection.rollback()
+                return None
+
+            segment_id = row[0]
+            cursor.execute("""
+                UPDATE video_segments
+                SET worker_id = %s, lease_expires_at = NOW() + INTERVAL %s SECOND,
+                    heartbeat_at = NOW(), attempts = attempts + 1
+                WHERE id = %s
+            """, (worker_id, lease_seconds, segment_id))
+            cursor.execute("""
+                SELECT s.id, s.video_record_id, s.part_number, s.segment_path, s.status, s.attempts,
+                       r.video_name, r.total_parts, r.character_image_path, r.character_prompt, r.video_prompt
+                FROM video_segments s
+                JOIN video_process_records r ON r.id = s.video_record_id
+                WHERE s.id = %s
+            """, (segment_id,))
+            columns = [desc[0] for desc in cursor.description]
+            claim = dict(zip(columns, cursor.fetchone()))
+            connection.commit()
+            return claim
+    except Exception as e:
+        logger.error(f"领取片段失败: {str(e)}")
+        return None
+    finally:
+        if connection:
+            connection.close()
+
+
+def renew_lease(segment_id, worker_id, lease_seconds=LEASE_SECONDS):
+    """续约，租约已被其他 worker 接管时返回False；数据库不可用时返回None，由下次心跳重试"""
+    try:
+        connection = vp.get_db_connection()
+        if not connection:
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE video_segments
+                SET lease_expires_at = NOW() + INTERVAL %s SECOND, heartbeat_at = NOW()
+                WHERE id = %s AND worker_id = %s
+            """, (lease_seconds, segment_id, worker_id))
+            connection.commit()
+            return cursor.rowcount == 1
+    except Exception as e:
+        logger.error(f"续约失败: {str(e)}")
+        return None
+    finally:
+        if connection:
+            connection.close()
+
+
+def release_segment(segment_id, worker_id, success, max_attempts=MAX_ATTEMPTS):
+    """释放租约；失败且用完尝试次数的片段标记为 FAILED，否则留给下次领取"""
+    try:
+        connection = vp.get_db_connection()
+        if not connection:
+            return False
+
+        with connection.cursor() as cursor:
+            if success:
+                cursor.execute("""
+                    UPDATE video_segments SET worker_id = NULL, lease_expires_at = NULL
+                    WHERE id = %s AND worker_id = %s
+                """, (segment_id, worker_id))
+            else:
+                cursor.execute("""
+                    UPDATE video_segments
+                    SET worker_id = NULL, lease_expires_at = NULL,
+                        status = IF(attempts >= %s, 'FAILED', status)
+                    WHERE id = %s AND worker_id = %s
+                """, (max_attempts, segment_id, worker_id))
+            connection.commit()
+            return True
+    except Exception as e:
+        logger.error(f"释放片段失败: {str(e)}")
+        return False
+    finally:
+        if connection:
+            connection.close()
+
+
+def reap_expired_segments(max_attempts=MAX_ATTEMPTS):
+    """租约过期且尝试次数已用完的片段（worker 崩溃）标记为 FAILED，返回涉及的 [(视频记录ID, 视频名称)]"""
+    try:
+        connection = vp.get_db_connection()
+        if not connection:
+            return []
+
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT s.id, s.video_record_id, r.video_name FROM video_segments s
+                JOIN video_process_records r ON r.id = s.video_record_id
+                WHERE s.status IN ('CREATED', 'ANALYZED') AND s.lease_expires_at < NOW() AND s.attempts >= %s
+                FOR UPDATE OF s SKIP LOCKED
+            """, (max_attempts,))
+            rows = cursor.fetchall()
+            if rows:
+                cursor.executemany(
+                    "UPDATE video_segments SET status = 'FAILED', worker_id = NULL, lease_expires_at = NULL WHERE id = %s",
+                    [(row[0],) for row in rows]
+                )
+            connection.commit()
+            return sorted({(row[1], row[2]) for row in rows})
+    except Exception as e:
+        logger.error(f"回收过期片段失败: {str(e)}")
+        return []
+    finally:
+        if connection:
+            connection.close()
+
+
+def finalize_video(video_record_id):
+    """
+    所有片段结束后更新视频记录
+
+    Returns:
+        str: 本次调用完成结算时返回最终状态（COMPLETED / FAILED），否则返回None
+    """
+    try:
+        connection = vp.get_db_connection()
+        if not connection:
+            return None
+
+        with connection.cursor() as cursor:
+            # 锁住视频记录，保证只有一个 worker 进行结算
+            cursor.execute("SELECT status FROM video_process_records WHERE id = %s FOR UPDATE", (video_record_id,))
+            row = cursor.fetchone()
+            if not row or row[0] != 'QUEUED':
+                connection.rollback()
+                return None
+
+            cursor.execute("""
+                SELECT COUNT(*),
+                       COALESCE(SUM(status IN ('EXTRACTED', 'SKIPPED')), 0),
+                       COALESCE(SUM(status = 'FAILED'), 0)
+                FROM video_segments WHERE video_record_id = %s
+            """, (video_record_id,))
+            total, done, failed = (int(value) for value in cursor.fetchone())
+
+            status = None
+            if done + failed == total:
+                status = 'COMPLETED' if failed == 0 else 'FAILED'
+                cursor.execute("""
+                    UPDATE video_process_records
+                    SET status = %s, processed_parts = %s, process_end_time = NOW()
+                    WHERE id = %s
+                """, (status, done, video_record_id))
+            else:
+                cursor.execute("UPDATE video_process_records SET processed_parts = %s WHERE id = %s",
+                               (done, video_record_id))
+            connection.commit()
+            return status
+    except Exception as e:
+        logger.error(f"更新视频记录失败: {str(e)}")
+        return None
+    finally:
+        if connection:
+            connection.close()
+
+
+def finish_video(video_record_id, video_name):
+    """结算视频记录，完成结算的 worker 负责合并JSON"""
+    status = finalize_video(video_record_id)
+    if status:
+        logger.info(f"视频 {video_name} 的所有片段已处理完毕，状态: {status}")
+        vp.merge_video_json(os.path.splitext(video_name)[0])
+
+
+class LeaseKeeper:
+    """处理片段期间在后台定时续约"""
+
+    def __init__(self, segment_id, worker_id):
+        self.segment_id = segment_id
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{segment_id}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            renewed = renew_lease(self.segment_id, self.worker_id)
+            if renewed is None:
+                # 数据库暂时不可用时租约仍归本 worker，下次心跳再续约
+                continue
+            if not renewed:
+                self.lost = True
+                logger.warning(f"片段 {self.segment_id} 的租约已丢失，可能已被其他 worker 接管")
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def process_claimed_segment(claim, model, worker_id):
+    """处理领取到的片段，返回是否成功"""
+    part_number = claim['part_number']
+    total_parts = claim['total_parts'] or part_number
+    segment = {'id': claim['id'], 'segment_path': claim['segment_path'], 'status': claim['status']}
+    logger.info(f"[{worker_id}] 领取 {claim['video_name']} Part {part_number}（第 {claim['attempts']} 次尝试）")
+
+    success = False
+    with LeaseKeeper(claim['id'], worker_id) as lease:
+        # 片段状态只在租约仍归本 worker 时写入，失败状态交给 release_segment 决定
+        vp.worker_context.worker_id = worker_id
+        vp.worker_context.lease_lost = lambda: lease.lost
+        try:
+            success = vp.process_segment(
+                claim['segment_path'], model, None, part_number, total_parts, 1, 1,
+                claim['character_prompt'] or vp.DEFAULT_CHARACTER_PROMPT,
+                claim['video_prompt'] or vp.DEFAULT_VIDEO_PROMPT,
+                claim['character_image_path'], segment
+            )
+        except vp.LeaseLost:
+            logger.warning(f"[{worker_id}] 租约已丢失，放弃处理 {os.path.basename(claim['segment_path'])}")
+        except Exception as e:
+            logger.error(f"[{worker_id}] 片段处理异常 {os.path.basename(claim['segment_path'])}: {str(e)}")
+        finally:
+            vp.worker_context.worker_id = None
+            vp.worker_context.lease_lost = None
+
+    # 租约已被其他 worker 接管时由对方负责释放和结算
+    if lease.lost:
+        return False
+    release_segment(claim['id'], worker_id, success)
+    finish_video(claim['video_record_id'], claim['video_name'])
+    return success
+
+
+def run_worker(concurrency=1, worker_name=None, once=False):
+    """
+    启动 worker，每个线程循环领取并处理片段
+
+    Args:
+        concurrency: 本进程同时处理的片段数
+        worker_name: worker 名称前缀，默认为 主机名-进程号
+        once: 队列为空时退出，否则持续等待新任务
+    """
+    if not vp.init_database():
+        raise RuntimeError("数据库初始化失败")
+
+    worker_name = worker_name or f"{socket.gethostname()}-{os.getpid()}"
+    model = genai.GenerativeModel(vp.SELECTED_MODEL)
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info("收到退出信号，处理完当前片段后退出")
+        stop.set()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    def loop(worker_id):
+        while not stop.is_set():
+            claim = claim_segment(worker_id)
+            if claim:
+                process_claimed_segment(claim, model, worker_id)
+                continue
+            # 队列为空时顺带回收崩溃 worker 遗留的片段
+            for video_record_id, video_name in reap_expired_segments():
+                finish_video(video_record_id, video_name)
+            if once:
+                return
+            stop.wait(POLL_INTERVAL)
+
+    threads = [
+        threading.Thread(target=loop, args=(f"{worker_name}-{index}",), name=f"worker-{index}")
+        for index in range(1, concurrency + 1)
+    ]
+    logger.info(f"worker {worker_name} 启动，并发 {concurrency}")
+    for thread in threads:
+        thread.start()
+    # 主线程等待时保持可被信号打断
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+    logger.info(f"worker {worker_name} 已退出")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分布式片段任务队列")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = subparsers.add_parser('enqueue', help="分割视频并加入队列")
+    enqueue_parser.add_argument('--video', action='append', required=True, help="视频路径，可重复指定")
+    enqueue_parser.add_argument('--image', required=True, help="角色图片路径")
+    enqueue_parser.add_argument('--character-prompt-file', help="角色分析提示词文件，默认使用内置提示词")
+    enqueue_parser.add_argument('--video-prompt-file', help="视频分析提示词文件，默认使用内置提示词")
+
+    work_parser = subparsers.add_parser('work', help="启动 worker 处理队列中的片段")
+    work_parser.add_argument('--concurrency', type=int, default=vp.MAX_CONCURRENT_SEGMENTS, help="同时处理的片段数")
+    work_parser.add_argument('--name', help="worker 名称，默认为 主机名-进程号")
+    work_parser.add_argument('--once', action='store_true', help="队列为空时退出")
+
+    args = parser.parse_args()
+
+    if args.command == 'work':
+        run_worker(args.concurrency, args.name, args.once)
+        return 0
+
+    if not vp.init_database():
+        return 1
+    character_prompt = vp.DEFAULT_CHARACTER_PROMPT
+    video_prompt = vp.DEFAULT_VIDEO_PROMPT
+    if args.character_prompt_file:
+        with open(args.character_prompt_file, 'r', encoding='utf-8') as f:
+            character_prompt = f.read()
+    if args.video_prompt_file:
+        with open(args.video_prompt_file, 'r', encoding='utf-8') as f:
+            video_prompt = f.read()
+
+    failed = 0
+    for video in args.video:
+        if not enqueue_video(os.path.abspath(video), os.path.abspath(args.image), character_prompt, video_prompt):
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,120 @@
+"""
+角色出现时间轴索引
+
+合并后的 JSON 中每个 Appearance 带有 start_seconds/end_seconds（在原视频中的绝对时间），
+TimelineIndex 按起点排序后用二分查找回答"t1 到 t2 之间发生了什么"，不需要逐个解析
+"分:秒" 字符串或扫描分段 JSON。数据库中 analysis_results 的同名列和
+(video_record_id, start_seconds) 索引提供同样的查询。
+
+    python timeline_index.py outputs/xxx/splitjson/xxx_all_20240101_120000.json --start 1:00 --end 2:30
+    python timeline_index.py merged.json --keyword 微笑
+"""
+import argparse
+import bisect
+import json
+
+
+def parse_time(value):
+    """解析秒数或 "分:秒" / "时:分:秒" 格式的时间"""
+    if value is None or value == '':
+        return None
+    seconds = 0.0
+    for part in str(value).split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+class TimelineIndex:
+    """
+    按起点排序的区间索引
+
+    Args:
+        appearances: 带 start_seconds/end_seconds 的 Appearance 列表
+    """
+
+    def __init__(self, appearances):
+        self.items = sorted(
+            (item for item in appearances if item.get('start_seconds') is not None),
+            key=lambda item: item['start_seconds']
+        )
+        self.starts = [item['start_seconds'] for item in self.items]
+        # 最长片段时长：查询时起点早于 t1 超过该值的片段不可能与区间重叠
+        self.max_duration = max(
+            (item['end_seconds'] - item['start_seconds'] for item in self.items), default=0.0
+        )
+
+    @classmethod
+    def from_merged_json(cls, path):
+        """从合并后的JSON文件构建索引"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f).get('Appearances', []))
+
+    def between(self, start=None, end=None):
+        """返回与 [start, end] 有重叠的片段，按起点排序"""
+        if not self.items:
+            return []
+        low = 0 if start is None else bisect.bisect_left(self.starts, start - self.max_duration)
+        high = len(self.items) if end is None else bisect.bisect_right(self.starts, end)
+        return [
+            item for item in self.items[low:high]
+            if start is None or item['end_seconds'] >= start
+        ]
+
+    def search(self, keyword, start=None, end=None):
+        """在时间范围内按描述关键词查找片段"""
+        return [item for item in self.between(start, end) if keyword in item.get('description', '')]
+
+
+def query_appearances(connection, video_record_id, start=None, end=None, keyword=None, limit=500):
+    """
+    从 analysis_results 查询片段，使用 (video_record_id, start_seconds) 索引
+
+    Returns:
+        list: [{part_number, clip_number, start, end, start_seconds, end_seconds, description, extracted_clip_path}]
+    """
+    conditions = ["r.video_record_id = %s", "r.start_seconds IS NOT NULL"]
+    params = [video_record_id]
+    if end is not None:
+        conditions.append("r.start_seconds <= %s")
+        params.append(end)
+    if start is not None:
+        conditions.append("r.end_seconds >= %s")
+        params.append(start)
+    if keyword:
+        conditions.append("r.description LIKE %s")
+        params.append(f"%{keyword}%")
+    params.append(limit)
+
+    sql = f"""
+        SELECT s.part_number, r.clip_number, r.start_time, r.end_time, r.start_seconds, r.end_seconds,
+               r.description, r.extracted_clip_path
+        FROM analysis_results r
+        JOIN video_segments s ON s.id = r.segment_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY r.start_seconds
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = ['part_number', 'clip_number', 'start', 'end', 'start_seconds', 'end_seconds',
+                   'description', 'extracted_clip_path']
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询合并JSON中的角色出现片段")
+    parser.add_argument('merged_json', help="merge_json_files 生成的合并JSON")
+    parser.add_argument('--start', help="起始时间（秒或 分:秒）")
+    parser.add_argument('--end', help="结束时间（秒或 分:秒）")
+    parser.add_argument('--keyword', help="描述关键词")
+    args = parser.parse_args()
+
+    index = TimelineIndex.from_merged_json(args.merged_json)
+    start, end = parse_time(args.start), parse_time(args.end)
+    items = index.search(args.keyword, start, end) if args.keyword else index.between(start, end)
+    for item in items:
+        print(json.dumps(item, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
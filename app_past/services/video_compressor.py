@@ -0,0 +1,154 @@
+"""
+上传前的视频压缩
+
+按目标大小计算码率后用 libx264 编码，提供三种模式：
+- fast：单遍 veryfast 预设，带码率上限，速度最快
+- two_pass：两遍编码，文件大小最接近目标
+- crf：CRF 画质优先，用 maxrate/bufsize 限制峰值码率，文件不会超过目标
+
+多个片段同时压缩时，通过信号量限制同时运行的编码进程数，并按核数给每个进程分配
+x264 线程，避免线程数远超核数。编码完成后立即检查文件大小，超出目标时按实际
+码率比例降低码率重新编码，上传前就保证大小合格。
+"""
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+
+from media_probe import get_duration
+
+logger = logging.getLogger(__name__)
+
+CPU_COUNT = os.cpu_count() or 2
+# 同时运行的编码进程数，每个进程分到的 x264 线程数
+MAX_PARALLEL_ENCODES = max(1, CPU_COUNT // 4)
+ENCODE_THREADS = max(1, CPU_COUNT // MAX_PARALLEL_ENCODES)
+
+AUDIO_BITRATE = 128 * 1024
+MIN_VIDEO_BITRATE = 100 * 1024
+CONTAINER_OVERHEAD = 0.03  # 封装开销，计算码率时预留
+SIZE_TOLERANCE = 1.02  # 超过目标大小该比例时重新编码
+MAX_ATTEMPTS = 3
+CRF_VALUE = 23
+
+MODES = ('fast', 'two_pass', 'crf')
+
+_encode_slots = threading.BoundedSemaphore(MAX_PARALLEL_ENCODES)
+
+
+def target_video_bitrate(duration, target_size_mb, audio_bitrate=AUDIO_BITRATE):
+    """根据时长和目标大小计算视频码率（bit/s）"""
+    target_size_bits = target_size_mb * 8 * 1024 * 1024 * (1 - CONTAINER_OVERHEAD)
+    return max(int(target_size_bits / duration - audio_bitrate), MIN_VIDEO_BITRATE)
+
+
+def build_compress_commands(input_file, output_file, video_bitrate, mode, passlog=None):
+    """构建压缩命令，two_pass 模式返回两条命令"""
+    video_args = ['-c:v', 'libx264', '-threads', str(ENCODE_THREADS), '-pix_fmt', 'yuv420p']
+    audio_args = ['-c:a', 'aac', '-b:a', str(AUDIO_BITRATE)]
+    output_args = ['-movflags', '+faststart', '-y', output_file]
+
+    if mode == 'two_pass':
+        rate_args = ['-preset', 'medium', '-b:v', str(video_bitrate), '-passlogfile', passlog]
+        return [
+            ['ffmpeg', '-v', 'error', '-i', input_file] + video_args + rate_args
+            + ['-pass', '1', '-an', '-f', 'null', '-'],
+            ['ffmpeg', '-v', 'error', '-i', input_file] + video_args + rate_args
+            + ['-pass', '2'] + audio_args + output_args,
+        ]
+
+    if mode == 'crf':
+        rate_args = ['-preset', 'medium', '-crf', str(CRF_VALUE),
+                     '-maxrate', str(video_bitrate), '-bufsize', str(video_bitrate * 2)]
+    else:
+        rate_args = ['-preset', 'veryfast', '-b:v', str(video_bitrate),
+                     '-maxrate', str(int(video_bitrate * 1.5)), '-bufsize', str(video_bitrate * 2)]
+    return [['ffmpeg', '-v', 'error', '-i', input_file] + video_args + rate_args + audio_args + output_args]
+
+
+def _run(command):
+    result = subprocess.run(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        encoding='utf-8',
+        errors='ignore'
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"ffmpeg 返回 {result.returncode}")
+
+
+def _encode(input_file, output_file, video_bitrate, mode):
+    passlog_dir = tempfile.mkdtemp(prefix='x264pass_') if mode == 'two_pass' else None
+    try:
+        passlog = os.path.join(passlog_dir, 'pass') if passlog_dir else None
+        with _encode_slots:
+            for command in build_compress_commands(input_file, output_file, video_bitrate, mode, passlog):
+                _run(command)
+    finally:
+        if passlog_dir:
+            for name in os.listdir(passlog_dir):
+                os.remove(os.path.join(passlog_dir, name))
+            os.rmdir(passlog_dir)
+
+
+def compress_video(input_file, output_file, target_size_mb, mode='fast'):
+    """
+    将视频压缩到目标大小以内
+
+    Args:
+        input_file: 输入视频
+        output_file: 输出路径
+        target_size_mb: 目标大小（MB）
+        mode: 压缩模式，fast / two_pass / crf
+
+    Returns:
+        str: 可以直接上传的文件路径；原视频已小于目标大小时返回原视频
+
+    Raises:
+        RuntimeError: 编码失败或多次尝试后仍超过目标大小
+    """
+    if mode not in MODES:
+        raise ValueError(f"不支持的压缩模式: {mode}，可选 {', '.join(MODES)}")
+
+    target_bytes = target_size_mb * 1024 * 1024
+    if os.path.getsize(input_file) <= target_bytes:
+        logger.info(f"原视频已小于 {target_size_mb}MB，无需压缩")
+        return input_file
+
+    # 断点续跑时复用上次合格的压缩结果
+    if (os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(input_file)
+            and 0 < os.path.getsize(output_file) <= target_bytes * SIZE_TOLERANCE):
+        logger.info(f"复用已有的压缩文件: {output_file}")
+        return output_file
+
+    duration = get_duration(input_file)
+    if duration <= 0:
+        raise RuntimeError("无法获取视频时长")
+
+    video_bitrate = target_video_bitrate(duration, target_size_mb)
+    # 先编码到临时文件，大小合格后再替换，中途失败或被取消不会留下可被复用的残缺文件
+    root, ext = os.path.splitext(output_file)
+    temp_file = f"{root}.tmp{ext}"
+    try:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            logger.info(f"压缩模式 {mode}，目标视频比特率：{video_bitrate / 1024:.2f}k（第 {attempt} 次）")
+            _encode(input_file, temp_file, video_bitrate, mode)
+
+            size = os.path.getsize(temp_file)
+            if size <= target_bytes * SIZE_TOLERANCE:
+                os.replace(temp_file, output_file)
+                return output_file
+
+            # 按超出的比例降低码率，再多留5%余量
+            if video_bitrate <= MIN_VIDEO_BITRATE:
+                break
+            logger.warning(f"压缩后 {size / 1024 / 1024:.2f}MB 超过目标 {target_size_mb}MB，降低码率重新压缩")
+            video_bitrate = max(int(video_bitrate * target_bytes / size * 0.95), MIN_VIDEO_BITRATE)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+    raise RuntimeError(f"压缩后仍超过目标大小: {size / 1024 / 1024:.2f}MB")
@@ -0,0 +1,457 @@
+"""
+无界面的视频分析任务
+
+把 final_videoprocess 的分析流程包装成任务：输入视频路径/URL、角色图片和提示词，
+在独立的工作进程池中运行，进度以事件流返回，暂停/继续/取消通过任务状态控制，
+不再依赖 Tkinter 对话框和控制台输入。
+
+命令行：
+    python video_jobs.py run --video a.mp4 --video https://example.com/b.mp4 --image role.png
+    python video_jobs.py serve --port 8010 --input-root inputs
+HTTP 服务也可以直接用 uvicorn 启动：
+    uvicorn video_jobs:app --port 8010
+HTTP 接口没有鉴权，默认只监听本机；接口提交的本地路径只能位于输入目录（API_INPUT_ROOT）内。
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import shutil
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+MAX_JOB_WORKERS = 2  # 同时运行的任务数，每个任务一个工作进程
+JOB_INPUT_DIR = os.path.join('inputs', 'jobs')  # URL 输入的下载目录
+DOWNLOAD_TIMEOUT = 60  # 下载连接超时（秒）
+# HTTP 接口提交的本地路径必须位于该目录内，serve --input-root 可修改
+API_INPUT_ROOT = 'inputs'
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+def is_url(source):
+    return urlparse(source).scheme in ('http', 'https')
+
+
+def check_local_input(source, input_root):
+    """HTTP 接口提交的本地路径必须位于输入目录内，避免读取服务器上的任意文件"""
+    if is_url(source):
+        return
+    root = os.path.realpath(input_root)
+    path = os.path.realpath(source)
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"只允许使用输入目录 {input_root} 内的文件: {source}")
+
+
+def resolve_input(source, work_dir, prefix):
+    """
+    本地路径直接返回，http(s) 地址下载到任务目录后返回本地路径
+
+    Args:
+        prefix: 下载文件名前缀（如输入序号），不同URL的文件名相同时不会互相覆盖
+    """
+    if not is_url(source):
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"文件不存在: {source}")
+        return source
+
+    os.makedirs(work_dir, exist_ok=True)
+    filename = os.path.basename(urlparse(source).path) or uuid.uuid4().hex
+    local_path = os.path.join(work_dir, f"{prefix}_{filename}")
+    logger.info(f"下载输入文件: {source}")
+    with urllib.request.urlopen(source, timeout=DOWNLOAD_TIMEOUT) as response, open(local_path, 'wb') as f:
+        shutil.copyfileobj(response, f, 1024 * 1024)
+    return local_path
+
+
+def _run_job(job_id, params, states, events):
+    """在工作进程中运行一个任务"""
+    # 工作进程中才导入处理模块，父进程（API服务）不需要加载 Gemini 和数据库依赖
+    import final_videoprocess as vp
+
+    vp.job_state_getter = lambda: states.get(job_id, 'running')
+    vp.event_callback = lambda event, data: events.put((job_id, event, data))
+    try:
+        work_dir = os.path.join(JOB_INPUT_DIR, job_id)
+        videos = [resolve_input(video, work_dir, index) for index, video in enumerate(params['videos'], 1)]
+        character_image = resolve_input(params['character_image'], work_dir, 'image')
+        vp.check_pause()
+        return vp.run_analysis(
+            videos,
+            character_image,
+            params.get('character_prompt') or vp.DEFAULT_CHARACTER_PROMPT,
+            params.get('video_prompt') or vp.DEFAULT_VIDEO_PROMPT,
+        )
+    except vp.JobCancelled:
+        # JobCancelled 不跨进程传递，父进程按返回值判断
+        return {'cancelled': True}
+    finally:
+        vp.job_state_getter = None
+        vp.event_callback = None
+
+
+class JobManager:
+    """
+    任务管理：工作进程池执行任务，进度事件通过共享队列回传
+
+    Args:
+        max_workers: 同时运行的任务数
+    """
+
+    def __init__(self, max_workers=MAX_JOB_WORKERS):
+        self.max_workers = max_workers
+        self.jobs = {}
+        self._condition = threading.Condition()
+        self._executor = None
+        self._manager = None
+
+    def _ensure_started(self):
+        # 延迟启动进程池：工作进程以 spawn 方式导入本模块时不会再创建进程池
+        if self._executor is not None:
+            return
+        context = multiprocessing.get_context('spawn')
+        self._manager = context.Manager()
+        self._states = self._manager.dict()
+        self._events = self._manager.Queue()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        self._listener = threading.Thread(target=self._listen, name="job-events", daemon=True)
+        self._listener.start()
+
+    def shutdown(self):
+        """取消所有未完成的任务并关闭进程池"""
+        if self._executor is None:
+            return
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        self._executor.shutdown(wait=True)
+        self._events.put(None)
+        self._listener.join()
+        self._manager.shutdown()
+        self._executor = None
+
+    def submit(self, videos, character_image, character_prompt=None, video_prompt=None):
+        """提交任务，返回任务信息"""
+        if not videos:
+            raise ValueError("至少需要一个视频")
+        self._ensure_started()
+
+        job_id = uuid.uuid4().hex
+        params = {
+            'videos': list(videos),
+            'character_image': character_image,
+            'character_prompt': character_prompt,
+            'video_prompt': video_prompt,
+        }
+        with self._condition:
+            self.jobs[job_id] = {
+                'id': job_id,
+                'status': 'queued',
+                'params': params,
+                'created_at': time.time(),
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                'events': [],
+                'future': None,
+            }
+            self._states[job_id] = 'running'
+            self._add_event(job_id, 'queued', {})
+
+        future = self._executor.submit(_run_job, job_id, params, self._states, self._events)
+        with self._condition:
+            self.jobs[job_id]['future'] = future
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return self.get(job_id)
+
+    def _add_event(self, job_id, event, data):
+        """记录事件并唤醒等待中的订阅者，调用方需持有 _condition"""
+        job = self.jobs[job_id]
+        job['events'].append({'seq': len(job['events']), 'time': time.time(), 'event': event, 'data': data})
+        self._condition.notify_all()
+
+    def _listen(self):
+        while True:
+            item = self._events.get()
+            if item is None:
+                return
+            job_id, event, data = item
+            if event is None:
+                self._finish(job_id)
+                continue
+            with self._condition:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    continue
+                if job['status'] == 'queued':
+                    job['status'] = 'running'
+                self._add_event(job_id, event, data)
+
+    def _on_done(self, job_id, future):
+        # 经由事件队列结束任务，保证工作进程发出的事件都排在结束事件之前
+        self._events.put((job_id, None, None))
+
+    def _finish(self, job_id):
+        with self._condition:
+            job = self.jobs[job_id]
+            future = job['future']
+            job['finished_at'] = time.time()
+            if future.cancelled():
+                job['status'] = 'cancelled'
+            elif future.exception() is not None:
+                job['status'] = 'failed'
+                job['error'] = str(future.exception())
+            elif (future.result() or {}).get('cancelled'):
+                job['status'] = 'cancelled'
+            else:
+                job['status'] = 'completed'
+                job['result'] = future.result()
+            self._add_event(job_id, job['status'], {'error': job['error']} if job['error'] else {})
+
+    def get(self, job_id):
+        """任务信息（不含事件列表）"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        info = {k: v for k, v in job.items() if k not in ('events', 'future')}
+        info['event_count'] = len(job['events'])
+        return info
+
+    def list(self):
+        return [self.get(job_id) for job_id in self.jobs]
+
+    def _set_state(self, job_id, state, status, event):
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] in TERMINAL_STATUSES:
+                return self.get(job_id)
+            self._states[job_id] = state
+            job['status'] = status
+            self._add_event(job_id, event, {})
+        return self.get(job_id)
+
+    def pause(self, job_id):
+        """暂停任务：处理中的步骤完成后在下一个检查点等待"""
+        return self._set_state(job_id, 'paused', 'paused', 'paused')
+
+    def resume(self, job_id):
+        return self._set_state(job_id, 'running', 'running', 'resumed')
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接取消，运行中的在下一个检查点退出"""
+        job = self.jobs.get(job_id)
+        if job is not None and job['future'] is not None and job['future'].cancel():
+            return self.get(job_id)
+        return self._set_state(job_id, 'cancelled', 'cancelling', 'cancelling')
+
+    def iter_events(self, job_id, since=0, timeout=None):
+        """
+        按顺序返回任务事件，直到任务结束
+
+        Args:
+            since: 从第几个事件开始
+            timeout: 等待新事件的最长时间（秒），超时后结束
+        """
+        index = since
+        while True:
+            with self._condition:
+                job = self.jobs[job_id]
+                if index >= len(job['events']):
+                    if job['status'] in TERMINAL_STATUSES:
+                        return
+                    if not self._condition.wait(timeout=timeout) and timeout is not None:
+                        return
+                    continue
+                pending = job['events'][index:]
+            for event in pending:
+                yield event
+            index += len(pending)
+
+
+job_manager = JobManager()
+
+
+class JobRequest(BaseModel):
+    videos: List[str]
+    character_image: str
+    character_prompt: Optional[str] = None
+    video_prompt: Optional[str] = None
+
+
+app = FastAPI(
+    title="视频分析任务API",
+    description="提交视频分析任务，查询进度，暂停/继续/取消任务",
+    version="1.0.0"
+)
+
+
+@app.on_event("shutdown")
+def shutdown_jobs():
+    job_manager.shutdown()
+
+
+def _get_job_or_404(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@app.post("/jobs")
+def create_job(request: JobRequest):
+    try:
+        for source in request.videos + [request.character_image]:
+            check_local_input(source, API_INPUT_ROOT)
+        return job_manager.submit(request.videos, request.character_image,
+                                  request.character_prompt, request.video_prompt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/jobs")
+def list_jobs():
+    return job_manager.list()
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    return _get_job_or_404(job_id)
+
+
+@app.get("/jobs/{job_id}/events")
+def stream_job_events(job_id: str, since: int = 0):
+    """以 Server-Sent Events 推送任务事件，任务结束后关闭连接"""
+    _get_job_or_404(job_id)
+
+    def generate():
+        # 每30秒没有新事件时发送注释行，保持连接
+        position = since
+        while True:
+            received = False
+            for event in job_manager.iter_events(job_id, position, timeout=30):
+                received = True
+                position = event['seq'] + 1
+                yield f"id: {event['seq']}\nevent: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if job_manager.get(job_id)['status'] in TERMINAL_STATUSES:
+                return
+            if not received:
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+@app.post("/jobs/{job_id}/pause")
+def pause_job(job_id: str):
+    _get_job_or_404(job_id)
+    return job_manager.pause(job_id)
+
+
+@app.post("/jobs/{job_id}/resume")
+def resume_job(job_id: str):
+    _get_job_or_404(job_id)
+    return job_manager.resume(job_id)
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    _get_job_or_404(job_id)
+    return job_manager.cancel(job_id)
+
+
+@app.get("/videos/{video_record_id}/appearances")
+def query_video_appearances(video_record_id: int, start: Optional[str] = None, end: Optional[str] = None,
+                            keyword: Optional[str] = None, limit: int = 500):
+    """按时间段（秒或 分:秒）和/或描述关键词查询视频中的角色出现片段"""
+    # 查询时才导入，只提交任务的服务不需要数据库连接
+    from final_videoprocess import get_db_connection
+    from timeline_index import parse_time, query_appearances
+
+    try:
+        start_seconds, end_seconds = parse_time(start), parse_time(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="时间格式错误，应为秒数或 分:秒")
+
+    connection = get_db_connection()
+    if not connection:
+        raise HTTPException(status_code=503, detail="数据库连接失败")
+    try:
+        return query_appearances(connection, video_record_id, start_seconds, end_seconds, keyword, limit)
+    finally:
+        connection.close()
+
+
+def run_cli(args):
+    """在命令行运行一个任务并输出进度，Ctrl+C 取消任务"""
+    character_prompt = None
+    video_prompt = None
+    if args.character_prompt_file:
+        with open(args.character_prompt_file, 'r', encoding='utf-8') as f:
+            character_prompt = f.read()
+    if args.video_prompt_file:
+        with open(args.video_prompt_file, 'r', encoding='utf-8') as f:
+            video_prompt = f.read()
+
+    job = job_manager.submit(args.video, args.image, character_prompt, video_prompt)
+    job_id = job['id']
+    print(f"任务已提交: {job_id}", flush=True)
+
+    def on_interrupt(signum, frame):
+        print("正在取消任务...", flush=True)
+        job_manager.cancel(job_id)
+
+    signal.signal(signal.SIGINT, on_interrupt)
+    try:
+        for event in job_manager.iter_events(job_id):
+            print(json.dumps(event, ensure_ascii=False), flush=True)
+    finally:
+        job_manager.shutdown()
+    return 0 if job_manager.get(job_id)['status'] == 'completed' else 1
+
+
+def main():
+    global API_INPUT_ROOT
+    parser = argparse.ArgumentParser(description="视频分析任务")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="运行一个分析任务并输出进度事件")
+    run_parser.add_argument('--video', action='append', required=True, help="视频路径或URL，可重复指定")
+    run_parser.add_argument('--image', required=True, help="角色图片路径或URL")
+    run_parser.add_argument('--character-prompt-file', help="角色分析提示词文件，默认使用内置提示词")
+    run_parser.add_argument('--video-prompt-file', help="视频分析提示词文件，默认使用内置提示词")
+    run_parser.add_argument('--workers', type=int, default=1, help="工作进程数")
+
+    serve_parser = subparsers.add_parser('serve', help="启动任务API服务")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="监听地址，接口没有鉴权，默认只允许本机访问")
+    serve_parser.add_argument('--port', type=int, default=8010)
+    serve_parser.add_argument('--input-root', default=API_INPUT_ROOT, help="接口允许读取的本地输入目录")
+    serve_parser.add_argument('--workers', type=int, default=MAX_JOB_WORKERS, help="同时运行的任务数")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    job_manager.max_workers = args.workers
+
+    if args.command == 'run':
+        return run_cli(args)
+
+    API_INPUT_ROOT = args.input_root
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())